@@ -60,6 +60,16 @@ class MockDetector(det.Detector):
         return self.name
 
 
+def without_timings(data):
+    """Remove timing information (that differs between runs) from results."""
+    data = dict(data)
+    data.pop('timing', None)
+    data.pop('timings', None)
+    if 'images' in data:
+        data['images'] = [without_timings(image) for image in data['images']]
+    return data
+
+
 @pytest.fixture()
 def mock_detector():
     return MockDetector({
@@ -83,6 +93,14 @@ def mock_detector():
     })
 
 
+@pytest.fixture(autouse=True)
+def detection_cache_dir(tmpdir, monkeypatch):
+    """Keep detection cache of each test in its own temporary directory."""
+    cache_dir = tmpdir.join('detection_cache')
+    monkeypatch.setenv('WENTRAL_CACHE_DIR', str(cache_dir))
+    return cache_dir
+
+
 @pytest.fixture()
 def webservice(mock_detector):
     """Mock object detection web service."""
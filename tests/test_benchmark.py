@@ -20,9 +20,22 @@
 
 """Tests for the benchmarking code."""
 
+import copy
+import functools
+import os
+import random
+from unittest import mock
+
+import numpy as np
+from PIL import Image
 import pytest
 
 import wentral.benchmark as bm
+import wentral.dataset as ds
+import wentral.detection_cache as dc
+import wentral.results as res
+
+import conftest
 
 
 # Data for PRC, IPRC and mAP tests.
@@ -130,6 +143,126 @@ def test_evaluate(dataset, mock_detector):
     assert_match_set(result, 4, 2, 4, 0.5, 4 / 6, 0.75)
 
 
+def test_evaluate_streaming(dataset, mock_detector):
+    """Evaluation without stored match sets has the same statistics."""
+    full = bm.evaluate(dataset, mock_detector)
+    streaming = bm.evaluate(dataset, mock_detector, keep_matchsets=False)
+    assert streaming.matchsets == []
+    assert streaming.image_count == full.image_count == 3
+    assert_match_set(streaming, full.tp, full.fn, full.fp, full.precision,
+                     full.recall, full.mAP)
+
+
+def test_evaluation_incremental(dataset, mock_detector):
+    matchsets = list(bm.match_detections(dataset, mock_detector))
+    evaluation = bm.Evaluation(dataset, mock_detector)
+    for i, ms in enumerate(matchsets):
+        evaluation.add_matchset(ms)
+        expect = bm.Evaluation(dataset, mock_detector, matchsets[:i + 1])
+        assert evaluation.to_dict() == expect.to_dict()
+        assert evaluation.mAP == bm.average_precision(
+            np.concatenate([ms.detections for ms in matchsets[:i + 1]]),
+            np.concatenate([ms.ground_truth for ms in matchsets[:i + 1]]),
+        )
+
+
+def test_threshold_sweep(dataset, mock_detector):
+    """Metrics from the sweep are the same as from re-running evaluation."""
+    sweep = bm.evaluate(dataset, mock_detector).threshold_sweep()
+    assert [row['confidence_threshold'] for row in sweep] == [
+        0.9, 0.8, 0.7, 0.6,
+    ]
+    for row in sweep:
+        result = bm.evaluate(dataset, mock_detector,
+                             confidence_threshold=row['confidence_threshold'])
+        assert (row['tp'], row['fp'], row['fn']) == (
+            result.tp, result.fp, result.fn,
+        )
+        assert row['precision'] == result.precision
+        assert row['recall'] == result.recall
+        assert row['f1'] == result.f1
+
+
+def test_best_f1_threshold(dataset, mock_detector):
+    best = bm.evaluate(dataset, mock_detector).best_f1_threshold()
+    assert best['confidence_threshold'] == 0.8
+    assert best['f1'] == pytest.approx(0.8, 0.001)
+    assert bm.Evaluation(None, None).best_f1_threshold() is None
+
+
+def test_multi_iou_map(dataset, mock_detector):
+    """AP at multiple IoUs is the same as from separate evaluations."""
+    ious = [0.1, 0.4, 0.95]
+    result = bm.evaluate(dataset, mock_detector, map_ious=ious)
+    assert list(result.ap_by_iou) == ious
+    for iou in ious:
+        expect = bm.evaluate(dataset, mock_detector, match_iou=iou)
+        assert result.ap_by_iou[iou] == expect.mAP
+    assert result.multi_iou_mAP == pytest.approx((0.95 + 0.75 + 0.593) / 3,
+                                                 0.001)
+    assert result.to_dict()['multi_iou_mAP'] == result.multi_iou_mAP
+
+
+def test_multi_iou_map_absent(dataset, mock_detector):
+    result = bm.evaluate(dataset, mock_detector)
+    assert result.ap_by_iou == {}
+    assert result.multi_iou_mAP is None
+    assert 'multi_iou_mAP' not in result.to_dict()
+
+
+class BatchMockDetector(conftest.MockDetector):
+    """Mock detector that returns batch results in reverse order."""
+
+    def __init__(self, answers):
+        super().__init__(answers)
+        self.batches = []
+
+    def batch_detect(self, images, **kw):
+        self.batches.append([path for _, path in images])
+        results = list(super().batch_detect(images, **kw))
+        return reversed(results)
+
+
+@pytest.mark.parametrize('batch_size,expect_batches', [
+    (2, [['0.png', '1.png']]),  # The last image is passed to `detect`.
+    (3, [['0.png', '1.png', '2.png']]),
+    (5, [['0.png', '1.png', '2.png']]),
+])
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_evaluate_batches(dataset, mock_detector, batch_size, expect_batches,
+                          jobs):
+    expect = bm.evaluate(dataset, mock_detector)
+    detector = BatchMockDetector(mock_detector.answers)
+    result = bm.evaluate(dataset, detector, batch_size=batch_size, jobs=jobs)
+    assert conftest.without_timings(result.to_dict())['images'] == \
+        conftest.without_timings(expect.to_dict())['images']
+    assert result.mAP == expect.mAP
+    if jobs == 1:
+        assert [[os.path.basename(p) for p in batch]
+                for batch in detector.batches] == expect_batches
+        assert len(detector.log) == 3
+
+
+def test_evaluate_parallel(dataset, mock_detector):
+    serial = bm.evaluate(dataset, mock_detector)
+    parallel = bm.evaluate(dataset, mock_detector, jobs=2)
+    assert conftest.without_timings(parallel.to_dict()) == \
+        conftest.without_timings(serial.to_dict())
+
+
+def test_evaluate_parallel_factory(dataset, mock_detector):
+    serial = bm.evaluate(dataset, mock_detector)
+    factory = functools.partial(copy.copy, mock_detector)
+    parallel = bm.evaluate(dataset, None, jobs=3, detector_factory=factory)
+    assert parallel.tp == serial.tp
+    assert parallel.fp == serial.fp
+    assert [
+        conftest.without_timings(ms.to_dict()) for ms in parallel.matchsets
+    ] == [
+        conftest.without_timings(ms.to_dict()) for ms in serial.matchsets
+    ]
+
+
 @pytest.mark.parametrize('conf,iou,expect', [
     # High confidence threshold.
     (0.8, 0.4, (4, 2, 0, 4 / 4, 4 / 6, 0.75)),
@@ -144,3 +277,273 @@ def test_evaluate_iou(dataset, mock_detector, conf, iou, expect):
     result = bm.evaluate(dataset, mock_detector, confidence_threshold=conf,
                          match_iou=iou)
     assert_match_set(result, *expect)
+
+
+def _random_boxes(rnd, count, with_confidence):
+    boxes = []
+    for _ in range(count):
+        x0 = rnd.randint(0, 90)
+        y0 = rnd.randint(0, 90)
+        box = (x0, y0, x0 + rnd.randint(1, 30), y0 + rnd.randint(1, 30))
+        if with_confidence:
+            box += (round(rnd.random(), 1),)
+        boxes.append(box)
+    return boxes
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('match_iou', [0.1, 0.4, 0.7])
+@pytest.mark.parametrize('det_count,gt_count', [(60, 20), (0, 5), (5, 0)])
+def test_matchers_agree(seed, match_iou, det_count, gt_count):
+    """Numpy and pure Python matchers produce the same results."""
+    rnd = random.Random(seed)
+    detections = _random_boxes(rnd, det_count, True)
+    ground_truth = _random_boxes(rnd, gt_count, False)
+    results = [
+        bm.MatchSet('foo.png', list(detections), list(ground_truth),
+                    confidence_threshold=0.5, match_iou=match_iou,
+                    map_ious=[0.3, 0.5, 0.9], matcher=matcher)
+        for matcher in ['numpy', 'python']
+    ]
+    assert results[0].to_dict() == results[1].to_dict()
+
+
+def test_matchset_arrays():
+    """Match set stores boxes in structured arrays, input is not modified."""
+    detections = [(10, 10, 20, 20, 0.5), (0, 0, 10, 10, 0.9)]
+    ground_truth = [(0, 0, 10, 10), (50, 50, 60, 60)]
+    ms = bm.MatchSet('foo.png', detections, ground_truth,
+                     confidence_threshold=0.5, match_iou=0.5)
+    assert detections == [(10, 10, 20, 20, 0.5), (0, 0, 10, 10, 0.9)]
+    assert ground_truth == [(0, 0, 10, 10), (50, 50, 60, 60)]
+    assert ms.detections.dtype == bm.DETECTION_DTYPE
+    assert ms.ground_truth.dtype == bm.GROUND_TRUTH_DTYPE
+    assert ms.detections.tolist() == [
+        (0, 0, 10, 10, 0.9, True),
+        (10, 10, 20, 20, 0.5, False),
+    ]
+    assert ms.ground_truth.tolist() == [(0, 0, 10, 10, 0.9),
+                                        (50, 50, 60, 60, 0)]
+    assert bm.MatchSet.from_dict(ms.to_dict()).to_dict() == ms.to_dict()
+
+
+@pytest.mark.parametrize('threshold', [0.1, 0.5, 0.75, 0.95])
+def test_matchset_repartition(threshold):
+    """Repartitioning gives the same split as matching at that threshold."""
+    rng = random.Random(1)
+    detections = [(x, x, x + 10, x + 10, rng.random())
+                  for x in range(0, 90, 3)]
+    ground_truth = [(x, x, x + 10, x + 10) for x in range(0, 100, 5)]
+    ms = bm.MatchSet('foo.png', detections, ground_truth,
+                     confidence_threshold=0.5, match_iou=0.5)
+    assert ms.true_detections is ms.true_detections
+    ms.repartition(threshold)
+    expect = bm.MatchSet('foo.png', detections, ground_truth,
+                         confidence_threshold=threshold, match_iou=0.5)
+    assert ms.to_dict() == expect.to_dict()
+    for name in ['detected_ground_truth', 'missed_ground_truth',
+                 'true_detections', 'false_detections']:
+        assert getattr(ms, name) == getattr(expect, name)
+    assert ms.tp == len(ms.detected_ground_truth)
+    assert ms.fn == len(ms.missed_ground_truth)
+    assert ms.fp == len(ms.false_detections)
+
+
+def test_ap_arrays():
+    """AP is the same for detection tuples and a structured array."""
+    records = np.array([(0, 0, 1, 1, c, t) for c, t in DETECTIONS],
+                       dtype=bm.DETECTION_DTYPE)
+    assert bm.average_precision(records, GROUND_TRUTH) == \
+        bm.average_precision(DETECTIONS, GROUND_TRUTH)
+
+
+def test_confidence_counts(monkeypatch):
+    """Buffered counts are aggregated into the same totals."""
+    monkeypatch.setattr(bm._ConfidenceCounts, 'BUFFER_SIZE', 3)
+    counts = bm._ConfidenceCounts()
+    for i in range(0, len(DETECTIONS), 2):
+        confidence, is_true = zip(*DETECTIONS[i:i + 2])
+        counts.add(np.array(confidence), np.array(is_true))
+    expect = bm._count_by_confidence(*zip(*DETECTIONS))
+    for got, exp in zip(counts.counts, expect):
+        assert got.tolist() == exp.tolist()
+    assert expect[0].tolist() == [0.9, 0.8, 0.7, 0.6, 0.5, 0.4, 0.3, 0.2,
+                                  0.1]
+    assert expect[2].tolist() == [0, 0, 1, 2, 0, 0, 1, 1, 0]
+
+
+def test_timings(dataset, mock_detector):
+    """Each image has stage timings and the summary has their statistics."""
+    result = bm.evaluate(dataset, mock_detector)
+    for ms in result.matchsets:
+        assert sorted(ms.timings) == ['convert', 'decode', 'detect', 'match']
+        assert all(t['wall'] >= 0 and t['cpu'] >= 0
+                   for t in ms.timings.values())
+        assert ms.pixels == 100 * 100
+
+    assert result.pixel_count == 3 * 100 * 100
+    assert result.wall_time > 0
+    assert result.images_per_second == 3 / result.wall_time
+    timing = result.to_dict()['timing']
+    assert timing['megapixels_per_second'] == 0.03 / result.wall_time
+    assert list(timing['stages']) == ['decode', 'convert', 'detect', 'match']
+    for stage in timing['stages'].values():
+        assert stage['count'] == 3
+        assert 0 <= stage['p50'] <= stage['p90'] <= stage['p99']
+
+
+def test_timings_cached(dataset, mock_detector, tmpdir):
+    """Stages skipped thanks to the detection cache have no timings."""
+    cache = dc.DetectionCache(str(tmpdir.join('cache')))
+    bm.evaluate(dataset, mock_detector, detection_cache=cache)
+    result = bm.evaluate(dataset, mock_detector, detection_cache=cache)
+    for ms in result.matchsets:
+        assert list(ms.timings) == ['match']
+
+
+@pytest.mark.parametrize('extensions', [
+    ['.json', '.json'],
+    ['.jsonl', '.wbin', '.json'],
+])
+def test_merge(dataset, mock_detector, tmpdir, extensions):
+    """Merged results of the shards are the same as for the whole dataset."""
+    ious = [0.1, 0.4]
+    expect = bm.evaluate(dataset, mock_detector, map_ious=ious)
+    shard_count = len(extensions)
+    paths = []
+    for shard, extension in enumerate(extensions, 1):
+        sharded = ds.ShardedDataset(dataset, shard, shard_count)
+        evaluation = bm.evaluate(sharded, mock_detector, map_ious=ious)
+        evaluation.shard = (shard, shard_count)
+        paths.append(str(tmpdir.join('shard{}{}'.format(shard, extension))))
+        writer = res.ResultsWriter(paths[-1])
+        for ms in evaluation.matchsets:
+            writer.add_matchset(ms)
+        writer.write(evaluation)
+
+    merged = bm.merge(paths)
+    summary = conftest.without_timings(merged.summary_dict(True))
+    assert summary == conftest.without_timings(expect.summary_dict(True))
+    assert merged.wall_time is not None
+    assert sorted(ms.image_name for ms in merged.matchsets) == \
+        sorted(ms.image_name for ms in expect.matchsets)
+
+
+def test_merge_invalid(dataset, mock_detector, tmpdir):
+    evaluation = bm.evaluate(dataset, mock_detector)
+    evaluation.shard = (1, 2)
+    path = str(tmpdir.join('shard.json'))
+    with open(path, 'wt') as out_file:
+        evaluation.json_dump(out_file)
+    with pytest.raises(Exception, match='not for a different shard'):
+        bm.merge([path, path])
+
+
+@pytest.mark.parametrize('params', [
+    {'confidence_threshold': 0.7},
+    {'match_iou': 0.6},
+    {'map_ious': [0.5, 0.7]},
+])
+@pytest.mark.parametrize('in_summary', [True, False])
+def test_merge_params(dataset, mock_detector, tmpdir, params, in_summary):
+    """Shards with different matching parameters are not merged."""
+    paths = []
+    # With 3 shards, shards 2 and 3 both contain some images.
+    for shard, shard_params in [(2, {}), (3, params)]:
+        evaluation = bm.evaluate(ds.ShardedDataset(dataset, shard, 3),
+                                 mock_detector, **shard_params)
+        evaluation.shard = (shard, 3)
+        if not in_summary:  # Older results only have them in the images.
+            evaluation.match_params = None
+        paths.append(str(tmpdir.join('shard{}.json'.format(shard))))
+        with open(paths[-1], 'wt') as out_file:
+            evaluation.json_dump(out_file)
+    with pytest.raises(Exception, match='different parameters'):
+        bm.merge(paths)
+
+
+def test_pixel_free(dataset, mock_detector, tmpdir, monkeypatch):
+    """Images are not opened for detectors that don't need pixels."""
+    expect = bm.evaluate(dataset, mock_detector)
+    mock_detector.needs_pixels = False
+
+    def no_open(path):
+        raise AssertionError('Opened ' + path)
+
+    cache = dc.DetectionCache(str(tmpdir.join('cache')))
+    monkeypatch.setattr(ds.PIL.Image, 'open', no_open)
+    result = bm.evaluate(dataset, mock_detector, detection_cache=cache)
+    assert conftest.without_timings(result.to_dict()) == \
+        conftest.without_timings(dict(expect.to_dict(), images=[
+            dict(ms, pixels=None) for ms in expect.to_dict()['images']
+        ]))
+    for ms in result.matchsets:
+        assert list(ms.timings) == ['detect', 'match']
+    assert result.megapixels_per_second is None
+    assert cache.size == 0
+
+    # Visualization still needs the images.
+    monkeypatch.undo()
+    vis_path = tmpdir.mkdir('vis')
+    result = bm.evaluate(dataset, mock_detector,
+                         visualizations_path=str(vis_path))
+    assert result.pixel_count == 3 * 100 * 100
+    assert vis_path.join('0.png').check()
+
+
+def test_reduced_input(dataset, mock_detector, tmpdir):
+    """Detectors with small input size get reduced images."""
+    expect = bm.evaluate(dataset, mock_detector)
+    sizes = []
+
+    class SmallInputDetector:
+        input_size = (50, 40)
+
+        def detect(self, image, image_path, **kw):
+            sizes.append(image.size)
+            scale = image.size[0] / 100
+            return [
+                tuple(c * scale for c in box[:4]) + box[4:]
+                for box in mock_detector.detect(image, image_path, **kw)
+            ]
+
+    detector = SmallInputDetector()
+    result = bm.evaluate(dataset, detector)
+    assert sizes == [(50, 50)] * 3
+    assert conftest.without_timings(result.to_dict()) == \
+        conftest.without_timings(dict(expect.to_dict(), detector=mock.ANY))
+    assert result.pixel_count == 3 * 100 * 100
+
+    # Visualization doesn't change the input of the detector but the images
+    # are saved at full resolution.
+    for prefetch in [0, 2]:
+        sizes.clear()
+        vis_path = tmpdir.mkdir('vis{}'.format(prefetch))
+        vis_result = bm.evaluate(dataset, detector,
+                                 visualizations_path=str(vis_path),
+                                 prefetch=prefetch)
+        assert sizes == [(50, 50)] * 3
+        assert conftest.without_timings(vis_result.to_dict()) == \
+            conftest.without_timings(result.to_dict())
+        with Image.open(str(vis_path.join('0.png'))) as vis_image:
+            assert vis_image.size == (100, 100)
+
+
+def test_prefetch_cached(dataset, mock_detector, tmpdir, monkeypatch):
+    """Images with cached detections are not decoded ahead."""
+    decoded = []
+    decode = ds._decode
+    monkeypatch.setattr(ds, '_decode', lambda image_data, input_size: (
+        decoded.append(image_data[1]) or decode(image_data, input_size)
+    ))
+    expect = bm.evaluate(dataset, mock_detector)
+    cache = dc.DetectionCache(str(tmpdir.join('cache')))
+    for _ in range(2):
+        result = bm.evaluate(dataset, mock_detector, detection_cache=cache,
+                             prefetch=2)
+        assert conftest.without_timings(result.to_dict()) == \
+            conftest.without_timings(expect.to_dict())
+    assert len(decoded) == 3  # Only in the first run.
+    assert len(mock_detector.log) == 3 * 2
+    for ms in result.matchsets:
+        assert list(ms.timings) == ['match']
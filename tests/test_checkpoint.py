@@ -0,0 +1,140 @@
+# Copyright (C) 2019-present eyeo GmbH
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests for benchmark checkpoints."""
+
+import itertools
+import json
+import os
+
+import pytest
+
+import wentral.benchmark as bm
+import wentral.checkpoint as cp
+import wentral.dataset as ds
+
+import conftest
+
+
+@pytest.fixture()
+def checkpoint_path(tmpdir):
+    return str(tmpdir.join('checkpoint.jsonl'))
+
+
+def interrupted_run(dataset, detector, checkpoint_path, image_count):
+    """Run the benchmark but stop after `image_count` images."""
+    checkpoint = cp.Checkpoint(checkpoint_path)
+    matchsets = bm.match_detections(dataset, detector, checkpoint=checkpoint)
+    list(itertools.islice(matchsets, image_count))
+    checkpoint.close()
+
+
+def test_checkpoint_log(dataset, mock_detector, checkpoint_path):
+    checkpoint = cp.Checkpoint(checkpoint_path)
+    evaluation = bm.evaluate(dataset, mock_detector, checkpoint=checkpoint)
+    checkpoint.close()
+
+    with open(checkpoint_path) as f:
+        records = [json.loads(line) for line in f]
+    assert records[0] == {
+        'detector': 'mock-detector',
+        'params': {
+            'confidence_threshold': 0.5,
+            'match_iou': 0.4,
+            'map_ious': None,
+        },
+    }
+    assert [bm.MatchSet.from_dict(r).to_dict() for r in records[1:]] == [
+        ms.to_dict() for ms in evaluation.matchsets
+    ]
+
+
+@pytest.mark.parametrize('done_count', [0, 1, 2, 3])
+def test_resume(dataset, mock_detector, checkpoint_path, done_count):
+    expect = bm.evaluate(dataset, mock_detector)
+    mock_detector.log = []
+
+    interrupted_run(dataset, mock_detector, checkpoint_path, done_count)
+    assert len(mock_detector.log) == done_count
+
+    checkpoint = cp.Checkpoint(checkpoint_path, resume=True)
+    result = bm.evaluate(dataset, mock_detector, checkpoint=checkpoint)
+    checkpoint.close()
+
+    assert len(mock_detector.log) == 3  # Each image was processed once.
+    assert conftest.without_timings(result.to_dict()) == \
+        conftest.without_timings(expect.to_dict())
+
+    # Resuming again produces the same result without running the detector.
+    checkpoint = cp.Checkpoint(checkpoint_path, resume=True)
+    result = bm.evaluate(dataset, mock_detector, checkpoint=checkpoint)
+    checkpoint.close()
+    assert len(mock_detector.log) == 3
+    assert conftest.without_timings(result.to_dict()) == \
+        conftest.without_timings(expect.to_dict())
+
+
+def test_resume_broken_record(dataset, mock_detector, checkpoint_path):
+    expect = bm.evaluate(dataset, mock_detector)
+    interrupted_run(dataset, mock_detector, checkpoint_path, 2)
+    with open(checkpoint_path, 'ab') as f:
+        f.write(b'{"image_name": "2.p')  # Interrupted while writing.
+
+    checkpoint = cp.Checkpoint(checkpoint_path, resume=True)
+    result = bm.evaluate(dataset, mock_detector, checkpoint=checkpoint)
+    checkpoint.close()
+    assert conftest.without_timings(result.to_dict()) == \
+        conftest.without_timings(expect.to_dict())
+
+    with open(checkpoint_path) as f:
+        assert len([json.loads(line) for line in f]) == 4
+
+
+def test_resume_other_params(dataset, mock_detector, checkpoint_path):
+    interrupted_run(dataset, mock_detector, checkpoint_path, 2)
+    checkpoint = cp.Checkpoint(checkpoint_path, resume=True)
+    with pytest.raises(Exception, match='different detector or parameters'):
+        bm.evaluate(dataset, mock_detector, checkpoint=checkpoint,
+                    match_iou=0.8)
+
+
+def test_no_resume_overwrites(dataset, mock_detector, checkpoint_path):
+    interrupted_run(dataset, mock_detector, checkpoint_path, 2)
+    interrupted_run(dataset, mock_detector, checkpoint_path, 1)
+    with open(checkpoint_path) as f:
+        assert len(f.readlines()) == 2
+
+
+def test_resume_prefetch(dataset, mock_detector, checkpoint_path,
+                         monkeypatch):
+    """Images that are already in the checkpoint are not decoded ahead."""
+    interrupted_run(dataset, mock_detector, checkpoint_path, 2)
+    decoded = []
+    decode = ds._decode
+    monkeypatch.setattr(ds, '_decode', lambda image_data, input_size: (
+        decoded.append(image_data[1]) or decode(image_data, input_size)
+    ))
+    checkpoint = cp.Checkpoint(checkpoint_path, resume=True)
+    result = bm.evaluate(dataset, mock_detector, checkpoint=checkpoint,
+                         prefetch=2)
+    checkpoint.close()
+    assert len(result.matchsets) == 3
+    assert [os.path.basename(path) for path in decoded] == ['2.png']
@@ -21,6 +21,7 @@
 """Tests for the command line interface."""
 
 import json
+import re
 
 import pytest
 
@@ -35,6 +36,15 @@ mAP: 75.00%
 """
 
 
+def strip_timing(output):
+    """Remove throughput and latencies (that vary) from benchmark output."""
+    return re.sub(
+        r'^(Throughput: .*|Latency \(ms\) .*|(decode|convert|detect|match|'
+        r'visualize) .*)\n',
+        '', output, flags=re.MULTILINE,
+    )
+
+
 @pytest.mark.script_launch_mode('inprocess')
 def test_server(script_runner, dataset_dir, webservice):
     """Test with -d server and --server-url."""
@@ -45,10 +55,29 @@ def test_server(script_runner, dataset_dir, webservice):
         str(dataset_dir),
     )
     assert result.success
-    assert result.stdout == MOCK_BM_OUTPUT
+    assert strip_timing(result.stdout) == MOCK_BM_OUTPUT
     assert result.stderr == ''
 
 
+@pytest.mark.script_launch_mode('inprocess')
+def test_timing(script_runner, dataset_dir, webservice):
+    """Throughput and stage latencies are printed after the results."""
+    result = script_runner.run(
+        'wentral', 'bm',
+        '-d', 'server',
+        '-s', webservice['url'],
+        str(dataset_dir),
+    )
+    assert result.success
+    lines = result.stdout.splitlines()[7:]
+    assert re.match(r'Throughput: [\d.]+ images/s, [\d.]+ megapixels/s$',
+                    lines[0])
+    assert lines[1].split() == ['Latency', '(ms)', 'p50', 'p90', 'p99']
+    assert [line.split()[0] for line in lines[2:]] == [
+        'decode', 'convert', 'detect', 'match',
+    ]
+
+
 @pytest.mark.script_launch_mode('inprocess')
 @pytest.mark.parametrize('weights_file', [None, '/a/b/c'])
 @pytest.mark.parametrize('extras', [
@@ -79,7 +108,7 @@ def test_other(script_runner, shmetector, dataset_dir, weights_file, extras):
                 expected_output = extras[i] + '\n' + expected_output
 
         assert result.success
-        assert result.stdout == expected_output
+        assert strip_timing(result.stdout) == expected_output
         assert result.stderr == ''
     else:
         # There's no default for --weights-file provided by the options parser
@@ -98,7 +127,7 @@ def test_static(script_runner, dataset_dir):
         str(dataset_dir),
     )
     assert result.success
-    assert result.stdout == """Overall results:
+    assert strip_timing(result.stdout) == """Overall results:
 N: 3
 TP:6 FN:0 FP:0
 Recall: 100.00%
@@ -109,6 +138,70 @@ mAP: 100.00%
     assert result.stderr == ''
 
 
+@pytest.mark.script_launch_mode('inprocess')
+def test_jobs(script_runner, dataset_dir, shmetector):
+    """Test running the detector in multiple processes."""
+    result = script_runner.run(
+        'wentral', 'bm',
+        '-d', shmetector,
+        '-w', '/a/b/c',
+        '-j', '2',
+        str(dataset_dir),
+    )
+    assert result.success
+    assert strip_timing(result.stdout) == MOCK_BM_OUTPUT
+    assert result.stderr == ''
+
+
+@pytest.mark.script_launch_mode('inprocess')
+def test_checkpoint(script_runner, dataset_dir, webservice, tmpdir):
+    """Test saving results into a checkpoint and resuming from it."""
+    checkpoint_path = tmpdir.join('checkpoint.jsonl')
+    for resume in [[], ['--resume']]:
+        result = script_runner.run(
+            'wentral', 'bm',
+            '-d', 'server',
+            '-s', webservice['url'],
+            '--no-cache',
+            '--checkpoint', str(checkpoint_path),
+            str(dataset_dir),
+            *resume
+        )
+        assert result.success
+        assert strip_timing(result.stdout) == MOCK_BM_OUTPUT
+        assert result.stderr == ''
+    # The second run didn't need to run the detector.
+    assert len(webservice['app'].detector.log) == 3
+    assert len(checkpoint_path.readlines()) == 4
+
+
+def test_resume_without_checkpoint(script_runner, dataset_dir):
+    result = script_runner.run(
+        'wentral', 'bm',
+        '-d', 'static',
+        '-p', str(dataset_dir),
+        '--resume',
+        str(dataset_dir),
+    )
+    assert not result.success
+    assert '--resume requires --checkpoint' in result.stderr
+
+
+@pytest.mark.script_launch_mode('inprocess')
+def test_prefetch(script_runner, dataset_dir, webservice):
+    """Test decoding images ahead of time."""
+    result = script_runner.run(
+        'wentral', 'bm',
+        '-d', 'server',
+        '-s', webservice['url'],
+        '--prefetch', '2',
+        str(dataset_dir),
+    )
+    assert result.success
+    assert strip_timing(result.stdout) == MOCK_BM_OUTPUT
+    assert result.stderr == ''
+
+
 @pytest.fixture()
 def dataset_copy(dataset_dir, tmpdir):
     """Copy of the dataset (usually so we can modify it)."""
@@ -144,7 +237,7 @@ def test_json_output(script_runner, dataset_dir, tmpdir, webservice):
         str(dataset_dir),
     )
     assert result.success
-    assert result.stdout == ''
+    assert strip_timing(result.stdout) == ''
     assert result.stderr == ''
     result = json.load(json_path.open())
     assert result['image_count'] == 3
@@ -156,6 +249,141 @@ def test_json_output(script_runner, dataset_dir, tmpdir, webservice):
     assert result['f1'] == pytest.approx(0.5714, 0.001)
 
 
+@pytest.mark.script_launch_mode('inprocess')
+def test_jsonl_output(script_runner, dataset_dir, tmpdir, webservice):
+    """Test JSONL output and using it as the dataset."""
+    jsonl_path = tmpdir.join('output.jsonl')
+    result = script_runner.run(
+        'wentral', 'bm',
+        '-d', 'server',
+        '-o', str(jsonl_path),
+        '-s', webservice['url'],
+        str(dataset_dir),
+    )
+    assert result.success
+    summary, *images = [json.loads(line) for line in jsonl_path.readlines()]
+    assert summary['image_count'] == len(images) == 3
+    assert summary['tp'] == summary['fp'] == 4
+    assert sorted(image['image_name'] for image in images) == [
+        '0.png', '1.png', '2.png',
+    ]
+
+    result = script_runner.run(
+        'wentral', 'bm',
+        '-d', 'json',
+        '-p', str(jsonl_path),
+        str(jsonl_path),
+    )
+    assert result.success
+    assert 'Precision: 50.00%' in result.stdout
+
+
+@pytest.mark.script_launch_mode('inprocess')
+def test_binary_output(script_runner, dataset_dir, tmpdir, webservice):
+    """Test binary output and using it as the dataset and the detector."""
+    binary_path = tmpdir.join('output.wbin')
+    result = script_runner.run(
+        'wentral', 'bm',
+        '-d', 'server',
+        '-o', str(binary_path),
+        '-s', webservice['url'],
+        str(dataset_dir),
+    )
+    assert result.success
+    assert binary_path.read_binary().startswith(b'WENTRAL')
+
+    result = script_runner.run(
+        'wentral', 'bm',
+        '-d', 'json',
+        '-p', str(binary_path),
+        str(binary_path),
+    )
+    assert result.success
+    assert 'Precision: 50.00%' in result.stdout
+
+
+@pytest.mark.script_launch_mode('inprocess')
+def test_pack(script_runner, dataset_dir, tmpdir, webservice):
+    """Test packing the dataset and benchmarking with the packed dataset."""
+    pack_dir = tmpdir.join('packed')
+    result = script_runner.run(
+        'wentral', 'pack', str(dataset_dir), str(pack_dir),
+    )
+    assert result.success
+    assert result.stdout == str(pack_dir.join('00001.wpack')) + '\n'
+
+    result = script_runner.run(
+        'wentral', 'bm',
+        '-d', 'server',
+        '-s', webservice['url'],
+        str(pack_dir),
+    )
+    assert result.success
+    assert strip_timing(result.stdout) == MOCK_BM_OUTPUT
+
+
+@pytest.mark.script_launch_mode('inprocess')
+@pytest.mark.parametrize('args,expect_count', [
+    (['--limit', '1'], 1),
+    (['--sample', '0.5', '--seed', '3'], 2),
+    (['--sample', '0.5', '--stratify', 'aspect'], 2),
+])
+def test_sample(script_runner, dataset_dir, webservice, args, expect_count):
+    result = script_runner.run(
+        'wentral', 'bm',
+        '-d', 'server',
+        '-s', webservice['url'],
+        *args,
+        str(dataset_dir),
+    )
+    assert result.success
+    assert 'N: {}\n'.format(expect_count) in result.stdout
+
+
+def test_sample_invalid(script_runner, dataset_dir):
+    result = script_runner.run(
+        'wentral', 'bm', '--sample', '1.5', str(dataset_dir),
+    )
+    assert not result.success
+    assert 'Invalid fraction: 1.5' in result.stderr
+
+
+@pytest.mark.script_launch_mode('inprocess')
+def test_shard_merge(script_runner, dataset_dir, tmpdir, webservice):
+    """Test benchmarking the shards separately and merging the results."""
+    paths = []
+    for shard in ['1/2', '2/2']:
+        paths.append(str(tmpdir.join('shard{}.json'.format(shard[0]))))
+        result = script_runner.run(
+            'wentral', 'bm',
+            '-d', 'server',
+            '-s', webservice['url'],
+            '--shard', shard,
+            '-o', paths[-1],
+            str(dataset_dir),
+        )
+        assert result.success
+        assert json.load(open(paths[-1]))['shard'] == [int(shard[0]), 2]
+
+    merged_path = tmpdir.join('merged.json')
+    result = script_runner.run(
+        'wentral', 'merge', '-v', '-o', str(merged_path), *paths,
+    )
+    assert result.success
+    assert strip_timing(result.stdout) == MOCK_BM_OUTPUT
+    merged = json.load(merged_path.open())
+    assert merged['image_count'] == len(merged['images']) == 3
+    assert 'shard' not in merged
+
+
+def test_shard_invalid(script_runner, dataset_dir):
+    result = script_runner.run(
+        'wentral', 'bm', '--shard', '3/2', str(dataset_dir),
+    )
+    assert not result.success
+    assert 'Invalid shard: 3/2' in result.stderr
+
+
 @pytest.mark.script_launch_mode('inprocess')
 @pytest.mark.parametrize('extra_args', [[], ['-c', '0.9']])
 def test_json_detector(script_runner, dataset_dir, json_output, extra_args):
@@ -193,7 +421,7 @@ def test_json_dataset(script_runner, webservice, json_output, tmpdir):
         str(json_output),
     )
     assert result.success
-    assert result.stdout == ''
+    assert strip_timing(result.stdout) == ''
     assert result.stderr == ''
 
     # Do it again with the output of the run above.
@@ -204,7 +432,7 @@ def test_json_dataset(script_runner, webservice, json_output, tmpdir):
         str(json_output2),
     )
     assert result.success
-    assert result.stdout == MOCK_BM_OUTPUT
+    assert strip_timing(result.stdout) == MOCK_BM_OUTPUT
     assert result.stderr == ''
 
 
@@ -219,7 +447,7 @@ def test_iou(script_runner, dataset_dir, webservice):
         str(dataset_dir),
     )
     assert result.success
-    assert result.stdout == """Overall results:
+    assert strip_timing(result.stdout) == """Overall results:
 N: 3
 TP:6 FN:0 FP:2
 Recall: 100.00%
@@ -230,6 +458,101 @@ mAP: 95.14%
     assert result.stderr == ''
 
 
+@pytest.mark.script_launch_mode('inprocess')
+@pytest.mark.parametrize('cache_args,expect_calls', [
+    ([], 3),
+    (['--no-cache'], 6),
+    (['--refresh-cache'], 6),
+])
+def test_detection_cache(script_runner, dataset_dir, webservice,
+                         detection_cache_dir, cache_args, expect_calls):
+    """Test that the second run takes detections from the cache."""
+    for _ in range(2):
+        result = script_runner.run(
+            'wentral', 'bm',
+            '-d', 'server',
+            '-s', webservice['url'],
+            str(dataset_dir),
+            *cache_args
+        )
+        assert result.success
+        assert strip_timing(result.stdout) == MOCK_BM_OUTPUT
+    assert len(webservice['app'].detector.log) == expect_calls
+    assert detection_cache_dir.check(dir=1) != ('--no-cache' in cache_args)
+
+
+@pytest.mark.script_launch_mode('inprocess')
+def test_map_iou(script_runner, dataset_dir, webservice):
+    """Test calculating AP at multiple IoUs."""
+    result = script_runner.run(
+        'wentral', 'bm',
+        '-d', 'server',
+        '-s', webservice['url'],
+        '--map-iou', '0.1:0.4:0.3',
+        str(dataset_dir),
+    )
+    assert result.success
+    assert strip_timing(result.stdout) == MOCK_BM_OUTPUT + """AP@0.10: 95.14%
+AP@0.40: 75.00%
+mAP@[0.10:0.40]: 85.07%
+"""
+    assert result.stderr == ''
+
+
+@pytest.mark.parametrize('spec', [
+    '0.5:x', '0.5:0.95:0', '0.5:0.95:-0.05', '0.95:0.5:0.05',
+])
+def test_map_iou_invalid(script_runner, dataset_dir, spec):
+    result = script_runner.run(
+        'wentral', 'bm',
+        '-d', 'static',
+        '-p', str(dataset_dir),
+        '--map-iou', spec,
+        str(dataset_dir),
+    )
+    assert not result.success
+    assert 'Invalid IoU list: ' + spec in result.stderr
+
+
+@pytest.mark.script_launch_mode('inprocess')
+def test_sweep(script_runner, dataset_dir, tmpdir, webservice):
+    """Test metrics at all confidence thresholds."""
+    result = script_runner.run(
+        'wentral', 'bm',
+        '-d', 'server',
+        '-s', webservice['url'],
+        '--sweep',
+        str(dataset_dir),
+    )
+    assert result.success
+    assert strip_timing(result.stdout) == MOCK_BM_OUTPUT + """Threshold sweep:
+Confidence      TP      FP      FN  Recall  Precision      F1
+    0.9000       3       0       3  50.00%    100.00%  66.67%
+    0.8000       4       0       2  66.67%    100.00%  80.00%
+    0.7000       4       2       2  66.67%     66.67%  66.67%
+    0.6000       4       4       2  66.67%     50.00%  57.14%
+Best F1: 80.00% at confidence threshold 0.8000
+Recall: 66.67%
+Precision: 100.00%
+"""
+    assert result.stderr == ''
+
+    json_path = tmpdir.join('output.json')
+    result = script_runner.run(
+        'wentral', 'bm',
+        '-d', 'server',
+        '-s', webservice['url'],
+        '-o', str(json_path),
+        '--sweep',
+        str(dataset_dir),
+    )
+    assert result.success
+    result = json.load(json_path.open())
+    assert len(result['threshold_sweep']) == 4
+    assert result['best_f1_threshold']['confidence_threshold'] == 0.8
+    assert result['best_f1_threshold']['tp'] == 4
+
+
 @pytest.mark.script_launch_mode('inprocess')
 def test_visualize_out_files(script_runner, dataset_dir, tmpdir, webservice):
     """Test vizualizing the detection boxes."""
@@ -319,7 +642,7 @@ def test_ws(script_runner, mocker, shmetector, dataset_dir, weights_file,
         iou_threshold = args.get('--iou-threshold', 0.4)
         port = args.get('--port', 8080)
 
-        assert result.stdout == (
+        assert strip_timing(result.stdout) == (
             'SlicingDetectorProxy(detector=MD(weights_file={}, '
             'iou_threshold={}), iou_threshold={}, slice_overlap=0.2, '
             'slicing_threshold={})\nport={}\n'
@@ -332,3 +655,23 @@ def test_ws(script_runner, mocker, shmetector, dataset_dir, weights_file,
         assert not result.success
         err = 'weights_file is required for detector'
         assert err in result.stderr
+
+
+@pytest.mark.script_launch_mode('inprocess')
+def test_loadtest(script_runner, dataset_dir, webservice, tmpdir):
+    json_path = tmpdir.join('loadtest.json')
+    result = script_runner.run(
+        'wentral', 'loadtest',
+        '-s', webservice['url'],
+        '-n', '2',
+        '--requests', '5',
+        '-o', str(json_path),
+        str(dataset_dir),
+    )
+    assert result.success
+    lines = result.stdout.splitlines()
+    assert lines[:2] == ['Requests: 5', 'Errors: 0 (0.00%)']
+    assert lines[4].startswith('Latency (ms): p50 ')
+    assert sum(int(line.split('ms')[1].split()[0])
+               for line in lines[5:]) == 5
+    assert json.load(json_path.open())['request_count'] == 5
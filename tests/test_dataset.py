@@ -0,0 +1,248 @@
+# Copyright (C) 2019-present eyeo GmbH
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests for datasets."""
+
+import collections
+import os
+
+from PIL import Image
+import pytest
+
+import wentral.benchmark as bm
+import wentral.dataset as ds
+
+import conftest
+
+
+class RecordingDataset:
+    """Dataset wrapper that records how many items have been taken."""
+
+    images_path = 'foo'
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.taken = 0
+
+    def __iter__(self):
+        for item in self.dataset:
+            self.taken += 1
+            yield item
+
+
+def test_prefetching(dataset):
+    prefetching = ds.PrefetchingDataset(dataset, prefetch=2)
+    expect = list(dataset)
+    got = list(prefetching)
+    assert [item[1:] for item in got] == [item[1:] for item in expect]
+    for image, _, _ in got:
+        assert image.mode == 'RGB'
+    assert str(prefetching) == str(dataset)
+    assert prefetching.images_path == dataset.images_path
+
+
+@pytest.mark.parametrize('prefetch,max_memory,expect_ahead', [
+    (1, 10 ** 9, 1),
+    (2, 10 ** 9, 2),
+    (5, 10 ** 9, 2),         # There are only 3 images.
+    (5, 100 * 100 * 4, 1),   # Memory for one image.
+    (5, 10, 1),              # At least one image is always decoded.
+])
+def test_prefetching_limits(dataset, prefetch, max_memory, expect_ahead):
+    recording = RecordingDataset(dataset)
+    prefetching = ds.PrefetchingDataset(recording, prefetch=prefetch,
+                                        max_memory=max_memory)
+    iterator = iter(prefetching)
+    next(iterator)
+    assert recording.taken == 1 + expect_ahead
+    iterator.close()
+
+
+def test_prefetching_benchmark(dataset, mock_detector):
+    expect = bm.evaluate(dataset, mock_detector)
+    result = bm.evaluate(ds.PrefetchingDataset(dataset), mock_detector)
+    assert conftest.without_timings(result.to_dict()) == \
+        conftest.without_timings(expect.to_dict())
+
+
+@pytest.mark.parametrize('shard_count', [1, 2, 3])
+def test_sharding(dataset, shard_count):
+    """Shards are disjoint and together cover the whole dataset."""
+    names = []
+    for shard in range(1, shard_count + 1):
+        sharded = ds.ShardedDataset(dataset, shard, shard_count)
+        assert str(sharded) == str(dataset)
+        assert sharded.images_path == dataset.images_path
+        for _, image_path, _ in sharded:
+            assert ds.shard_of(image_path, shard_count) == shard
+            names.append(image_path)
+    assert sorted(names) == sorted(path for _, path, _ in dataset)
+
+
+def test_lazy_image(dataset_dir):
+    image = ds.LazyImage(str(dataset_dir.join('1.png')))
+    assert image._image is None
+    image.close()
+    assert ds.open_image(image) is image.open()
+    assert image.size == (100, 100)
+    assert ds.open_image(image).mode == 'RGBA'
+    assert ds.open_image(image.open()) is image.open()
+    image.close()
+
+
+class ListDataset:
+    """Dataset of images that can't be opened with some boxes."""
+
+    images_path = '/nonexistent'
+
+    def __init__(self, count):
+        self.items = [
+            ('/nonexistent/{}.png'.format(i), [(0, 0, 1, 1)] * (i % 5))
+            for i in range(count)
+        ]
+
+    def image_size(self, image_path):
+        i = int(os.path.basename(image_path).split('.')[0])
+        return 100, 100 * (i % 3 + 1)
+
+    def __iter__(self):
+        for image_path, boxes in self.items:
+            yield ds.LazyImage(image_path), image_path, boxes
+
+
+def test_limit():
+    sampled = ds.SampledDataset(ListDataset(10), limit=3)
+    assert [path for _, path, _ in sampled] == [
+        '/nonexistent/{}.png'.format(i) for i in range(3)
+    ]
+
+
+def test_sample():
+    dataset = ListDataset(100)
+    order = [path for _, path, _ in dataset]
+
+    def sample(**kw):
+        paths = [path for _, path, _ in ds.SampledDataset(dataset, **kw)]
+        assert paths == sorted(paths, key=order.index)
+        return paths
+
+    half = sample(fraction=0.5)
+    assert len(half) == 50
+    assert sample(fraction=0.5) == half
+    assert sample(fraction=0.5, seed=1) != half
+    assert set(sample(fraction=0.2)) < set(half)
+    assert set(sample(fraction=0.5, limit=20)) == set(sample(fraction=0.2))
+    assert len(sample(fraction=0.001)) == 0
+
+
+@pytest.mark.parametrize('stratify,stratum', [
+    ('boxes', lambda i: (i % 5).bit_length()),
+    ('aspect', lambda i: i % 3),
+])
+def test_stratify(stratify, stratum):
+    """Each stratum is represented proportionally."""
+    dataset = ListDataset(120)
+    for fraction, limit in [(0.5, None), (None, 30)]:
+        sampled = ds.SampledDataset(dataset, fraction=fraction, limit=limit,
+                                    stratify=stratify)
+        got = collections.Counter(
+            stratum(int(os.path.basename(path).split('.')[0]))
+            for _, path, _ in sampled
+        )
+        expect = collections.Counter(stratum(i) for i in range(120))
+        for key, count in expect.items():
+            assert abs(got[key] - count * 30 / 120
+                       * (2 if fraction else 1)) < 1
+
+
+def test_stratify_aspect_headers(dataset):
+    """Without `image_size` aspect ratio is taken from the images."""
+    sampled = ds.SampledDataset(list(dataset), fraction=0.5,
+                                stratify='aspect')
+    assert len(list(sampled)) == 2
+    with pytest.raises(Exception, match='Unknown stratification'):
+        ds.SampledDataset(dataset, stratify='foo')
+
+
+def test_image_cache(dataset_dir, mock_detector, monkeypatch):
+    """Second pass over a dataset with image cache doesn't decode images."""
+    cache = ds.ImageCache()
+    dataset = ds.LabeledDataset(str(dataset_dir), image_cache=cache)
+    expect = bm.evaluate(dataset, mock_detector)
+    assert (cache.hits, cache.misses, len(cache)) == (0, 3, 3)
+    assert cache.memory == 3 * 100 * 100 * 4
+
+    def no_open(path):
+        raise AssertionError('Opened ' + path)
+
+    monkeypatch.setattr(ds.PIL.Image, 'open', no_open)
+    for wrapped in [dataset, ds.PrefetchingDataset(dataset)]:
+        result = bm.evaluate(wrapped, mock_detector)
+        assert conftest.without_timings(result.to_dict()) == \
+            conftest.without_timings(expect.to_dict())
+    assert (cache.hits, cache.misses) == (6, 3)
+
+
+def test_image_cache_eviction():
+    cache = ds.ImageCache(max_memory=2 * 100 * 100 * 4)
+    images = {key: Image.new('RGB', (100, 100)) for key in 'abc'}
+    for key, image in images.items():
+        cache.put(key, image)
+    assert len(cache) == 2
+    assert cache.get('a') is None  # Least recently used.
+    assert cache.get('b') is images['b']
+    cache.put('a', images['a'])
+    assert cache.get('c') is None  # Now this one is the oldest.
+    assert cache.memory == 2 * 100 * 100 * 4
+
+    small_cache = ds.ImageCache(max_memory=10)
+    small_cache.put('a', images['a'])
+    assert len(small_cache) == 0
+
+
+def test_image_cache_budget():
+    """Pixel data of the cached images fits into the memory budget."""
+    cache = ds.ImageCache(max_memory=100 * 100 * 4 * 3)
+    for i in range(20):
+        cache.put(i, Image.new('RGB', (50 + i * 5, 100 + i * 3)))
+        # PIL stores RGB pixels in 4 bytes, like RGBX.
+        stored = sum(len(cache.get(key).tobytes('raw', 'RGBX'))
+                     for key in list(cache._images))
+        assert stored == cache.memory <= cache.max_memory
+
+
+def test_json_dataset_stream(json_output):
+    loaded = ds.JsonDataset(str(json_output))
+    streamed = ds.JsonDataset(str(json_output), stream=True)
+    assert streamed.images_path == loaded.images_path
+    assert 'images' not in streamed.data
+    assert [(path, boxes) for _, path, boxes in streamed] == \
+        [(path, boxes) for _, path, boxes in loaded]
+
+
+@pytest.mark.parametrize('index_cache', [True, False])
+def test_image_size(dataset_dir, monkeypatch, index_cache):
+    dataset = ds.LabeledDataset(str(dataset_dir), index_cache=index_cache)
+    image_path = str(dataset_dir.join('0.png'))
+    if index_cache:
+        # The size is taken from the index without opening the image.
+        monkeypatch.setattr(ds.PIL.Image, 'open', None)
+    assert dataset.image_size(image_path) == (100, 100)
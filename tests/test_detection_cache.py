@@ -0,0 +1,105 @@
+# Copyright (C) 2019-present eyeo GmbH
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests for the detection cache."""
+
+import os
+
+import numpy as np
+import pytest
+
+import wentral.benchmark as bm
+import wentral.detection_cache as dc
+
+import conftest
+
+
+@pytest.fixture()
+def cache(tmpdir):
+    return dc.DetectionCache(str(tmpdir.join('cache')))
+
+
+@pytest.fixture()
+def image_path(dataset_dir):
+    return str(dataset_dir.join('0.png'))
+
+
+def test_get_put(cache, image_path, mock_detector):
+    key = cache.make_key(image_path, mock_detector, {'a': 1})
+    assert cache.get(key) is None
+    cache.put(key, [(1, 2, 3, 4, 0.5)])
+    assert cache.get(key) == [(1, 2, 3, 4, 0.5)]
+    assert cache.size > 0
+
+
+def test_key(cache, dataset_dir, image_path, mock_detector):
+    key = cache.make_key(image_path, mock_detector, {'a': 1})
+    assert key == cache.make_key(image_path, mock_detector, {'a': 1})
+    assert key != cache.make_key(image_path, mock_detector, {'a': 2})
+    assert key != cache.make_key(str(dataset_dir.join('1.png')),
+                                 mock_detector, {'a': 1})
+    mock_detector.name = 'other-detector'
+    assert key != cache.make_key(image_path, mock_detector, {'a': 1})
+
+
+def test_refresh(cache, image_path, mock_detector):
+    key = cache.make_key(image_path, mock_detector, {})
+    cache.put(key, [(1, 2, 3, 4, 0.5)])
+    refreshing = dc.DetectionCache(cache.path, refresh=True)
+    assert refreshing.get(key) is None
+    refreshing.put(key, [(5, 6, 7, 8, 0.9)])
+    assert cache.get(key) == [(5, 6, 7, 8, 0.9)]
+
+
+def test_eviction(tmpdir, image_path, mock_detector):
+    cache = dc.DetectionCache(str(tmpdir.join('cache')), max_size=100)
+    keys = [cache.make_key(image_path, mock_detector, {'i': i})
+            for i in range(5)]
+    for i, key in enumerate(keys):
+        cache.put(key, [(i, i, i, i, 0.5)] * 2)
+        # Make sure access times are distinct and in the order of insertion.
+        os.utime(cache._entry_path(key), (i, i))
+    assert cache.size <= 100
+    # Least recently used entries are gone, the most recent ones are there.
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[-1]) is not None
+
+
+def test_benchmark_uses_cache(dataset, mock_detector, cache):
+    first = bm.evaluate(dataset, mock_detector, detection_cache=cache)
+    assert len(mock_detector.log) == 3
+    second = bm.evaluate(dataset, mock_detector, detection_cache=cache)
+    assert len(mock_detector.log) == 3  # Detector wasn't called again.
+    assert conftest.without_timings(second.to_dict()) == \
+        conftest.without_timings(first.to_dict())
+
+
+def test_numpy_detections(dataset, mock_detector, cache):
+    """Detections with NumPy scalars are cached as floats."""
+    mock_detector.answers = {
+        name: [tuple(np.float32(v) for v in box) for box in boxes]
+        for name, boxes in mock_detector.answers.items()
+    }
+    first = bm.evaluate(dataset, mock_detector, detection_cache=cache)
+    second = bm.evaluate(dataset, mock_detector, detection_cache=cache)
+    assert len(mock_detector.log) == 3
+    assert conftest.without_timings(second.to_dict()) == \
+        conftest.without_timings(first.to_dict())
@@ -20,6 +20,8 @@
 
 """Tests for JsonDetector."""
 
+import pickle
+
 import pytest
 
 import wentral.json_detector as jd
@@ -39,3 +41,72 @@ def test_detect(json_output, image_name, ct, it, expect):
         iou_threshold=it,
     )
     assert detections == expect
+
+
+class CountingDetections(dict):
+    """Detections mapping that counts how many times records are read."""
+
+    reads = 0
+
+    def __getitem__(self, image_name):
+        self.reads += 1
+        return super().__getitem__(image_name)
+
+
+def test_detect_sorted(json_output, monkeypatch):
+    """Detections are sorted once and the results are memoized."""
+    # Enough for the sorted detections of a.png and 3 results for it.
+    monkeypatch.setattr(jd.const, 'JSON_DETECTOR_CACHE_MEMORY', 1400)
+    detector = jd.JsonDetector(str(json_output))
+    detections = detector.detections = CountingDetections({
+        'a.png': [[0, 0, 10, 10, 0.5], [1, 1, 11, 11, 0.7],
+                  [50, 50, 60, 60, 0.5, True], [20, 20, 30, 30, 0.9]],
+        'b.png': [],
+        'c.png': [[0, 0, 10, 10, 1]],
+    })
+
+    expect = [[20, 20, 30, 30, 0.9], [1, 1, 11, 11, 0.7],
+              [50, 50, 60, 60, 0.5]]
+    result = detector.detect(None, 'a.png', confidence_threshold=0.5)
+    assert result == expect
+    result.clear()  # Memoized results are not affected.
+    assert detector.detect(None, 'a.png', confidence_threshold=0.5) == expect
+    assert detector.detect(None, 'a.png', confidence_threshold=0.6,
+                           iou_threshold=1) == expect[:2]
+    assert detector.detect(None, 'a.png', confidence_threshold=0.5,
+                           iou_threshold=1) == [
+        [20, 20, 30, 30, 0.9], [1, 1, 11, 11, 0.7], [0, 0, 10, 10, 0.5],
+        [50, 50, 60, 60, 0.5],
+    ]
+    assert detections.reads == 1
+    assert len(detector._cache) == 4
+
+    assert detector.detect(None, 'b.png') == []
+    assert detector.detect(None, 'c.png') == [[0, 0, 10, 10, 1]]
+    detector.detect(None, 'a.png', confidence_threshold=0.5)
+    assert detections.reads == 4  # Evicted from the cache.
+    assert detector._cache.memory <= 1400
+    with pytest.raises(KeyError):
+        detector.detect(None, 'd.png')
+
+
+def test_detect_over_budget(json_output, monkeypatch):
+    """Entries that don't fit into the memory budget are not cached."""
+    monkeypatch.setattr(jd.const, 'JSON_DETECTOR_CACHE_MEMORY', 100)
+    detector = jd.JsonDetector(str(json_output))
+    detections = detector.detections = CountingDetections({
+        'a.png': [[0, 0, 10, 10, 0.5]],
+    })
+    for _ in range(2):
+        assert detector.detect(None, 'a.png') == [[0, 0, 10, 10, 0.5]]
+    assert detections.reads == 2
+    assert len(detector._cache) == 0
+    assert detector._cache.memory == 0
+
+
+def test_pickle(json_output):
+    detector = jd.JsonDetector(str(json_output))
+    expect = detector.detect(None, '1.png')
+    copy = pickle.loads(pickle.dumps(detector))
+    assert len(copy._cache) == 0
+    assert copy.detect(None, '1.png') == expect
@@ -0,0 +1,92 @@
+# Copyright (C) 2019-present eyeo GmbH
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Tests for load generation."""
+
+import pytest
+
+import wentral.loadtest as lt
+
+
+def test_single_pass(dataset, webservice):
+    """By default each image of the dataset is sent once."""
+    result = lt.run(webservice['url'], dataset, concurrency=2)
+    assert result.request_count == 3
+    assert result.error_count == 0
+    assert len(result.latencies) == 3
+    assert result.throughput == 3 / result.duration
+    log = webservice['app'].detector.log
+    assert sorted(entry['image_name'] for entry in log) == [
+        '0.png', '1.png', '2.png',
+    ]
+
+
+@pytest.mark.parametrize('concurrency', [1, 3])
+def test_request_count(dataset, webservice, concurrency):
+    """Dataset is cycled to send the requested number of requests."""
+    result = lt.run(webservice['url'], dataset, concurrency=concurrency,
+                    request_count=7)
+    assert result.request_count == 7
+    assert len(webservice['app'].detector.log) == 7
+
+
+def test_duration(dataset, webservice):
+    webservice['app'].detector.delay = 0.01
+    result = lt.run(webservice['url'], dataset, duration=0.1)
+    assert 0 < result.request_count <= 11
+    assert result.duration >= 0.1
+
+
+def test_open_loop(dataset, webservice):
+    """Requests are sent at fixed rate."""
+    result = lt.run(webservice['url'], dataset, rate=50, concurrency=2,
+                    request_count=6)
+    assert result.request_count == 6
+    assert result.error_count == 0
+    # The last request is sent 5 / 50 seconds after the first.
+    assert result.duration >= 0.1
+
+
+def test_errors(dataset, webservice):
+    result = lt.run(webservice['url'], dataset, confidence_threshold='foo')
+    assert result.error_count == result.request_count == 3
+    assert result.error_rate == 1
+    assert result.percentiles() == {}
+    [message] = result.errors
+    assert '400' in message
+
+
+def test_statistics():
+    result = lt.LoadTestResult()
+    for latency in [0.0005, 0.003, 0.003, 0.015, 2.5, 20]:
+        result.add(latency)
+    result.add_error(Exception('Boom'))
+    result.duration = 2
+
+    assert result.request_count == 7
+    assert result.error_rate == 1 / 7
+    assert result.throughput == 3
+    assert result.percentiles()['p50'] == pytest.approx(0.009)
+    assert result.percentiles()['max'] == 20
+    assert dict(result.histogram()) == {
+        1: 1, 2: 0, 5: 2, 10: 0, 20: 1, 50: 0, 100: 0, 200: 0, 500: 0,
+        1000: 0, 2000: 0, 5000: 1, 10000: 0, None: 1,
+    }
+    assert result.to_dict()['errors'] == {'Boom': 1}
@@ -0,0 +1,85 @@
+# Copyright (C) 2019-present eyeo GmbH
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Tests for non-maximum suppression."""
+
+import random
+
+import numpy as np
+import pytest
+
+import wentral.nms as nms
+import wentral.utils as u
+
+
+def greedy_nms(boxes, iou_threshold, confidence_threshold):
+    """Straightforward implementation of NMS to compare with."""
+    detections = sorted([
+        d for d in boxes if d[4] >= confidence_threshold
+    ], key=lambda d: d[4], reverse=True)
+
+    picked = []
+    for d in detections:
+        for p in picked:
+            if u.iou(p[:4], d[:4]) >= iou_threshold:
+                break
+        else:
+            picked.append(d)
+    return picked
+
+
+def random_boxes(seed, count):
+    rnd = random.Random(seed)
+    boxes = []
+    for i in range(count):
+        x0 = rnd.randint(0, 90)
+        y0 = rnd.randint(0, 90)
+        boxes.append([x0, y0, x0 + rnd.randint(1, 30),
+                      y0 + rnd.randint(1, 30), round(rnd.random(), 1), i])
+    return boxes
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('iou_threshold', [0, 0.1, 0.4, 0.7, 1])
+@pytest.mark.parametrize('confidence_threshold', [0, 0.5])
+@pytest.mark.parametrize('count', [0, 1, 200])
+def test_nms_greedy(seed, iou_threshold, confidence_threshold, count):
+    """Vectorized NMS selects the same detections as the greedy one."""
+    boxes = random_boxes(seed, count)
+    expect = greedy_nms(boxes, iou_threshold, confidence_threshold)
+    assert nms.nms(boxes, iou_threshold, confidence_threshold) == expect
+
+    indices = nms.nms_indices(np.array(boxes), iou_threshold,
+                              confidence_threshold)
+    assert indices.tolist() == [box[5] for box in expect]
+
+
+def test_nms_top_k():
+    boxes = [
+        (0, 0, 10, 10, 0.9),
+        (20, 20, 30, 30, 0.7),
+        (0, 0, 10, 11, 0.8),    # Duplicate of the first one.
+        (40, 40, 50, 50, 0.6),
+        (60, 60, 70, 70, 0.5),
+    ]
+    assert nms.nms(boxes, 0.5) == [boxes[0], boxes[1], boxes[3], boxes[4]]
+    assert nms.nms(boxes, 0.5, top_k=3) == [boxes[0], boxes[1]]
+    assert nms.nms(boxes, 0.5, confidence_threshold=0.6, top_k=10) == \
+        [boxes[0], boxes[1], boxes[3]]
@@ -0,0 +1,96 @@
+# Copyright (C) 2019-present eyeo GmbH
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Tests for packed datasets."""
+
+import pytest
+
+import wentral.benchmark as bm
+import wentral.dataset as ds
+import wentral.detection_cache as dc
+import wentral.pack as pack
+
+import conftest
+
+
+@pytest.mark.parametrize('shard_size,expect_shards', [
+    (10 ** 9, 1),
+    (1, 3),  # One image per shard.
+])
+def test_pack(dataset, tmpdir, shard_size, expect_shards):
+    pack_dir = str(tmpdir.join('packed'))
+    paths = pack.write_pack(dataset, pack_dir, shard_size)
+    assert len(paths) == expect_shards
+    assert pack.shard_paths(pack_dir) == paths
+    assert pack.is_packed(pack_dir) and pack.is_packed(paths[0])
+
+    packed = ds.PackedDataset(pack_dir)
+    assert packed.images_path == dataset.images_path
+    items = list(packed)
+    expect = list(dataset)
+    assert [item[1:] for item in items] == [item[1:] for item in expect]
+    for (image, _, _), (expect_image, _, _) in zip(items, expect):
+        assert image.tobytes() == expect_image.tobytes()
+
+
+def test_packed_benchmark(dataset, mock_detector, tmpdir):
+    """Benchmark results are the same as with the original dataset."""
+    pack_dir = str(tmpdir.join('packed'))
+    pack.write_pack(dataset, pack_dir)
+    expect = bm.evaluate(dataset, mock_detector)
+    packed = ds.PackedDataset(pack_dir)
+    cache = dc.DetectionCache(str(tmpdir.join('cache')))
+    for params in [{}, {'jobs': 2}, {'detection_cache': cache}]:
+        result = bm.evaluate(packed, mock_detector, **params)
+        assert conftest.without_timings(result.to_dict()) == \
+            conftest.without_timings(dict(expect.to_dict(),
+                                          dataset=str(packed)))
+
+    # The cache has the same keys for packed and unpacked images.
+    result = bm.evaluate(dataset, mock_detector, detection_cache=cache)
+    for ms in result.matchsets:
+        assert list(ms.timings) == ['match']
+
+
+def test_packed_prefetch(dataset, dataset_dir, mock_detector, tmpdir):
+    """Prefetching works without the original images (also with cache)."""
+    pack_dir = str(tmpdir.join('packed'))
+    pack.write_pack(dataset, pack_dir)
+    expect = bm.evaluate(dataset, mock_detector)
+    dataset_dir.remove()
+
+    packed = ds.PackedDataset(pack_dir)
+    cache = dc.DetectionCache(str(tmpdir.join('cache')))
+    for _ in range(2):  # Fill the cache and then use it.
+        result = bm.evaluate(ds.PrefetchingDataset(packed), mock_detector,
+                             detection_cache=cache)
+        assert conftest.without_timings(result.to_dict()) == \
+            conftest.without_timings(dict(expect.to_dict(),
+                                          dataset=str(packed)))
+    assert len(mock_detector.log) == 3 * 2  # Original run + first run.
+
+
+def test_invalid(tmpdir):
+    path = tmpdir.join('foo' + pack.PACK_EXTENSION)
+    path.write('foo')
+    with pytest.raises(Exception, match='not a packed dataset'):
+        ds.PackedDataset(str(path))
+    with pytest.raises(Exception, match='No packed dataset files'):
+        ds.PackedDataset(str(tmpdir.mkdir('empty')))
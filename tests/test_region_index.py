@@ -0,0 +1,112 @@
+# Copyright (C) 2019-present eyeo GmbH
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Tests for the cached region index."""
+
+import os
+
+import admincer.index as idx
+from PIL import Image
+import pytest
+
+import wentral.region_index as ri
+
+
+@pytest.fixture()
+def yolo_dir(tmpdir):
+    """Directory with images and regions in YOLO format."""
+    ret = tmpdir.mkdir('yolo')
+    ret.join('classes.names').write('ad\ntextad\n')
+    for i in range(4):
+        Image.new('RGB', (100, 50)).save(str(ret.join('{}.png'.format(i))))
+        ret.join('{}.txt'.format(i)).write(
+            '0 0.5 0.5 0.2 0.2\n1 0.{} 0.5 0.4 0.4\n'.format(i + 1),
+        )
+    # An image without regions and one in a subdirectory.
+    Image.new('RGB', (10, 10)).save(str(ret.join('4.png')))
+    Image.new('RGB', (10, 10)).save(str(ret.mkdir('sub').join('5.png')))
+    ret.join('sub', '5.txt').write('1 0.5 0.5 2 0.5\n')
+    return ret
+
+
+def assert_same_index(index, root_path):
+    expect = idx.reg_index(root_path)
+    assert dict(index) == dict(expect)
+    assert index.region_types == expect.region_types
+
+
+def test_csv(dataset_dir, tmpdir):
+    cache_path = str(tmpdir.join('index.json'))
+    index = ri.reg_index(str(dataset_dir), cache_path)
+    assert_same_index(index, str(dataset_dir))
+    assert sorted(index.reloaded) == ['0.png', '1.png', '2.png']
+
+    index = ri.reg_index(str(dataset_dir), cache_path)
+    assert_same_index(index, str(dataset_dir))
+    assert index.reloaded == []
+
+
+def test_yolo_incremental(yolo_dir):
+    index = ri.reg_index(str(yolo_dir))
+    assert_same_index(index, str(yolo_dir))
+    assert len(index.reloaded) == 6
+    assert yolo_dir.join(ri.CACHE_FILE_NAME).check()
+
+    index = ri.reg_index(str(yolo_dir))
+    assert_same_index(index, str(yolo_dir))
+    assert index.reloaded == []
+    assert index.image_sizes['0.png'] == (100, 50)
+    assert index.image_sizes[os.path.join('sub', '5.png')] == (10, 10)
+
+    # Modified, added and removed region files and images.
+    yolo_dir.join('1.txt').write('0 0.5 0.5 0.8 0.8\n')
+    yolo_dir.join('4.txt').write('1 0.5 0.5 0.8 0.8\n')
+    yolo_dir.join('2.txt').remove()
+    yolo_dir.join('3.png').remove()
+    Image.new('RGB', (20, 20)).save(str(yolo_dir.join('6.png')))
+    index = ri.reg_index(str(yolo_dir))
+    assert_same_index(index, str(yolo_dir))
+    assert sorted(index.reloaded) == ['1.png', '2.png', '4.png', '6.png']
+
+
+def test_yolo_names_changed(yolo_dir):
+    ri.reg_index(str(yolo_dir))
+    yolo_dir.join('classes.names').write('foo\nbar\n')
+    index = ri.reg_index(str(yolo_dir))
+    assert_same_index(index, str(yolo_dir))
+    assert len(index.reloaded) == 6
+
+
+def test_invalid_cache(yolo_dir):
+    yolo_dir.join(ri.CACHE_FILE_NAME).write('{"foo')
+    index = ri.reg_index(str(yolo_dir))
+    assert_same_index(index, str(yolo_dir))
+    assert len(index.reloaded) == 6
+
+
+def test_readonly(yolo_dir, monkeypatch):
+    """The index is loaded even if the cache can't be saved."""
+    def mkstemp(**kw):
+        raise PermissionError('Read-only file system')
+
+    monkeypatch.setattr(ri.tempfile, 'mkstemp', mkstemp)
+    index = ri.reg_index(str(yolo_dir))
+    assert_same_index(index, str(yolo_dir))
+    assert not yolo_dir.join(ri.CACHE_FILE_NAME).check()
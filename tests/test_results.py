@@ -0,0 +1,223 @@
+# Copyright (C) 2019-present eyeo GmbH
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests for streaming output of benchmark results."""
+
+import json
+
+import numpy as np
+import pytest
+
+import wentral.benchmark as bm
+import wentral.json_detector as jd
+import wentral.results as res
+
+import conftest
+
+
+def roundtrip(data):
+    return json.loads(json.dumps(data))
+
+
+@pytest.mark.parametrize('jsonl', [False, True])
+@pytest.mark.parametrize('include_sweep', [False, True])
+def test_json_dump(dataset, mock_detector, tmpdir, jsonl, include_sweep):
+    """Streamed output contains the same data as `to_dict`."""
+    evaluation = bm.evaluate(dataset, mock_detector, map_ious=[0.5, 0.7])
+    path = str(tmpdir.join('output.jsonl' if jsonl else 'output.json'))
+    with open(path, 'wt', encoding='utf-8') as out_file:
+        evaluation.json_dump(out_file, include_sweep, jsonl)
+
+    if not jsonl:
+        with open(path, encoding='utf-8') as in_file:
+            assert json.load(in_file) == roundtrip(
+                evaluation.to_dict(include_sweep),
+            )
+    assert res.load(path) == roundtrip(evaluation.to_dict(include_sweep))
+
+
+def test_json_dump_empty(dataset, mock_detector, tmpdir):
+    evaluation = bm.Evaluation(dataset, mock_detector)
+    path = tmpdir.join('output.json')
+    with path.open('wt', encoding='utf-8') as out_file:
+        evaluation.json_dump(out_file)
+    assert json.load(path.open())['images'] == []
+
+
+def test_jsonl_records(dataset, mock_detector, tmpdir):
+    """JSONL output has the summary and then one image per line."""
+    evaluation = bm.evaluate(dataset, mock_detector)
+    path = tmpdir.join('output.jsonl')
+    with path.open('wt', encoding='utf-8') as out_file:
+        evaluation.json_dump(out_file, jsonl=True)
+
+    summary, *images = [json.loads(line) for line in path.readlines()]
+    assert summary == roundtrip(evaluation.summary_dict())
+    assert images == roundtrip([ms.to_dict() for ms in evaluation.matchsets])
+
+
+@pytest.mark.parametrize('name', ['output.json', 'output.jsonl'])
+def test_results_writer(dataset, mock_detector, tmpdir, name):
+    """Writer produces the output without the evaluation keeping results."""
+    expect = bm.evaluate(dataset, mock_detector)
+    path = str(tmpdir.join(name))
+    writer = res.ResultsWriter(path, include_sweep=True)
+    evaluation = bm.evaluate(dataset, mock_detector, keep_matchsets=False,
+                             results_writer=writer)
+    writer.write(evaluation)
+    assert evaluation.matchsets == []
+    expect = roundtrip(expect.to_dict(include_sweep=True))
+    assert conftest.without_timings(res.load(path)) == \
+        conftest.without_timings(expect)
+
+    # Detections can be loaded from the output in both formats.
+    detector = jd.JsonDetector(path)
+    assert sorted(detector.detections['2.png']) == [
+        [5, 5, 15, 15, 0.7], [20, 20, 50, 50, 0.6], [60, 60, 90, 90, 0.9],
+    ]
+
+
+@pytest.mark.parametrize('map_ious', [None, [0.5, 0.7]])
+def test_binary_roundtrip(dataset, mock_detector, tmpdir, map_ious):
+    evaluation = bm.evaluate(dataset, mock_detector, map_ious=map_ious)
+    path = str(tmpdir.join('output' + res.BINARY_EXTENSION))
+    with open(path, 'wb') as out_file:
+        evaluation.binary_dump(out_file, include_sweep=True)
+
+    results = res.load(path)
+    assert len(results['images']) == 3
+    assert results['images'][-1] == evaluation.matchsets[-1].to_dict()
+    results['images'] = list(results['images'])
+    assert roundtrip(results) == roundtrip(evaluation.to_dict(True))
+
+
+def test_binary_empty(dataset, mock_detector, tmpdir):
+    path = str(tmpdir.join('output' + res.BINARY_EXTENSION))
+    with open(path, 'wb') as out_file:
+        bm.Evaluation(dataset, mock_detector).binary_dump(out_file)
+    assert list(res.load(path)['images']) == []
+
+
+def test_binary_random_access(dataset, mock_detector, tmpdir):
+    """The data of one image is read from memory-mapped arrays."""
+    path = str(tmpdir.join('output' + res.BINARY_EXTENSION))
+    writer = res.ResultsWriter(path)
+    evaluation = bm.evaluate(dataset, mock_detector, keep_matchsets=False,
+                             results_writer=writer)
+    writer.write(evaluation)
+
+    binary_results = res.BinaryResults(path)
+    i = binary_results.index('1.png')
+    detections = binary_results.detections(i)
+    assert isinstance(detections, np.memmap)
+    assert detections.dtype == bm.DETECTION_DTYPE
+    assert detections.tolist() == [
+        (10, 10, 80, 25, 0.9, True),
+        (10, 30, 30, 60, 0.6, False),
+    ]
+    assert binary_results.summary['tp'] == evaluation.tp
+
+    detector = jd.JsonDetector(path)
+    assert detector.detect(None, '1.png') == [
+        [10, 10, 80, 25, 0.9], [10, 30, 30, 60, 0.6],
+    ]
+    with pytest.raises(KeyError):
+        detector.detect(None, 'foo.png')
+
+
+def test_binary_invalid(tmpdir):
+    path = tmpdir.join('output' + res.BINARY_EXTENSION)
+    path.write('{}')
+    with pytest.raises(Exception, match='not a binary results file'):
+        res.BinaryResults(str(path))
+
+
+STREAM_DATA = {
+    'dataset': 'ünïcode',
+    'images_path': '/images',
+    'images': [
+        {'image_name': 'ä.png', 'detections': [[1, 2, 3, 4, 0.5, True]]},
+        {'image_name': 'b.png', 'detections': [[10, 20, 30, 40, 1e-3]]},
+        {'image_name': '🖼.png', 'detections': []},
+    ],
+    'tp': 12345,
+    'precision': 0.5,
+    'recall': 1.25e-3,
+    'f1': -2.5E+2,
+    'best': [0.75, 1e-10],
+}
+
+
+# Small chunk sizes split the values at all positions.
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 7, 1 << 20])
+@pytest.mark.parametrize('name,dump', [
+    ('compact.json', lambda data, f: json.dump(data, f, ensure_ascii=False,
+                                               separators=(',', ':'))),
+    ('indented.json', lambda data, f: json.dump(data, f, indent='\r\n\t',
+                                                ensure_ascii=False)),
+    ('written.json', lambda data, f: res.write_json(
+        {k: v for k, v in data.items() if k != 'images'},
+        [json.dumps(r, ensure_ascii=False) for r in data['images']], f,
+    )),
+    ('written.jsonl', lambda data, f: res.write_jsonl(
+        {k: v for k, v in data.items() if k != 'images'},
+        [json.dumps(r, ensure_ascii=False) for r in data['images']], f,
+    )),
+])
+def test_streaming(tmpdir, monkeypatch, chunk_size, name, dump):
+    """Results are parsed incrementally and records are found by offset."""
+    monkeypatch.setattr(res, '_CHUNK_SIZE', chunk_size)
+    path = str(tmpdir.join(name))
+    with open(path, 'wt', encoding='utf-8', newline='') as out_file:
+        dump(STREAM_DATA, out_file)
+
+    assert list(res.iter_records(path)) == STREAM_DATA['images']
+    summary = dict(STREAM_DATA)
+    del summary['images']
+    assert res.read_summary(path) == summary
+    assert 'images_path' in res.read_summary(path, keys=['images_path'])
+
+    detections = res.JsonDetections(path)
+    assert len(detections) == 3
+    for record in reversed(STREAM_DATA['images']):
+        assert detections[record['image_name']] == \
+            [d[:5] for d in record['detections']]
+    with pytest.raises(KeyError):
+        detections['foo.png']
+
+
+def test_streaming_summary_first(tmpdir):
+    """Summary keys before the records are read without parsing them."""
+    path = tmpdir.join('output.json')
+    path.write('{"images_path": "/images", "images": [{}, garbage')
+    assert res.read_summary(str(path), keys=['images_path']) == \
+        {'images_path': '/images'}
+    with pytest.raises(ValueError):
+        res.read_summary(str(path))
+
+
+@pytest.mark.parametrize('content', ['[]', '{"images": {}}', '{1: 2}',
+                                     '{"images": [] "tp": 1}'])
+def test_streaming_invalid(tmpdir, content):
+    path = tmpdir.join('output.json')
+    path.write(content)
+    with pytest.raises(ValueError):
+        list(res.iter_records(str(path)))
@@ -20,6 +20,9 @@
 
 """Tests for common utilities."""
 
+import io
+
+from PIL import Image
 import pytest
 
 import wentral.utils as utils
@@ -38,9 +41,86 @@ def test_iou(box1, box2, expect_iou):
     assert got_iou == pytest.approx(expect_iou, 0.001)
 
 
+def test_iou_matrix():
+    boxes1 = [(0, 0, 10, 10), (0, 0, 0, 0), (5, 5, 15, 15, 0.9)]
+    boxes2 = [(0, 5, 10, 15), (0, 10, 10, 20), (0, 0, 10, 10), (1, 1, 2, 2)]
+    ious = utils.iou_matrix(boxes1, boxes2)
+    assert ious.shape == (3, 4)
+    for i, box1 in enumerate(boxes1):
+        for j, box2 in enumerate(boxes2):
+            assert ious[i, j] == utils.iou(box1[:4], box2[:4])
+
+
+def test_iou_matrix_empty():
+    assert utils.iou_matrix([], [(0, 0, 1, 1)]).shape == (0, 1)
+    assert utils.iou_matrix([(0, 0, 1, 1)], []).shape == (1, 0)
+
+
 def test_bounding_box():
     assert utils.bounding_box(
         (10, 20, 30, 40),
         (5, 50, 15, 60),
         (20, 30, 40, 50),
     ) == (5, 20, 40, 60)
+
+
+def _encoded_image(size, format, mode='RGB'):
+    data = io.BytesIO()
+    image = Image.new('RGB', size, (200, 100, 50))
+    if mode == 'P':
+        image = image.quantize()
+    elif mode != 'RGB':
+        image = image.convert(mode)
+    image.save(data, format=format)
+    data.seek(0)
+    return Image.open(data)
+
+
+@pytest.mark.parametrize('format', ['JPEG', 'PNG'])
+@pytest.mark.parametrize('input_size,expect_size', [
+    (None, (400, 300)),
+    ((400, 300), (400, 300)),   # Already at input size.
+    ((300, 300), (400, 300)),   # Can't reduce without going below.
+    ((200, 100), (200, 150)),   # Reduced by 2, limited by width.
+    ((100, 75), (100, 75)),     # Reduced by 4.
+    ((90, 70), (100, 75)),      # Factor is rounded down.
+])
+def test_load_reduced(format, input_size, expect_size):
+    image = utils.load_reduced(_encoded_image((400, 300), format),
+                               input_size)
+    assert image.size == expect_size
+    assert image.getpixel((0, 0))[0] == pytest.approx(200, abs=2)
+    assert utils.original_size(image) == (400, 300)
+
+
+@pytest.mark.parametrize('format,mode', [
+    ('PNG', 'P'),
+    ('GIF', 'P'),
+    ('PNG', '1'),
+    ('PNG', 'I;16'),
+])
+def test_load_reduced_modes(format, mode):
+    """Images in modes that PIL can't reduce are converted first."""
+    encoded = _encoded_image((400, 300), format, mode)
+    assert encoded.mode == mode
+    image = utils.load_reduced(encoded, (100, 75))
+    assert image.size == (100, 75)
+    assert utils.original_size(image) == (400, 300)
+    expect = _encoded_image((400, 300), format, mode).convert('RGB')
+    assert image.tobytes() == expect.reduce(4).tobytes()
+
+
+def test_load_reduced_decoded():
+    image = Image.new('RGB', (400, 300))
+    assert utils.load_reduced(image, (100, 75)).size == (400, 300)
+
+
+def test_scale_boxes():
+    boxes = [(10, 20, 30, 40, 0.9), (0, 0, 100, 75)]
+    image = utils.load_reduced(_encoded_image((400, 300), 'JPEG'), (100, 75))
+    assert utils.scale_boxes(boxes, image) == [
+        (40, 80, 120, 160, 0.9),
+        (0, 0, 400, 300),
+    ]
+    full = utils.load_reduced(_encoded_image((400, 300), 'JPEG'))
+    assert utils.scale_boxes(boxes, full) is boxes
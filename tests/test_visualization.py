@@ -53,7 +53,8 @@ def test_vis_match_set(match_set, tmpdir):
     MARK_COLOR = (69, 69, 69)
 
     image = Image.new('RGB', (100, 100), (255, 255, 255))
-    for box in match_set.detections + match_set.ground_truth:
+    boxes = match_set.detections.tolist() + match_set.ground_truth.tolist()
+    for box in boxes:
         # Mark each box with a colored pixel in order to check them after they
         # are extracted.
         image.putpixel((int(box[0]) + 1, int(box[1]) + 1), MARK_COLOR)
@@ -21,6 +21,8 @@
 """Web front end and benchmarking tool for web object detection models."""
 
 import argparse
+import functools
+import json
 import logging
 import sys
 
@@ -28,8 +30,14 @@ import paste.translogger as tl
 import waitress
 
 import wentral.benchmark as bm
+import wentral.checkpoint as cp
 import wentral.config as conf
+import wentral.constants as const
 import wentral.dataset as ds
+import wentral.detection_cache as dc
+import wentral.loadtest as lt
+import wentral.pack as pack
+import wentral.results as res
 import wentral.slicing_detector_proxy as sdp
 import wentral.webservice as ws
 
@@ -140,6 +148,107 @@ Recall: {0.recall:.2%}
 Precision: {0.precision:.2%}
 F1: {0.f1:.2%}
 mAP: {0.mAP:.2%}"""
+THROUGHPUT_TEMPLATE = 'Throughput: {0.images_per_second:.2f} images/s'
+MEGAPIXELS_TEMPLATE = ', {0.megapixels_per_second:.2f} megapixels/s'
+
+LATENCY_HEADER = """Latency (ms)         p50       p90       p99"""
+LATENCY_ROW = '{stage:12} {p50:9.2f} {p90:9.2f} {p99:9.2f}'
+
+
+MULTI_IOU_AP_TEMPLATE = 'AP@{:.2f}: {:.2%}'
+MULTI_IOU_MAP_TEMPLATE = 'mAP@[{:.2f}:{:.2f}]: {:.2%}'
+
+SWEEP_HEADER = """Threshold sweep:
+Confidence      TP      FP      FN  Recall  Precision      F1"""
+SWEEP_ROW = ('{confidence_threshold:10.4f} {tp:7d} {fp:7d} {fn:7d} '
+             '{recall:7.2%} {precision:10.2%} {f1:7.2%}')
+BEST_F1_TEMPLATE = """Best F1: {f1:.2%} at confidence threshold \
+{confidence_threshold:.4f}
+Recall: {recall:.2%}
+Precision: {precision:.2%}"""
+
+LOADTEST_TEMPLATE = """Requests: {0.request_count}
+Errors: {0.error_count} ({0.error_rate:.2%})
+Duration: {0.duration:.2f} s
+Throughput: {0.throughput:.2f} requests/s"""
+LOADTEST_LATENCY_TEMPLATE = """Latency (ms): p50 {p50:.2f}, p90 {p90:.2f}, \
+p99 {p99:.2f}, max {max:.2f}"""
+HISTOGRAM_ROW = '{:>12} {:8d} {}'
+
+
+def iou_list(spec):
+    """Parse a list of IoU cutoffs.
+
+    The list can be given as comma-separated values (e.g. "0.5,0.75") or as
+    a range: "START:STOP:STEP" (e.g. "0.5:0.95:0.05", STOP is included).
+
+    """
+    try:
+        if ':' not in spec:
+            return [float(x) for x in spec.split(',')]
+        start, stop, step = map(float, spec.split(':'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('Invalid IoU list: ' + spec)
+    if step <= 0 or stop < start:
+        raise argparse.ArgumentTypeError('Invalid IoU list: ' + spec)
+    count = int(round((stop - start) / step)) + 1
+    return [round(start + i * step, 10) for i in range(count)]
+
+
+def shard_spec(spec):
+    """Parse shard specification: "I/N" (shard I of N, starting from 1)."""
+    try:
+        shard, shard_count = map(int, spec.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('Invalid shard: ' + spec)
+    if not 1 <= shard <= shard_count:
+        raise argparse.ArgumentTypeError('Invalid shard: ' + spec)
+    return shard, shard_count
+
+
+def fraction(spec):
+    """Parse a fraction: a number greater than 0 and at most 1."""
+    try:
+        value = float(spec)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Invalid fraction: ' + spec)
+    if not 0 < value <= 1:
+        raise argparse.ArgumentTypeError('Invalid fraction: ' + spec)
+    return value
+
+
+def print_results(evaluation, sweep=False):
+    """Print the summary of benchmark results."""
+    print(BM_RESULTS_TEMPLATE.format(evaluation))
+    if evaluation.images_per_second is not None:
+        throughput = THROUGHPUT_TEMPLATE.format(evaluation)
+        if evaluation.megapixels_per_second is not None:
+            throughput += MEGAPIXELS_TEMPLATE.format(evaluation)
+        print(throughput)
+    stage_timings = evaluation.stage_timings()
+    if stage_timings:
+        print(LATENCY_HEADER)
+        for stage, timing in stage_timings.items():
+            print(LATENCY_ROW.format(stage=stage, **{
+                'p{}'.format(q): timing['p{}'.format(q)] * 1000
+                for q in const.LATENCY_PERCENTILES
+            }))
+    ap_by_iou = evaluation.ap_by_iou
+    if ap_by_iou:
+        for map_iou, ap in ap_by_iou.items():
+            print(MULTI_IOU_AP_TEMPLATE.format(map_iou, ap))
+        print(MULTI_IOU_MAP_TEMPLATE.format(
+            min(ap_by_iou),
+            max(ap_by_iou),
+            evaluation.multi_iou_mAP,
+        ))
+    if sweep:
+        print(SWEEP_HEADER)
+        for row in evaluation.threshold_sweep():
+            print(SWEEP_ROW.format(**row))
+        best_f1 = evaluation.best_f1_threshold()
+        if best_f1 is not None:
+            print(BEST_F1_TEMPLATE.format(**best_f1))
 
 
 @command(aliases=['bm'])
@@ -149,9 +258,99 @@ mAP: {0.mAP:.2%}"""
     help='Minimum IOU after which the detection is considered correct '
          '(default: 0.4)',
 )
+@arg(
+    '--matcher', choices=sorted(bm.MATCHERS), default=bm.DEFAULT_MATCHER,
+    help='Implementation of detection to ground truth matching (default: '
+         '{})'.format(bm.DEFAULT_MATCHER),
+)
+@arg(
+    '--map-iou', metavar='IOUS', type=iou_list,
+    help='Also calculate AP at these match IoUs and their average, e.g. '
+         '0.5:0.95:0.05 (range) or 0.5,0.75 (list)',
+)
+@arg(
+    '--sweep', action='store_true',
+    help='Calculate metrics at all confidence thresholds and find the '
+         'threshold with the best F1',
+)
+@arg(
+    '--cache-dir', metavar='PATH',
+    help='Directory for caching detector outputs (default: $WENTRAL_CACHE_DIR '
+         'or ~/.cache/wentral)',
+)
+@arg(
+    '--cache-size', metavar='MB', type=int,
+    default=const.DETECTION_CACHE_SIZE >> 20,
+    help='Maximum size of the detection cache in megabytes (default: '
+         '{})'.format(const.DETECTION_CACHE_SIZE >> 20),
+)
+@arg(
+    '--no-cache', action='store_true',
+    help='Don\'t use the detection cache',
+)
+@arg(
+    '--refresh-cache', action='store_true',
+    help='Run the detector even if detections are cached (and update the '
+         'cache)',
+)
+@arg(
+    '--checkpoint', metavar='JSONL_FILE',
+    help='Save results for each image into this file as soon as they are '
+         'ready (to allow resuming with --resume)',
+)
+@arg(
+    '--resume', action='store_true',
+    help='Resume interrupted benchmark from --checkpoint file (skip the '
+         'images that have results in it)',
+)
+@arg(
+    '--batch-size', '-b', metavar='N', type=int, default=1,
+    help='Pass images to the detector in batches of N (default: 1)',
+)
+@arg(
+    '--prefetch', metavar='N', type=int, default=0,
+    help='Decode up to N images ahead in background threads (default: 0, '
+         'not used with --jobs)',
+)
+@arg(
+    '--prefetch-memory', metavar='MB', type=int,
+    default=const.PREFETCH_MEMORY >> 20,
+    help='Memory budget for images decoded ahead in megabytes (default: '
+         '{})'.format(const.PREFETCH_MEMORY >> 20),
+)
+@arg(
+    '--jobs', '-j', metavar='N', type=int, default=1,
+    help='Number of worker processes that run detections in parallel '
+         '(default: 1)',
+)
+@arg(
+    '--limit', metavar='N', type=int,
+    help='Only evaluate N images (the first ones unless --sample or '
+         '--stratify is used)',
+)
+@arg(
+    '--sample', metavar='FRACTION', type=fraction,
+    help='Only evaluate a random sample of this fraction of the images',
+)
+@arg(
+    '--seed', metavar='S', type=int, default=0,
+    help='Seed that determines the sample (default: 0)',
+)
+@arg(
+    '--stratify', choices=ds.SampledDataset.STRATIFY,
+    help='Sample the same fraction of images with each number of boxes or '
+         'aspect ratio (on a logarithmic scale)',
+)
+@arg(
+    '--shard', metavar='I/N', type=shard_spec,
+    help='Only evaluate shard I of N of the dataset (combine the results of '
+         'all shards with wentral merge)',
+)
 @arg(
     '--output', '-o', metavar='JSON_FILE',
-    help='Output file for the summary in JSON format',
+    help='Output file for the results in JSON format (JSONL if the name '
+         'ends with .jsonl, binary if it ends with {})'
+         .format(res.BINARY_EXTENSION),
 )
 @arg(
     '--visualizations-path', '-z', metavar='PATH',
@@ -172,24 +371,114 @@ def benchmark(args):
     params = {
         'confidence_threshold': args.confidence_threshold,
         'match_iou': args.match_iou,
+        'matcher': args.matcher,
+        # Per-image results are streamed to the output file.
+        'keep_matchsets': False,
     }
 
+    if args.output:
+        params['results_writer'] = res.ResultsWriter(args.output, args.sweep)
+
+    if args.map_iou:
+        params['map_ious'] = args.map_iou
+
+    if not args.no_cache:
+        params['detection_cache'] = dc.DetectionCache(
+            args.cache_dir or dc.default_cache_dir(),
+            max_size=args.cache_size << 20,
+            refresh=args.refresh_cache,
+        )
+
     if args.visualizations_path:
         params['visualizations_path'] = args.visualizations_path
 
-    if args.dataset.endswith('.json'):
-        dataset = ds.JsonDataset(args.dataset)
-    else:
-        dataset = ds.LabeledDataset(args.dataset)
+    if args.batch_size > 1:
+        params['batch_size'] = args.batch_size
+
+    if args.jobs > 1:
+        # Each worker process will create its own detector.
+        params['jobs'] = args.jobs
+        detector_args = argparse.Namespace(**{
+            k: v for k, v in vars(args).items() if k != 'func'
+        })
+        params['detector_factory'] = functools.partial(conf.make_detector,
+                                                       detector_args)
+
+    if args.resume and not args.checkpoint:
+        parser.error('--resume requires --checkpoint')
+    if args.checkpoint:
+        params['checkpoint'] = cp.Checkpoint(args.checkpoint, args.resume)
+
+    dataset = load_dataset(args.dataset)
+
+    if args.limit is not None or args.sample or args.stratify:
+        dataset = ds.SampledDataset(
+            dataset,
+            limit=args.limit,
+            fraction=args.sample,
+            seed=args.seed,
+            stratify=args.stratify,
+        )
+
+    if args.shard:
+        dataset = ds.ShardedDataset(dataset, *args.shard)
+
+    if args.prefetch > 0:
+        params['prefetch'] = args.prefetch
+        params['prefetch_memory'] = args.prefetch_memory << 20
+
+    try:
+        evaluation = bm.evaluate(dataset, detector, **params)
+    finally:
+        if args.checkpoint:
+            params['checkpoint'].close()
+
+    evaluation.shard = args.shard
+
+    if not args.output or args.verbose > 0:
+        print_results(evaluation, args.sweep)
+
+    if args.output:
+        params['results_writer'].write(evaluation)
+
 
-    evaluation = bm.evaluate(dataset, detector, **params)
+@command()
+@arg(
+    '--sweep', action='store_true',
+    help='Calculate metrics at all confidence thresholds and find the '
+         'threshold with the best F1',
+)
+@arg(
+    '--output', '-o', metavar='JSON_FILE',
+    help='Output file for the merged results (JSONL if the name ends with '
+         '.jsonl, binary if it ends with {})'.format(res.BINARY_EXTENSION),
+)
+@arg(
+    '--verbose', '-v', action='count', default=0,
+    help='Increase the amount of debug output',
+)
+@arg(
+    'results', metavar='RESULTS_FILE', nargs='+',
+    help='Benchmark results of the shards (produced by wentral bm --shard)',
+)
+def merge(args):
+    """Merge benchmark results of dataset shards."""
+    params = {'keep_matchsets': False}
+    if args.output:
+        params['results_writer'] = res.ResultsWriter(args.output, args.sweep)
+
+    try:
+        evaluation = bm.merge(args.results, **params)
+    except Exception:
+        if args.output:
+            params['results_writer'].close()
+        raise
 
     if not args.output or args.verbose > 0:
-        print(BM_RESULTS_TEMPLATE.format(evaluation))
+        print_results(evaluation, args.sweep)
 
     if args.output:
-        with open(args.output, 'wt', encoding='utf-8') as out_file:
-            evaluation.json_dump(out_file)
+        params['results_writer'].write(evaluation)
 
 
 @command(aliases=['ws'])
@@ -224,6 +513,122 @@ def webserve(args):
     waitress.serve(lapp, port=args.port)
 
 
+def load_dataset(path):
+    """Load dataset from a directory, a packed dataset or a results file."""
+    if path.endswith(('.json', '.jsonl', res.BINARY_EXTENSION)):
+        return ds.JsonDataset(path, stream=True)
+    if pack.is_packed(path):
+        return ds.PackedDataset(path)
+    return ds.LabeledDataset(path)
+
+
+@command('pack')
+@arg(
+    '--shard-size', '-s', metavar='MB', type=int,
+    default=const.PACK_SHARD_SIZE >> 20,
+    help='Maximum size of the images in one shard file in megabytes '
+         '(default: {})'.format(const.PACK_SHARD_SIZE >> 20),
+)
+@arg(
+    '--verbose', '-v', action='count', default=0,
+    help='Increase the amount of debug output',
+)
+@arg(
+    'dataset', metavar='DATASET',
+    help='Directory with images and marked regions (or JSON file with '
+         'benchmark results)',
+)
+@arg(
+    'output', metavar='OUTPUT_DIR',
+    help='Directory for the packed dataset files',
+)
+def pack_dataset(args):
+    """Pack a dataset into a few large files for faster loading."""
+    paths = pack.write_pack(load_dataset(args.dataset), args.output,
+                            shard_size=args.shard_size << 20)
+    for path in paths:
+        print(path)
+
+
+@command(aliases=['lt'])
+@arg(
+    '--server-url', '-s', metavar='URL', required=True,
+    help='URL of the web service (started with wentral ws)',
+)
+@arg(
+    '--concurrency', '-n', metavar='N', type=int, default=1,
+    help='Number of clients that send requests in parallel (default: 1)',
+)
+@arg(
+    '--rate', '-r', metavar='RPS', type=float,
+    help='Send requests at fixed rate (requests per second) instead of '
+         'waiting for responses; --concurrency limits requests in flight',
+)
+@arg(
+    '--requests', metavar='N', type=int,
+    help='Total number of requests (the images are reused if necessary)',
+)
+@arg(
+    '--duration', '-t', metavar='SECONDS', type=float,
+    help='Stop sending requests after this time',
+)
+@arg(
+    '--confidence-threshold', '-c', metavar='X', type=float,
+    help='Confidence threshold sent with the requests',
+)
+@arg(
+    '--output', '-o', metavar='JSON_FILE',
+    help='Output file for the results in JSON format',
+)
+@arg(
+    '--verbose', '-v', action='count', default=0,
+    help='Increase the amount of debug output',
+)
+@arg(
+    'dataset', metavar='DATASET',
+    help='Directory with images (or JSON file with benchmark results) that '
+         'are sent to the web service',
+)
+def loadtest(args):
+    """Measure performance of the web service under load."""
+    params = {}
+    if args.confidence_threshold is not None:
+        params['confidence_threshold'] = args.confidence_threshold
+
+    result = lt.run(
+        args.server_url,
+        load_dataset(args.dataset),
+        concurrency=args.concurrency,
+        rate=args.rate,
+        request_count=args.requests,
+        duration=args.duration,
+        **params
+    )
+
+    print(LOADTEST_TEMPLATE.format(result))
+    if result.latencies:
+        print(LOADTEST_LATENCY_TEMPLATE.format(**{
+            k: v * 1000 for k, v in result.percentiles().items()
+        }))
+        histogram = result.histogram()
+        # Skip empty buckets before the first and after the last request.
+        nonempty = [i for i, (_, count) in enumerate(histogram) if count]
+        histogram = histogram[nonempty[0]:nonempty[-1] + 1]
+        most = max(count for _, count in histogram)
+        for bound, count in histogram:
+            label = '<= {} ms'.format(bound) if bound else '> {} ms'.format(
+                lt.LATENCY_BUCKETS[-1],
+            )
+            print(HISTOGRAM_ROW.format(label, count,
+                                       '#' * (40 * count // most)))
+    for error, count in sorted(result.errors.items()):
+        print('Error ({} times): {}'.format(count, error))
+
+    if args.output:
+        with open(args.output, 'wt', encoding='utf-8') as out_file:
+            json.dump(result.to_dict(), out_file, indent=2, sort_keys=True)
+
+
 # Logging levels set by zero, one or two -v flags.
 LOGLEVELS = {
     0: logging.WARNING,
@@ -20,10 +20,17 @@
 
 """Compare detections to the ground truth."""
 
-import json
+import array
 import logging
+import multiprocessing as mp
 import os
+import time
 
+import numpy as np
+
+import wentral.constants as const
+import wentral.dataset as ds
+import wentral.results as results
 import wentral.utils as u
 import wentral.visualization as vis
 
@@ -53,6 +60,125 @@ def _f1(tp, fp, fn):
     return 2 * p * r / (p + r)
 
 
+def _match_python(ground_truth, detections, match_ious):
+    """Match ground truth boxes to detections (pure Python implementation).
+
+    Parameters
+    ----------
+    ground_truth : list of tuple (x0, y0, x1, y1, ...)
+        Expected boxes.
+    detections : list of tuple (x0, y0, x1, y1, ...)
+        Detected boxes sorted by confidence (from high to low).
+    match_ious : list of float
+        IoU cutoffs used for matching detected with expected (matching is
+        done separately for each of them).
+
+    Returns
+    -------
+    matches : list of list of int or None
+        For each IoU cutoff and each ground truth box, the index of the
+        matching detection or None if no detection matches it. Each ground
+        truth box is matched to the first detection with sufficient IoU that
+        is not already matched to an earlier ground truth box.
+
+    """
+    all_matches = []
+
+    for match_iou in match_ious:
+        matches = []
+        matched = set()
+
+        for true_box in ground_truth:
+            for j, detection in enumerate(detections):
+                if j in matched:
+                    continue  # Already matched to some ground truth.
+                if u.iou(true_box[:4], detection[:4]) >= match_iou:
+                    matched.add(j)
+                    matches.append(j)
+                    break
+            else:  # No detections matched.
+                matches.append(None)
+
+        all_matches.append(matches)
+
+    return all_matches
+
+
+def _greedy_match(hits):
+    """Match ground truth to detections given a matrix of matching pairs."""
+    available = np.ones(hits.shape[1], dtype=bool)
+    matches = []
+
+    for row in hits:
+        candidates = row & available
+        j = int(np.argmax(candidates))
+        if candidates[j]:
+            available[j] = False
+            matches.append(j)
+        else:
+            matches.append(None)
+
+    return matches
+
+
+def _match_numpy(ground_truth, detections, match_ious):
+    """Match ground truth boxes to detections (vectorized implementation).
+
+    Calculates all the IoUs at once with `utils.iou_matrix` and then performs
+    the same greedy assignment as `_match_python` (and returns the same
+    result). The IoU matrix is shared by all the IoU cutoffs so each extra
+    cutoff costs just one more assignment pass.
+
+    """
+    if len(detections) == 0:
+        return [[None] * len(ground_truth) for _ in match_ious]
+
+    ious = u.iou_matrix(ground_truth, detections)
+    return [_greedy_match(ious >= match_iou) for match_iou in match_ious]
+
+
+# Implementations of ground truth to detection matching.
+MATCHERS = {
+    'numpy': _match_numpy,
+    'python': _match_python,
+}
+DEFAULT_MATCHER = 'numpy'
+
+
+# Columnar record types for detections and ground truth boxes. Storing them in
+# numpy structured arrays takes several times less memory than keeping a
+# tuple of Python objects for each box.
+DETECTION_DTYPE = np.dtype([
+    ('x0', float), ('y0', float), ('x1', float), ('y1', float),
+    ('confidence', float), ('is_true', bool),
+])
+GROUND_TRUTH_DTYPE = np.dtype([
+    ('x0', float), ('y0', float), ('x1', float), ('y1', float),
+    ('confidence', float),
+])
+BOX_FIELDS = ['x0', 'y0', 'x1', 'y1']
+
+
+def _to_records(rows, dtype, width):
+    """Convert a list of boxes to a structured array.
+
+    The first `width` elements of each row are stored in the first `width`
+    fields of the record, the remaining fields are set to zero (False).
+
+    """
+    records = np.zeros(len(rows), dtype=dtype)
+    if len(rows) > 0:
+        values = np.array([tuple(row[:width]) for row in rows], dtype=float)
+        for i, name in enumerate(dtype.names[:width]):
+            records[name] = values[:, i]
+    return records
+
+
+def _boxes(records):
+    """Return the boxes from a structured array as an N x 4 array."""
+    return np.stack([records[name] for name in BOX_FIELDS], axis=1)
+
+
 class MatchSet:
     """Detected and expected boxes and information about their matching.
 
@@ -60,15 +186,21 @@ class MatchSet:
     ----------
     image_name : str
         Name of the image in which the objects are detected.
-    detections : list of tuple (x0, y0, x1, y1, confidence, is_true)
-        All detections regardless of confidence but without duplicates.
-    ground_truth : list of tuple (x0, y0, x1, y1, detection_confidence)
-        Expected boxes and confidence levels at which they are detected.
+    detections : numpy array of DETECTION_DTYPE
+        All detections regardless of confidence but without duplicates. Each
+        record contains x0, y0, x1, y1, confidence and is_true.
+    ground_truth : numpy array of GROUND_TRUTH_DTYPE
+        Expected boxes (x0, y0, x1, y1) and confidence levels at which they
+        are detected.
     confidence_threshold : float
         Minimum confidence for detections to be counted (for calculating tp,
-        tn, fp, recall and precision).
+        tn, fp, recall and precision). Use `repartition` to change it.
     match_iou : float
         IoU cutoff used for matching detected with expected.
+    iou_matches : dict of float -> numpy array of bool
+        Results of matching with additional IoU cutoffs (requested via
+        `map_ious` parameter) for calculating AP at multiple IoUs. The arrays
+        indicate whether each of the detections is a true positive.
     tp : int
         Number of true positives (expected and detected).
     fn : int
@@ -79,6 +211,13 @@ class MatchSet:
         Ratio of expected boxes that was detected.
     precision : float
         Ratio of detected boxes that was expected.
+    timings : dict of str -> dict
+        Wall and CPU time (in seconds) spent on each stage of processing the
+        image (see `const.BENCHMARK_STAGES`), e.g.
+        `{'detect': {'wall': 0.5, 'cpu': 0.1}}`. Stages that were skipped
+        (e.g. decoding and detection for cached detections) are missing.
+    pixels : int
+        Number of pixels in the image (None if unknown).
 
     """
 
@@ -94,21 +233,33 @@ class MatchSet:
         ground_truth : list of tuple (x0, y0, x1, y1)
             Expected boxes.
         params : dict
-            Parameters for the match calculations, such as confidence_threshold
-            and match_iou.
+            Parameters for the match calculations, such as
+            confidence_threshold, match_iou, map_ious (list of additional IoU
+            cutoffs) and matcher (one of the keys of `MATCHERS`).
 
         """
         self.image_name = image_name
-        # Sort detections by confidence (from high to low).
-        self.detections = sorted(detections, key=lambda d: d[4], reverse=True)
-        self.ground_truth = ground_truth
+        detections = _to_records(detections, DETECTION_DTYPE, 5)
+        # Sort detections by confidence (from high to low), stable sort keeps
+        # the original order of detections with the same confidence.
+        order = np.argsort(-detections['confidence'], kind='stable')
+        self.detections = detections[order]
+        self.ground_truth = _to_records(ground_truth, GROUND_TRUTH_DTYPE, 4)
         self.confidence_threshold = params['confidence_threshold']
         self.match_iou = params['match_iou']
 
-        self._mark_true_false()
+        self.iou_matches = {}
+        self.timings = {}
+        self.pixels = None
+
+        self._mark_true_false(
+            params.get('matcher', DEFAULT_MATCHER),
+            params.get('map_ious') or [],
+        )
+        self._partition()
         self._calculate_metrics()
 
-    def _mark_true_false(self):
+    def _mark_true_false(self, matcher, map_ious):
         """Mark detections as true or false.
 
         Goes through ground truth boxes and finds highest confidence matching
@@ -116,55 +267,109 @@ class MatchSet:
         as its detection confidece. Detection gets marked as true positive.
         Non-matched true boxes get 0 confidence and non-matched detections are
         marked as false positives.
+
+        Additionally, the matching is performed for each IoU cutoff in
+        `map_ious` and the results for those are saved in `iou_matches`.
+
+        Parameters
+        ----------
+        matcher : str
+            Name of the matching implementation (see `MATCHERS`).
+        map_ious : list of float
+            Additional IoU cutoffs (for calculating AP at multiple IoUs).
+
         """
-        for i in range(len(self.ground_truth)):
-            true_box = self.ground_truth[i]
-            for j in range(len(self.detections)):
-                detection = self.detections[j]
-                if len(detection) > 5:
-                    continue  # Already matched to some ground truth.
-                if u.iou(true_box, detection[:4]) >= self.match_iou:
-                    # Add detection confidence to ground_truth box.
-                    self.ground_truth[i] += (detection[4],)
-                    # Mark detection as true positive.
-                    self.detections[j] += (True,)
-                    break
-            else:  # No detections matched.
-                self.ground_truth[i] += (0,)
+        ground_truth = _boxes(self.ground_truth)
+        detections = _boxes(self.detections)
+        if matcher == 'python':
+            # Pure Python implementation works with tuples.
+            ground_truth = ground_truth.tolist()
+            detections = detections.tolist()
+
+        match = MATCHERS[matcher]
+        match_ious = [self.match_iou] + list(map_ious)
+        gt_matches, *extra_matches = match(ground_truth, detections,
+                                           match_ious)
+
+        for map_iou, matches in zip(map_ious, extra_matches):
+            is_true = np.zeros(len(self.detections), dtype=bool)
+            is_true[[j for j in matches if j is not None]] = True
+            self.iou_matches[map_iou] = is_true
+
+        for i, j in enumerate(gt_matches):
+            if j is not None:
+                # Add detection confidence to ground_truth box.
+                self.ground_truth[i]['confidence'] = \
+                    self.detections[j]['confidence']
+                self.detections[j]['is_true'] = True
+
+    def _partition(self):
+        """Split the boxes according to `confidence_threshold`.
+
+        Ground truth is split into detected and missed and the detections
+        above the threshold into true and false. The parts are converted to
+        lists when they are first requested and then reused.
 
-        for j in range(len(self.detections)):
-            if len(self.detections[j]) != 6:  # Wasn't matched: false positive.
-                self.detections[j] += (False,)
+        """
+        gt = self.ground_truth
+        det = self.detections
+        detected_gt = gt['confidence'] >= self.confidence_threshold
+        counted = det[det['confidence'] >= self.confidence_threshold]
+        self._parts = {
+            'detected_ground_truth': gt[detected_gt],
+            'missed_ground_truth': gt[~detected_gt],
+            'true_detections': counted[counted['is_true']],
+            'false_detections': counted[~counted['is_true']],
+        }
+        self._part_lists = {}
+
+    def _part(self, name):
+        if name not in self._part_lists:
+            self._part_lists[name] = self._parts[name].tolist()
+        return self._part_lists[name]
+
+    def repartition(self, confidence_threshold):
+        """Change the confidence threshold without matching the boxes again.
+
+        The matching of detections to ground truth doesn't depend on the
+        confidence threshold, so only the split of the boxes and the metrics
+        (tp, fn, fp, recall, precision and f1) are updated.
+
+        Parameters
+        ----------
+        confidence_threshold : float
+            New minimum confidence for detections to be counted.
+
+        """
+        self.confidence_threshold = confidence_threshold
+        self._partition()
+        self._calculate_metrics()
 
     @property
     def detected_ground_truth(self):
         """The list of ground truth boxes that have been detected."""
-        return [box for box in self.ground_truth
-                if box[4] >= self.confidence_threshold]
+        return self._part('detected_ground_truth')
 
     @property
     def missed_ground_truth(self):
         """The list of ground truth boxes that have not been detected."""
-        return [box for box in self.ground_truth
-                if box[4] < self.confidence_threshold]
+        return self._part('missed_ground_truth')
 
     @property
     def true_detections(self):
         """The list of detections that matched some ground truth boxes."""
-        return [det for det in self.detections
-                if det[4] >= self.confidence_threshold and det[5]]
+        return self._part('true_detections')
 
     @property
     def false_detections(self):
         """The list of detections that don't match any ground truth boxes."""
-        return [det for det in self.detections
-                if det[4] >= self.confidence_threshold and not det[5]]
+        return self._part('false_detections')
 
     def _calculate_metrics(self):
         """Calculate metrics: tp, fn, fp, recall and precision."""
-        self.tp = len(self.detected_ground_truth)
-        self.fn = len(self.missed_ground_truth)
-        self.fp = len(self.false_detections)
+        self.tp = len(self._parts['detected_ground_truth'])
+        self.fn = len(self._parts['missed_ground_truth'])
+        self.fp = len(self._parts['false_detections'])
 
         self.recall = _recall(self.tp, self.fn)
         self.precision = _precision(self.tp, self.fp)
@@ -174,20 +379,277 @@ class MatchSet:
                      'Precision:{0.precision:.2%} F1:{0.f1}'.format(self))
 
     def to_dict(self):
-        return dict(self.__dict__)
+        ret = {k: v for k, v in self.__dict__.items()
+               if not k.startswith('_')}
+        ret['detections'] = self.detections.tolist()
+        ret['ground_truth'] = self.ground_truth.tolist()
+        ret['iou_matches'] = {
+            map_iou: is_true.tolist()
+            for map_iou, is_true in self.iou_matches.items()
+        }
+        return ret
+
+    @classmethod
+    def from_dict(cls, data):
+        """Reconstruct a match set from the output of `to_dict`.
+
+        The data can also come from JSON (e.g. image records of benchmark
+        output), so the arrays and numeric keys are restored.
+
+        """
+        ms = cls.__new__(cls)
+        ms.__dict__.update(data)
+        ms.detections = np.array([tuple(d) for d in data['detections']],
+                                 dtype=DETECTION_DTYPE)
+        ms.ground_truth = np.array([tuple(gt) for gt in data['ground_truth']],
+                                   dtype=GROUND_TRUTH_DTYPE)
+        ms.iou_matches = {
+            float(map_iou): np.array(is_true, dtype=bool)
+            for map_iou, is_true in data.get('iou_matches', {}).items()
+        }
+        ms.timings = data.get('timings', {})
+        ms.pixels = data.get('pixels')
+        ms._partition()
+        return ms
 
 
 # Average precision calculation code is based on:
 # https://medium.com/@jonathan_hui/map-mean-average-precision-for-object-detection-45c121a31173
+def _aggregate_counts(confidence, true_count, false_count):
+    """Sum up true and false positive counts by confidence level.
+
+    Parameters
+    ----------
+    confidence : numpy array of float
+        Confidence levels (can contain duplicates).
+    true_count : numpy array of int
+        Number of true positives at each of the confidence levels.
+    false_count : numpy array of int
+        Number of false positives at each of the confidence levels.
+
+    Returns
+    -------
+    counts : (confidence, true_count, false_count)
+        Arrays of distinct confidence levels in decreasing order and the total
+        number of true and false positives detected with each of them.
+
+    """
+    levels, inverse = np.unique(confidence, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    totals = [
+        np.bincount(inverse, weights=count, minlength=len(levels))
+        .astype(np.int64)[::-1]
+        for count in [true_count, false_count]
+    ]
+    return (levels[::-1], *totals)
+
+
+def _count_by_confidence(confidence, is_true):
+    """Count true and false positive detections at each confidence level.
+
+    Parameters
+    ----------
+    confidence : numpy array of float
+        Confidence with which each of the detections is detected.
+    is_true : numpy array of bool
+        Indication of whether each of the detections is a true positive or a
+        false positive.
+
+    Returns
+    -------
+    counts : (confidence, true_count, false_count)
+        Arrays of distinct confidence levels in decreasing order and the number
+        of true and false positives detected with each of them.
+
+    """
+    is_true = np.asarray(is_true, dtype=bool)
+    return _aggregate_counts(np.asarray(confidence, dtype=float),
+                             is_true, ~is_true)
+
+
+def _detection_columns(detections):
+    """Extract confidence and is_true columns from detection records.
+
+    Parameters
+    ----------
+    detections : numpy array of DETECTION_DTYPE or list of tuple
+        Detections as a structured array (e.g. `MatchSet.detections`) or as
+        a list of tuples with last two elements of each being confidence
+        with which it's detected and the indication of whether it's a true
+        positive or false positive.
+
+    Returns
+    -------
+    confidence : numpy array of float
+    is_true : numpy array of bool
+
+    """
+    if isinstance(detections, np.ndarray) and detections.dtype.names:
+        return detections['confidence'], detections['is_true']
+    confidence = np.array([d[-2] for d in detections], dtype=float)
+    is_true = np.array([d[-1] for d in detections], dtype=bool)
+    return confidence, is_true
+
+
+class _ConfidenceCounts:
+    """Running counts of true and false positives by confidence level.
+
+    Added detections are buffered and periodically aggregated so that the
+    memory use is bounded by the number of distinct confidence levels rather
+    than by the number of detections.
+
+    """
+
+    # Minimal number of buffered records that triggers the aggregation.
+    BUFFER_SIZE = 1 << 16
+
+    def __init__(self):
+        self._chunks = [_count_by_confidence([], [])]
+        self._buffered = 0
+
+    def add(self, confidence, is_true):
+        """Add detections given by their confidence and is_true columns."""
+        is_true = np.asarray(is_true, dtype=bool)
+        self._chunks.append((confidence, is_true, ~is_true))
+        self._buffered += len(confidence)
+        if self._buffered > max(self.BUFFER_SIZE, len(self._chunks[0][0])):
+            self._aggregate()
+
+    def _aggregate(self):
+        if self._buffered > 0:
+            columns = [np.concatenate(column) for column in zip(*self._chunks)]
+            self._chunks = [_aggregate_counts(*columns)]
+            self._buffered = 0
+
+    @property
+    def counts(self):
+        """Aggregated counts (see `_count_by_confidence`)."""
+        self._aggregate()
+        return self._chunks[0]
+
+
+def _cumulative_counts(confidence_counts, gt_count):
+    """Calculate tp, fp and fn at each confidence threshold.
+
+    Parameters
+    ----------
+    confidence_counts : (confidence, true_count, false_count)
+        Number of true and false positives detected with each confidence (see
+        `_count_by_confidence`).
+    gt_count : int
+        Number of ground truth boxes.
+
+    Returns
+    -------
+    counts : (confidence, tp, fp, fn)
+        Arrays of counts of true positives, false positives and false
+        negatives when only detections with at least given confidence are
+        counted. Confidence levels are in decreasing order.
+
+    """
+    confidence, true_count, false_count = confidence_counts
+    tp = np.cumsum(true_count)
+    fp = np.cumsum(false_count)
+    return confidence, tp, fp, gt_count - tp
+
+
+def _precision_array(tp, fp):
+    """Vectorized version of `_precision`."""
+    return np.where(fp == 0, 1.0, tp / np.maximum(tp + fp, 1))
+
+
+def _recall_array(tp, fn):
+    """Vectorized version of `_recall`."""
+    return np.where(fn == 0, 1.0, tp / np.maximum(tp + fn, 1))
+
+
+def threshold_sweep(confidence_counts, gt_count):
+    """Calculate metrics at all relevant confidence thresholds.
+
+    Parameters
+    ----------
+    confidence_counts : (confidence, true_count, false_count)
+        Number of true and false positives detected with each confidence (see
+        `_count_by_confidence`).
+    gt_count : int
+        Number of ground truth boxes.
+
+    Returns
+    -------
+    sweep : list of dict
+        Metrics that would be obtained with `confidence_threshold` set to each
+        confidence of some detection, in decreasing order of the threshold.
+        Each dict contains confidence_threshold, tp, fp, fn, precision, recall
+        and f1.
+
+    """
+    cumulative_counts = _cumulative_counts(confidence_counts, gt_count)
+    return [
+        {
+            'confidence_threshold': c,
+            'tp': tp,
+            'fp': fp,
+            'fn': fn,
+            'precision': _precision(tp, fp),
+            'recall': _recall(tp, fn),
+            'f1': _f1(tp, fp, fn),
+        }
+        for c, tp, fp, fn in zip(*(a.tolist() for a in cumulative_counts))
+    ]
+
+
+def _prc_arrays(confidence_counts, gt_count):
+    """Return precision-recall curve as arrays (see below)."""
+    c, tp, fp, fn = _cumulative_counts(confidence_counts, gt_count)
+
+    # Detections at the same confidence level are sorted arbitrarily so we
+    # only produce one point per confidence level. The start point is at c=1
+    # (it's needed in case the highest confidence prediction is a true one,
+    # since there will be no recall=0 point in this case). If some detections
+    # have confidence of 1 (or more), they are all counted in the start point.
+    start = np.count_nonzero(c >= 1)
+    c = np.concatenate([[1], c[start:], [0]])
+    tp = np.concatenate([[0], tp])[start:]
+    fp = np.concatenate([[0], fp])[start:]
+    fn = np.concatenate([[gt_count], fn])[start:]
+
+    # The end point is needed when recall=1 is not attained at any c. We take
+    # it by definition that at c=0 any box is a detection so everything is
+    # recalled but precision=0.
+    precision = np.append(_precision_array(tp, fp), 0)
+    recall = np.append(_recall_array(tp, fn), 1)
+    return c, precision, recall
+
+
+def _precision_recall_curve_from_counts(confidence_counts, gt_count):
+    """Return precision-recall curve (PRC) from counts of detections.
+
+    Parameters
+    ----------
+    confidence_counts : (confidence, true_count, false_count)
+        Number of true and false positives detected with each confidence (see
+        `_count_by_confidence`).
+    gt_count : int
+        Number of ground truth boxes.
+
+    Returns
+    -------
+    prc : list of (confidence, precision, recall)
+        Points of precision-recall curve in the order of decreasing confidence
+        (increasing recall).
+
+    """
+    prc = _prc_arrays(confidence_counts, gt_count)
+    return list(zip(*(a.tolist() for a in prc)))
+
+
 def _precision_recall_curve(detections, ground_truth):
     """Return precision-recall curve (PRC).
 
     Parameters
     ----------
-    detections : list of (..., confidence, is_true)
-        List of detection records as tuples with last two elements of each
-        being confidence with which it's detected and the indication of whether
-        it's a true positive or false positive.
+    detections : numpy array of DETECTION_DTYPE or list of (..., c, is_true)
+        Detection records (see `_detection_columns`).
     ground_truth : list of tuple
         Ground truth records. We only care about how many of them there are.
 
@@ -198,37 +660,15 @@ def _precision_recall_curve(detections, ground_truth):
         (increasing recall).
 
     """
-    tp = fp = 0
-    fn = len(ground_truth)
-    prc = []
-    last_c = 1
-
-    # Go through detections in decreasing confidence order.
-    for detection in sorted(detections, key=lambda d: d[-2], reverse=True):
-        c, is_true = detection[-2:]
-
-        if c < last_c:
-            # Detections at the same confidence level are sorted arbitrarily so
-            # we only produce points when confidence changes.
-            prc.append((last_c, _precision(tp, fp), _recall(tp, fn)))
-            last_c = c
-
-        if is_true:
-            fn -= 1
-            tp += 1
-        else:
-            fp += 1
+    return _precision_recall_curve_from_counts(
+        _count_by_confidence(*_detection_columns(detections)),
+        len(ground_truth),
+    )
 
-    # Add last point that would not be generated inside the loop.
-    prc.append((last_c, _precision(tp, fp), _recall(tp, fn)))
 
-    # Add the end point (start point (1, 1, 0) is added by the loop). The
-    # start point is needed in case the highest confidence prediction is a
-    # true one, since there will be no recall=0 point in this case. The end
-    # point is needed when recall=1 is not attained at any c. We take it by
-    # definition that at c=0 any box is a detection so everything is recalled
-    # but precision=0.
-    return prc + [(0, 0, 1)]
+def _interpolate_precision(precision):
+    """Replace precision with the maximum at given or higher recall."""
+    return np.maximum.accumulate(precision[::-1])[::-1]
 
 
 def _interpolate_prc(prc):
@@ -247,14 +687,15 @@ def _interpolate_prc(prc):
     iprc : list of (confidence, interpolated_precision, recall)
 
     """
-    iprc = []
-    interpolated_precision = 0
+    c, precision, recall = np.array(prc, dtype=float).reshape(-1, 3).T
+    precision = _interpolate_precision(precision)
+    return list(zip(c.tolist(), precision.tolist(), recall.tolist()))
 
-    for c, precision, recall in reversed(prc):
-        interpolated_precision = max(precision, interpolated_precision)
-        iprc.append((c, interpolated_precision, recall))
 
-    return list(reversed(iprc))
+def _auc_arrays(precision, recall):
+    """Compute area under precision-recall curve given as arrays."""
+    return float(np.sum((precision[1:] + precision[:-1]) / 2
+                        * np.diff(recall)))
 
 
 def _auc(prc):
@@ -273,10 +714,8 @@ def _auc(prc):
             sum((p[i+1] + p[i]) / 2 * (r[i+1] - r[i]))
 
     """
-    return sum(
-        (prc[i + 1][1] + prc[i][1]) / 2 * (prc[i + 1][2] - prc[i][2])
-        for i in range(len(prc) - 1)
-    )
+    _, precision, recall = np.array(prc, dtype=float).reshape(-1, 3).T
+    return _auc_arrays(precision, recall)
 
 
 def average_precision(detections, ground_truth):
@@ -284,10 +723,11 @@ def average_precision(detections, ground_truth):
 
     Parameters
     ----------
-    detections : list of (..., confidence, is_true)
-        List of detection records as tuples with last two elements of each
-        being confidence with which it's detected and the indication of whether
-        it's a true positive or false positive.
+    detections : numpy array of DETECTION_DTYPE or list of (..., c, is_true)
+        Detections as a structured array (e.g. `MatchSet.detections`) or as
+        a list of tuples with last two elements of each being confidence
+        with which it's detected and the indication of whether it's a true
+        positive or false positive.
     ground_truth : list of tuple
         Ground truth records. We only care about how many of them there are.
 
@@ -298,14 +738,30 @@ def average_precision(detections, ground_truth):
         precision-recall curve.
 
     """
-    prc = _precision_recall_curve(detections, ground_truth)
-    iprc = _interpolate_prc(prc)
-    return _auc(iprc)
+    return _average_precision_from_counts(
+        _count_by_confidence(*_detection_columns(detections)),
+        len(ground_truth),
+    )
+
+
+def _average_precision_from_counts(confidence_counts, gt_count):
+    """Calculate average precision from counts of detections.
+
+    See `_precision_recall_curve_from_counts` for description of parameters.
+
+    """
+    _, precision, recall = _prc_arrays(confidence_counts, gt_count)
+    return _auc_arrays(_interpolate_precision(precision), recall)
 
 
 class Evaluation:
     """Summary of detections, their accuracy and overall statistics.
 
+    The statistics are updated incrementally as match sets are added via
+    `add_matchset` so the evaluation can be built while the benchmark is
+    running. Unless `keep_matchsets` is set, the match sets themselves are not
+    stored and the memory they occupy can be reclaimed.
+
     Attributes
     ----------
     dataset : LabeledDataset
@@ -313,7 +769,12 @@ class Evaluation:
     detector : Detector (has .detect(image, path) -> boxes)
         Detector that was evaluated.
     matchsets : list of MatchSet
-        Information about performance on individual images.
+        Information about performance on individual images (empty unless
+        `keep_matchsets` is True).
+    keep_matchsets : bool
+        Store added match sets in `matchsets`.
+    image_count : int
+        Number of evaluated images.
     tp : int
         Number of true positives (expected and detected).
     fn : int
@@ -327,32 +788,194 @@ class Evaluation:
     mAP : float
         Mean average precision (actually just average precision beause we have
         only one class).
+    ap_by_iou : dict of float -> float
+        Average precision at additional IoU cutoffs (if match sets contain
+        results of matching at them, see `MatchSet.iou_matches`).
+    multi_iou_mAP : float
+        Average of `ap_by_iou` values, e.g. COCO-style mAP@[.5:.95] (None if
+        there are no additional IoU cutoffs).
+    wall_time : float
+        Duration of the benchmark run in seconds (None if unknown).
+    pixel_count : int
+        Total number of pixels in the images (where it's known).
+    images_per_second : float
+        Throughput of the benchmark (None if `wall_time` is unknown).
+    megapixels_per_second : float
+        Throughput of the benchmark (None if `wall_time` or the sizes of the
+        images are unknown, e.g. when the images were not opened).
+    shard : (int, int)
+        Index of the shard and the number of shards if only a shard of the
+        dataset was evaluated (see `dataset.ShardedDataset`), otherwise None.
+    match_params : dict
+        Matching parameters (`confidence_threshold`, `match_iou` and
+        `map_ious`) if they are known, otherwise None.
 
     """
 
-    def __init__(self, dataset, detector, matchsets):
+    def __init__(self, dataset, detector, matchsets=(), keep_matchsets=True):
         self.dataset = dataset
         self.detector = detector
-        self.matchsets = matchsets
-        self.image_count = len(matchsets)
+        self.keep_matchsets = keep_matchsets
+        self.matchsets = []
+        self.image_count = 0
 
         self.tp = 0
         self.fn = 0
         self.fp = 0
+
+        self.wall_time = None
+        self.shard = None
+        self.match_params = None
+        self.pixel_count = 0
+        # Wall and CPU times of each stage for each image.
+        self._stage_times = {}
+
+        # Data for average precision calculation.
+        self._gt_count = 0
+        self._confidence_counts = _ConfidenceCounts()
+        self._iou_confidence_counts = {}
+        self._mAP = None
+
         for ms in matchsets:
-            self.tp += ms.tp
-            self.fn += ms.fn
-            self.fp += ms.fp
+            self.add_matchset(ms)
+
+    def add_matchset(self, ms):
+        """Update the statistics with the results for one more image."""
+        self.image_count += 1
+        self.tp += ms.tp
+        self.fn += ms.fn
+        self.fp += ms.fp
+
+        self._gt_count += len(ms.ground_truth)
+        confidence = ms.detections['confidence']
+        self._confidence_counts.add(confidence, ms.detections['is_true'])
+        for map_iou, is_true in ms.iou_matches.items():
+            self._iou_confidence_counts.setdefault(
+                map_iou, _ConfidenceCounts(),
+            ).add(confidence, is_true)
+        self._mAP = None
+
+        if ms.pixels is not None:
+            self.pixel_count += ms.pixels
+        for stage, timing in ms.timings.items():
+            wall, cpu = self._stage_times.setdefault(
+                stage, (array.array('d'), array.array('d')),
+            )
+            wall.append(timing['wall'])
+            cpu.append(timing['cpu'])
+
+        if self.keep_matchsets:
+            self.matchsets.append(ms)
 
-        self.recall = _recall(self.tp, self.fn)
-        self.precision = _precision(self.tp, self.fp)
-        self.f1 = _f1(self.tp, self.fp, self.fn)
-        self.mAP = average_precision(
-            sum([ms.detections for ms in self.matchsets], []),
-            sum([ms.ground_truth for ms in self.matchsets], []),
-        )
+    @property
+    def recall(self):
+        return _recall(self.tp, self.fn)
 
-    def to_dict(self):
+    @property
+    def precision(self):
+        return _precision(self.tp, self.fp)
+
+    @property
+    def f1(self):
+        return _f1(self.tp, self.fp, self.fn)
+
+    @property
+    def mAP(self):
+        if self._mAP is None:
+            self._mAP = _average_precision_from_counts(
+                self._confidence_counts.counts,
+                self._gt_count,
+            )
+        return self._mAP
+
+    @property
+    def ap_by_iou(self):
+        """Average precision at each of the additional IoU cutoffs."""
+        return {
+            map_iou: _average_precision_from_counts(counts.counts,
+                                                    self._gt_count)
+            for map_iou, counts in sorted(self._iou_confidence_counts.items())
+        }
+
+    @property
+    def multi_iou_mAP(self):
+        """Average precision averaged over the additional IoU cutoffs.
+
+        This is None if no additional IoU cutoffs were used.
+
+        """
+        ap_by_iou = self.ap_by_iou
+        if not ap_by_iou:
+            return None
+        return sum(ap_by_iou.values()) / len(ap_by_iou)
+
+    @property
+    def images_per_second(self):
+        if not self.wall_time:
+            return None
+        return self.image_count / self.wall_time
+
+    @property
+    def megapixels_per_second(self):
+        if not self.wall_time or not self.pixel_count:
+            return None
+        return self.pixel_count / 1e6 / self.wall_time
+
+    def stage_timings(self):
+        """Return timing statistics for each stage of image processing.
+
+        Returns
+        -------
+        timings : dict of str -> dict
+            For each stage (in processing order) the number of images that
+            went through it (`count`), total wall and CPU time in seconds
+            (`wall` and `cpu`) and wall time latency percentiles in seconds
+            (`p50`, `p90` and `p99`).
+
+        """
+        ret = {}
+        for stage in sorted(self._stage_times,
+                            key=const.BENCHMARK_STAGES.index):
+            wall, cpu = self._stage_times[stage]
+            ret[stage] = {'count': len(wall), 'wall': sum(wall),
+                          'cpu': sum(cpu)}
+            percentiles = np.percentile(wall, const.LATENCY_PERCENTILES)
+            for q, value in zip(const.LATENCY_PERCENTILES, percentiles):
+                ret[stage]['p{}'.format(q)] = float(value)
+        return ret
+
+    def threshold_sweep(self):
+        """Return metrics at all confidence thresholds (see `threshold_sweep`).
+
+        The metrics are computed from the matching that is already done so
+        changing the threshold doesn't require running the detector again.
+
+        """
+        return threshold_sweep(self._confidence_counts.counts,
+                               self._gt_count)
+
+    def best_f1_threshold(self):
+        """Return the metrics at the confidence threshold with the best F1.
+
+        If several thresholds produce the same F1, the highest one is returned.
+        If there are no detections, None is returned.
+
+        """
+        sweep = self.threshold_sweep()
+        if not sweep:
+            return None
+        return max(sweep, key=lambda row: row['f1'])
+
+    def summary_dict(self, include_sweep=False):
+        """Return overall results (everything except per-image results).
+
+        Parameters
+        ----------
+        include_sweep : bool
+            Include the metrics at all confidence thresholds and the threshold
+            with the best F1.
+
+        """
         ret = {
             'tp': self.tp,
             'fn': self.fn,
@@ -362,24 +985,380 @@ class Evaluation:
             'f1': self.f1,
             'mAP': self.mAP,
             'image_count': self.image_count,
-            'images': [ms.to_dict() for ms in self.matchsets],
             'dataset': str(self.dataset),
             'detector': str(self.detector),
             'images_path': self.dataset.images_path
         }
+        if self.shard is not None:
+            ret['shard'] = list(self.shard)
+        if self.match_params is not None:
+            ret['params'] = self.match_params
+        if self._iou_confidence_counts:
+            ret['ap_by_iou'] = [
+                {'match_iou': map_iou, 'ap': ap}
+                for map_iou, ap in self.ap_by_iou.items()
+            ]
+            ret['multi_iou_mAP'] = self.multi_iou_mAP
+        if self.wall_time is not None or self._stage_times:
+            ret['timing'] = {
+                'wall_time': self.wall_time,
+                'images_per_second': self.images_per_second,
+                'megapixels_per_second': self.megapixels_per_second,
+                'stages': self.stage_timings(),
+            }
+        if include_sweep:
+            ret['threshold_sweep'] = self.threshold_sweep()
+            ret['best_f1_threshold'] = self.best_f1_threshold()
         return ret
 
-    def json_dump(self, out_file):
-        """Write this evaluation into a JSON file.
+    def to_dict(self, include_sweep=False):
+        ret = self.summary_dict(include_sweep)
+        ret['images'] = [ms.to_dict() for ms in self.matchsets]
+        return ret
+
+    def json_dump(self, out_file, include_sweep=False, jsonl=False):
+        """Write this evaluation into a JSON or JSONL file.
+
+        The results for individual images are serialized one at a time so
+        the output is never held in memory as a whole (see `wentral.results`
+        for the format details).
 
         Parameters
         ----------
         out_file : file
             File to write to. It must be a text file opened in unicode mode
             with utf-8 encoding.
+        include_sweep : bool
+            Include the metrics at all confidence thresholds and the threshold
+            with the best F1.
+        jsonl : bool
+            Write the summary on the first line and the results for each
+            image on the following lines.
+
+        """
+        results.dump(self.summary_dict(include_sweep), self.matchsets,
+                     out_file, jsonl)
+
+    def binary_dump(self, out_file, include_sweep=False):
+        """Write this evaluation into a file in binary format.
+
+        See `wentral.results` for the description of the format.
+
+        Parameters
+        ----------
+        out_file : file
+            File to write to. It must be opened in binary mode.
+        include_sweep : bool
+            Include the metrics at all confidence thresholds and the threshold
+            with the best F1.
 
         """
-        json.dump(self.to_dict(), out_file, indent=2, sort_keys=True)
+        results.write_binary(self.summary_dict(include_sweep),
+                             self.matchsets, out_file)
+
+
+# Parameters for `detector.detect` calls: we request all detections and then
+# apply confidence threshold when calculating the metrics.
+DETECT_PARAMS = {'confidence_threshold': 0.001}
+
+
+def _to_rgb(image):
+    """Convert the image to RGB (this requires decoding it)."""
+    image = ds.open_image(image)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+
+def _full_resolution_rgb(image, original, image_path):
+    """Return the image in RGB at full resolution (for visualization).
+
+    If the image was decoded at reduced resolution for the detector, the
+    original image (the item of the dataset) is opened again.
+
+    """
+    if u.ORIGINAL_SIZE_KEY in ds.open_image(image).info:
+        image = ds.reopen_image(original, image_path)
+    return _to_rgb(image)
+
+
+def _clock():
+    """Return current wall and CPU time (for measuring durations)."""
+    return time.perf_counter(), time.process_time()
+
+
+def _record_time(timings, stage, start, share=1):
+    """Record the time elapsed since `start` (divided by `share`).
+
+    CPU time is measured for the whole process so it includes the work done
+    by other threads (e.g. decoding ahead in `PrefetchingDataset`).
+
+    """
+    wall, cpu = _clock()
+    timings[stage] = {'wall': (wall - start[0]) / share,
+                      'cpu': (cpu - start[1]) / share}
+
+
+def _detect_batch(detector, batch, cache, decode=True, input_size=None):
+    """Detect objects in a batch of images (using the cache if possible).
+
+    Parameters
+    ----------
+    detector : Detector
+        Detector to use.
+    batch : list of (image, image_path, expected_boxes)
+        Batch of dataset items.
+    cache : DetectionCache or None
+        Cache of detections.
+    decode : bool
+        Decode the images and convert them to RGB before passing them to the
+        detector. If False, the images are passed as they are and the cache is
+        not used (because getting the detections is cheap).
+    input_size : (int, int)
+        Decode the images at reduced resolution that is at least this size
+        (see `utils.load_reduced`) and scale the detections back.
+
+    Returns
+    -------
+    detections : list of (image, detected_boxes, timings)
+        Images (converted to RGB if they had to be decoded), detections for
+        them and the times spent on decoding, conversion and detection (see
+        `MatchSet.timings`) in the same order as `batch`. Time of batch
+        detection is split equally between the images of the batch.
+
+    """
+    images = {}
+    detections = {}
+    timings = {}
+    cache_keys = {}
+    to_detect = []
+
+    for image, image_path, expected_boxes in batch:
+        logging.info('Processing image: {}'.format(image_path))
+        logging.debug('Marked objects: {}'.format(expected_boxes))
+        images[image_path] = image
+        timings[image_path] = {}
+
+        if not decode:
+            to_detect.append((image, image_path))
+            continue
+
+        if cache is not None:
+            cache_keys[image_path] = cache.make_key(
+                image_path, detector, DETECT_PARAMS,
+                getattr(image, 'data', None),
+            )
+            cached = cache.get(cache_keys[image_path])
+            if cached is not None:
+                detections[image_path] = cached
+                continue
+
+        start = _clock()
+        image = u.load_reduced(ds.open_image(image), input_size)
+        _record_time(timings[image_path], 'decode', start)
+        start = _clock()
+        images[image_path] = _to_rgb(image)
+        _record_time(timings[image_path], 'convert', start)
+        to_detect.append((images[image_path], image_path))
+
+    start = _clock()
+    if len(to_detect) == 1:
+        image, image_path = to_detect[0]
+        results = [(image_path, detector.detect(image, image_path,
+                                                **DETECT_PARAMS))]
+    elif to_detect:
+        # Batch detection can be lazy so we consume it before measuring time.
+        results = list(detector.batch_detect(to_detect, **DETECT_PARAMS))
+    else:
+        results = []
+    for _, image_path in to_detect:
+        _record_time(timings[image_path], 'detect', start, len(to_detect))
+
+    # Batch detection might return results in any order so we match them to
+    # the images by path.
+    for image_path, detected_boxes in results:
+        if decode:
+            detected_boxes = u.scale_boxes(detected_boxes, images[image_path])
+        detections[image_path] = detected_boxes
+        if cache is not None and decode:
+            cache.put(cache_keys[image_path], detected_boxes)
+
+    return [
+        (images[image_path], detections[image_path], timings[image_path])
+        for _, image_path, _ in batch
+    ]
+
+
+class _CacheLookahead:
+    """Detection cache lookups that are done before images are prefetched.
+
+    `needs_decoding` is called for each image before it's queued for
+    decoding, so that the images with cached detections are not decoded. The
+    keys and the detections that it found are kept until `_detect_batch`
+    asks for them via the same methods as `DetectionCache` has, so the image
+    files are only hashed once.
+
+    """
+
+    def __init__(self, cache, detector):
+        self.cache = cache
+        self.detector = detector
+        self._keys = {}
+        self._hits = {}
+
+    def needs_decoding(self, image_data):
+        """Look up the detections, return False if they are in the cache."""
+        image, image_path, _ = image_data
+        key = self.cache.make_key(image_path, self.detector, DETECT_PARAMS,
+                                  getattr(image, 'data', None))
+        self._keys[image_path] = key
+        detections = self.cache.get(key)
+        if detections is None:
+            return True
+        self._hits[key] = detections
+        return False
+
+    def make_key(self, image_path, detector, params, image_data=None):
+        key = self._keys.pop(image_path, None)
+        if key is None:
+            key = self.cache.make_key(image_path, detector, params, image_data)
+        return key
+
+    def get(self, key):
+        if key in self._hits:
+            return self._hits.pop(key)
+        return self.cache.get(key)
+
+    def put(self, key, detections):
+        self.cache.put(key, detections)
+
+
+def _prefetching(dataset, detector, prefetch, max_memory, params):
+    """Wrap the dataset to decode the images ahead of time if necessary.
+
+    The images that get their detections from the detection cache are not
+    decoded unless they are visualized (`params['detection_cache']` is
+    replaced with `_CacheLookahead` that looks them up in advance).
+
+    """
+    visualize = 'visualizations_path' in params
+    if not (getattr(detector, 'needs_pixels', True) or visualize):
+        return dataset  # The images are not going to be decoded.
+
+    should_decode = None
+    cache = params.get('detection_cache')
+    if cache is not None and not visualize:
+        lookahead = _CacheLookahead(cache, detector)
+        params['detection_cache'] = lookahead
+        should_decode = lookahead.needs_decoding
+
+    return ds.PrefetchingDataset(
+        dataset,
+        prefetch=prefetch,
+        max_memory=max_memory,
+        input_size=getattr(detector, 'input_size', None),
+        should_decode=should_decode,
+    )
+
+
+def _match_batch(detector, batch, **params):
+    """Detect objects in a batch of images and match them to ground truth."""
+    visualize = 'visualizations_path' in params
+    # Detectors that don't look at the images get them without decoding and
+    # the images are not touched unless they are visualized.
+    decode = getattr(detector, 'needs_pixels', True)
+    input_size = getattr(detector, 'input_size', None)
+    detections = _detect_batch(detector, batch, params.get('detection_cache'),
+                               decode, input_size)
+    matchsets = []
+
+    for (image, detected_boxes, timings), (original, image_path,
+                                           expected_boxes) \
+            in zip(detections, batch):
+        logging.debug('Detected objects: {}'.format(detected_boxes))
+        image_name = os.path.basename(image_path)
+        start = _clock()
+        ms = MatchSet(image_name, detected_boxes, expected_boxes, **params)
+        _record_time(timings, 'match', start)
+
+        if visualize:
+            start = _clock()
+            vis.visualize_match_set(
+                ms, _full_resolution_rgb(image, original, image_path),
+                params['visualizations_path'],
+            )
+            _record_time(timings, 'visualize', start)
+
+        ms.timings = timings
+        if decode or visualize:
+            width, height = u.original_size(image)
+            ms.pixels = width * height
+
+        matchsets.append(ms)
+
+    return matchsets
+
+
+def _batches(dataset, batch_size):
+    """Split dataset items into lists of `batch_size` items."""
+    batch = []
+    for item in dataset:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Detector used by the current worker process (see `_init_worker`).
+_worker_detector = None
+
+
+def _init_worker(detector, detector_factory):
+    """Set up the detector in a worker process."""
+    global _worker_detector
+    if detector_factory is None:
+        _worker_detector = detector
+    else:
+        _worker_detector = detector_factory()
+
+
+def _match_batch_in_worker(task):
+    """Load the images and match detections in a worker process."""
+    items, params = task
+    batch = [
+        (ds.LazyImage(image_path, image_data), image_path, expected_boxes)
+        for image_path, image_data, expected_boxes in items
+    ]
+    return _match_batch(_worker_detector, batch, **params)
+
+
+def _match_detections_parallel(batches, detector, jobs, detector_factory,
+                               **params):
+    """Match detections using a pool of worker processes.
+
+    The images are loaded by the workers (only their paths are passed to the
+    pool unless the images are not in files) and the results are yielded in
+    the order of the dataset.
+
+    """
+    def tasks():
+        for batch in batches:
+            items = []
+            for image, image_path, expected_boxes in batch:
+                image.close()  # The worker will open it again.
+                # Images from packed datasets are sent with their content.
+                items.append((image_path, getattr(image, 'data', None),
+                              expected_boxes))
+            yield items, params
+
+    if detector_factory is not None:
+        detector = None  # No need to send it to the workers.
+
+    with mp.Pool(jobs, _init_worker, (detector, detector_factory)) as pool:
+        for matchsets in pool.imap(_match_batch_in_worker, tasks()):
+            yield from matchsets
 
 
 def match_detections(dataset, detector, **params):
@@ -394,7 +1373,22 @@ def match_detections(dataset, detector, **params):
         coordinates followed by confidence).
     params : dict
         Parameters for the detector, such as confidence_threshold and
-        match_iou.
+        match_iou. If `jobs` is greater than 1, the images will be processed
+        by that many worker processes. Each worker will use a copy of
+        `detector` or, if `detector_factory` is given, the detector returned
+        by calling it. If `detection_cache` (DetectionCache) is given, the
+        detections will be taken from it when possible (without decoding the
+        image and running the detector).
+        If `checkpoint` (Checkpoint) is given, the results are saved into it
+        as they are produced and the images that already have results in it
+        are skipped (their results are taken from the checkpoint).
+        If `batch_size` is greater than 1, the images are passed to the
+        detector in batches of this size via `detector.batch_detect`.
+        If `prefetch` is greater than 0, up to that many images are decoded
+        ahead in background threads (see `PrefetchingDataset`) with the
+        memory budget of `prefetch_memory` bytes. The images that are skipped
+        because of the checkpoint or have cached detections are not decoded.
+        Prefetching is not done with multiple jobs.
 
     Returns
     -------
@@ -404,22 +1398,46 @@ def match_detections(dataset, detector, **params):
     """
     params.setdefault('confidence_threshold', 0.5)
     params.setdefault('match_iou', 0.4)
+    jobs = params.pop('jobs', 1)
+    batch_size = params.pop('batch_size', 1)
+    detector_factory = params.pop('detector_factory', None)
+    checkpoint = params.pop('checkpoint', None)
+    prefetch = params.pop('prefetch', 0)
+    prefetch_memory = params.pop('prefetch_memory', const.PREFETCH_MEMORY)
+
+    if checkpoint is not None:
+        checkpoint.start(detector, params)
+        yield from checkpoint.matchsets
+        dataset = _skip_done(dataset, checkpoint)
+
+    if prefetch > 0 and jobs <= 1:
+        dataset = _prefetching(dataset, detector, prefetch, prefetch_memory,
+                               params)
+
+    batches = _batches(dataset, batch_size)
+    if jobs > 1:
+        matchsets = _match_detections_parallel(batches, detector, jobs,
+                                               detector_factory, **params)
+    else:
+        matchsets = (
+            ms
+            for batch in batches
+            for ms in _match_batch(detector, batch, **params)
+        )
 
-    for image, image_path, expected_boxes in dataset:
-        logging.info('Processing image: {}'.format(image_path))
-        logging.debug('Marked objects: {}'.format(expected_boxes))
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        detected_boxes = detector.detect(image, image_path,
-                                         confidence_threshold=0.001)
-        logging.debug('Detected objects: {}'.format(detected_boxes))
-        image_name = os.path.basename(image_path)
-        ms = MatchSet(image_name, detected_boxes, expected_boxes, **params)
+    for ms in matchsets:
+        if checkpoint is not None:
+            checkpoint.append(ms)
+        yield ms
 
-        if 'visualizations_path' in params:
-            vis.visualize_match_set(ms, image, params['visualizations_path'])
 
-        yield ms
+def _skip_done(dataset, checkpoint):
+    """Skip the images that already have results in the checkpoint."""
+    for image, image_path, expected_boxes in dataset:
+        if os.path.basename(image_path) in checkpoint:
+            image.close()
+        else:
+            yield image, image_path, expected_boxes
 
 
 def evaluate(dataset, detector, **params):
@@ -433,7 +1451,11 @@ def evaluate(dataset, detector, **params):
         Detector to benchmark.
     params : dict
         Parameters for the detector, such as confidence_threshold and
-        match_iou.
+        match_iou (see also `match_detections`). If `keep_matchsets` is False
+        (and visualization is not requested), the results for individual
+        images are not stored in the evaluation. If `results_writer`
+        (ResultsWriter) is given, the results for individual images are
+        added to it as they are produced.
 
     Returns
     -------
@@ -441,11 +1463,158 @@ def evaluate(dataset, detector, **params):
         Evaluation result.
 
     """
+    keep_matchsets = params.pop('keep_matchsets', True)
+    results_writer = params.pop('results_writer', None)
     if 'visualizations_path' in params:
         os.makedirs(params['visualizations_path'], exist_ok=True)
-    matchsets = list(match_detections(dataset, detector, **params))
-    evaluation = Evaluation(dataset, detector, matchsets)
+        keep_matchsets = True  # Visualization needs all the data.
+
+    params.setdefault('confidence_threshold', 0.5)
+    params.setdefault('match_iou', 0.4)
+
+    evaluation = Evaluation(dataset, detector, keep_matchsets=keep_matchsets)
+    evaluation.match_params = {
+        'confidence_threshold': params['confidence_threshold'],
+        'match_iou': params['match_iou'],
+        'map_ious': params.get('map_ious'),
+    }
+    start = time.perf_counter()
+    for ms in match_detections(dataset, detector, **params):
+        evaluation.add_matchset(ms)
+        if results_writer is not None:
+            results_writer.add_matchset(ms)
+    evaluation.wall_time = time.perf_counter() - start
+
     if 'visualizations_path' in params:
         vis.write_data_json(evaluation, params['visualizations_path'])
         vis.write_index_html(params['visualizations_path'])
     return evaluation
+
+
+class _Description:
+    """Stand-in for the dataset or the detector of loaded results."""
+
+    def __init__(self, description, images_path=None):
+        self.description = description
+        self.images_path = images_path
+
+    def __str__(self):
+        return self.description
+
+
+def _check_match_params(path, params, expected):
+    """Check that the results in `path` have the expected match parameters.
+
+    Returns
+    -------
+    params : dict
+        The parameters to expect in the following results.
+
+    Raises
+    ------
+    Exception
+        If the parameters are different.
+
+    """
+    if params is None:
+        return expected
+    if expected is not None and any(
+        _normalize_param(params.get(k)) != _normalize_param(expected.get(k))
+        for k in ['confidence_threshold', 'match_iou', 'map_ious']
+    ):
+        raise Exception('Results in {} are produced with different '
+                        'parameters: {}'.format(path, params))
+    return params
+
+
+def _normalize_param(value):
+    if isinstance(value, list):
+        return sorted(float(v) for v in value)
+    return value
+
+
+def merge(paths, **params):
+    """Merge the results of benchmark runs on the shards of a dataset.
+
+    The results for individual images are combined into one evaluation, so
+    all the metrics (including mAP) are exactly the same as if the whole
+    dataset was evaluated in one run. All shards must be produced by the same
+    detector with the same matching parameters (confidence threshold, match
+    IoU and mAP IoUs). The wall time of the merged evaluation
+    is the longest of the wall times of the shards (since they are supposed
+    to run in parallel).
+
+    Parameters
+    ----------
+    paths : list of str
+        Paths to the result files of the shards (in any format supported by
+        `results.load`).
+    params : dict
+        If `keep_matchsets` is False, the results for individual images are
+        not stored in the evaluation. If `results_writer` (ResultsWriter) is
+        given, they are added to it.
+
+    Returns
+    -------
+    result : Evaluation
+        Merged evaluation.
+
+    """
+    keep_matchsets = params.pop('keep_matchsets', True)
+    results_writer = params.pop('results_writer', None)
+    evaluation = None
+    shards = set()
+    image_names = set()
+    wall_times = []
+    match_params = None
+
+    for path in paths:
+        data = results.load(path)
+        if evaluation is None:
+            evaluation = Evaluation(
+                _Description(data['dataset'], data['images_path']),
+                _Description(data['detector']),
+                keep_matchsets=keep_matchsets,
+            )
+            evaluation.match_params = data.get('params')
+            shard_count = data.get('shard', [None, None])[1]
+        elif data['detector'] != str(evaluation.detector):
+            raise Exception('Results in {} are produced by a different '
+                            'detector: {}'.format(path, data['detector']))
+        match_params = _check_match_params(path, data.get('params'),
+                                           match_params)
+
+        shard, count = data.get('shard', [None, None])
+        if count != shard_count or shard in shards:
+            raise Exception('Results in {} are not for a different shard of '
+                            'the same dataset'.format(path))
+        shards.add(shard)
+
+        timing = data.get('timing') or {}
+        if timing.get('wall_time') is not None:
+            wall_times.append(timing['wall_time'])
+
+        for record in data['images']:
+            if record['image_name'] in image_names:
+                raise Exception('Duplicate results for {} in {}'
+                                .format(record['image_name'], path))
+            image_names.add(record['image_name'])
+            ms = MatchSet.from_dict(record)
+            # Older results only have the parameters in the image records.
+            match_params = _check_match_params(path, {
+                'confidence_threshold': ms.confidence_threshold,
+                'match_iou': ms.match_iou,
+                'map_ious': list(ms.iou_matches) or None,
+            }, match_params)
+            evaluation.add_matchset(ms)
+            if results_writer is not None:
+                results_writer.add_matchset(ms)
+
+    if evaluation is None:
+        raise Exception('No results to merge')
+    if shard_count is not None and len(shards) < shard_count:
+        logging.warning('Merging {} of {} shards'
+                        .format(len(shards), shard_count))
+    if wall_times:
+        evaluation.wall_time = max(wall_times)
+    return evaluation
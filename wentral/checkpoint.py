@@ -0,0 +1,156 @@
+# Copyright (C) 2019-present eyeo GmbH
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Checkpoints that allow resuming interrupted benchmark runs."""
+
+import json
+import logging
+import os
+
+import wentral.benchmark as bm
+
+# Parameters that affect the results of matching: when resuming, they must be
+# the same as in the checkpoint.
+MATCH_PARAMS = ['confidence_threshold', 'match_iou', 'map_ious']
+
+
+class Checkpoint:
+    """Log of benchmark results for individual images.
+
+    The log is a JSONL file. The first line contains the description of the
+    detector and the matching parameters and each subsequent line contains
+    the results for one image (as produced by `MatchSet.to_dict()`).
+
+    Parameters
+    ----------
+    path : str
+        Path to the checkpoint file.
+    resume : bool
+        If True, the results from the existing checkpoint file (if there's
+        one) are loaded and new results are appended to it. Otherwise the file
+        is overwritten.
+
+    Attributes
+    ----------
+    matchsets : list of MatchSet
+        Results loaded from the checkpoint file.
+
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.resume = resume
+        self.matchsets = []
+        self._image_names = set()
+        self._file = None
+
+    def __str__(self):
+        return 'Checkpoint(path={})'.format(self.path)
+
+    def __contains__(self, image_name):
+        return image_name in self._image_names
+
+    @staticmethod
+    def _header(detector, params):
+        return {
+            'detector': str(detector),
+            'params': {k: params.get(k) for k in MATCH_PARAMS},
+        }
+
+    def _load(self, header):
+        """Load the results and return the size of the valid part of the log.
+
+        Raises
+        ------
+        Exception
+            If the checkpoint was produced with a different detector or with
+            different matching parameters.
+
+        """
+        valid_size = 0
+
+        with open(self.path, 'rb') as log_file:
+            for i, line in enumerate(log_file):
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    # Incomplete last record (interrupted while writing).
+                    logging.warning('Ignoring broken record in {}: line {}'
+                                    .format(self.path, i + 1))
+                    break
+
+                if i == 0:
+                    if record != header:
+                        raise Exception(
+                            'Checkpoint {} was created with different '
+                            'detector or parameters: {}'.format(self.path,
+                                                                record),
+                        )
+                else:
+                    ms = bm.MatchSet.from_dict(record)
+                    self.matchsets.append(ms)
+                    self._image_names.add(ms.image_name)
+
+                valid_size += len(line)
+
+        logging.info('Loaded {} results from {}'.format(len(self.matchsets),
+                                                        self.path))
+        return valid_size
+
+    def start(self, detector, params):
+        """Load existing results (if resuming) and open the log for writing.
+
+        Parameters
+        ----------
+        detector : Detector
+            The detector that is benchmarked.
+        params : dict
+            Matching parameters (see `MatchSet`).
+
+        """
+        header = self._header(detector, params)
+
+        if self.resume and os.path.exists(self.path):
+            valid_size = self._load(header)
+            self._file = open(self.path, 'r+b')
+            # Remove incomplete records that might be at the end.
+            self._file.truncate(valid_size)
+            self._file.seek(valid_size)
+            if valid_size > 0:
+                return
+
+        if self._file is None:
+            self._file = open(self.path, 'wb')
+        self._write(header)
+
+    def _write(self, record):
+        self._file.write(json.dumps(record).encode('utf-8') + b'\n')
+        self._file.flush()
+
+    def append(self, ms):
+        """Save the results for one image."""
+        self._write(ms.to_dict())
+        self._image_names.add(ms.image_name)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -27,3 +27,25 @@ IOU_THRESHOLD = 0.4      # IOU above which two boxes are considered the same.
 # Slicing detector proxy defaults.
 SLICING_THRESHOLD = 0.7
 SLICE_OVERLAP = 0.2
+
+# Default size limit of the detection cache (in bytes).
+DETECTION_CACHE_SIZE = 1 << 30
+
+# Default memory budget for images decoded ahead of time (in bytes).
+PREFETCH_MEMORY = 1 << 30
+
+# Stages of processing an image in a benchmark (for timing measurements).
+BENCHMARK_STAGES = ['decode', 'convert', 'detect', 'match', 'visualize']
+
+# Latency percentiles reported for each benchmark stage.
+LATENCY_PERCENTILES = [50, 90, 99]
+
+# Default maximum size of the images in a packed dataset shard (in bytes).
+PACK_SHARD_SIZE = 1 << 30
+
+# Default memory budget for the cache of decoded images (in bytes).
+IMAGE_CACHE_MEMORY = 1 << 30
+
+# Default memory budget for the sorted detections and `detect` results that
+# `JsonDetector` keeps in memory (in bytes).
+JSON_DETECTOR_CACHE_MEMORY = 1 << 28
@@ -20,17 +20,183 @@
 
 """Dataset loading for benchmarking."""
 
-import json
+import collections
+import concurrent.futures as cf
+import hashlib
+import io
 import logging
+import math
 import os
+import threading
+import zlib
 
 import admincer.index as idx
 import PIL
 
+import wentral.constants as const
+import wentral.pack as pack
+import wentral.region_index as ri
+import wentral.results as results
+import wentral.utils as u
+
+
+class ImageCache:
+    """Cache of decoded images with a memory budget.
+
+    When the budget is exceeded, least recently used images are evicted.
+    The cache is used by lazy images (see `LazyImage`) of datasets that are
+    given one, so that repeated passes over a dataset don't decode the images
+    again. It's safe to use from multiple threads.
+
+    Parameters
+    ----------
+    max_memory : int
+        Memory budget for the decoded images in bytes (estimated from image
+        dimensions). Images bigger than the budget are not cached.
+
+    Attributes
+    ----------
+    hits : int
+        Number of images that were found in the cache.
+    misses : int
+        Number of images that had to be decoded.
+    memory : int
+        Estimated memory size of the cached images.
+
+    """
+
+    def __init__(self, max_memory=const.IMAGE_CACHE_MEMORY):
+        self.max_memory = max_memory
+        self.hits = 0
+        self.misses = 0
+        self.memory = 0
+        self._images = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._images)
+
+    def get(self, key):
+        """Return cached image or None if it's not in the cache."""
+        with self._lock:
+            image = self._images.get(key)
+            if image is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._images.move_to_end(key)
+            return image
+
+    def put(self, key, image):
+        """Add decoded image to the cache (evicting other images if needed)."""
+        size = _decoded_size(image)
+        if size > self.max_memory:
+            return
+        with self._lock:
+            if key in self._images:
+                self.memory -= _decoded_size(self._images.pop(key))
+            self._images[key] = image
+            self.memory += size
+            while self.memory > self.max_memory:
+                _, evicted = self._images.popitem(last=False)
+                self.memory -= _decoded_size(evicted)
+
+
+class LazyImage:
+    """Image file that is only opened when it's used.
+
+    Attribute access is forwarded to the underlying `PIL.Image`, which is
+    opened on first use, so the lazy image can be used in place of an opened
+    one. Evaluating detectors that don't look at the pixels (see
+    `Detector.needs_pixels`) doesn't touch the image files at all.
+
+    Parameters
+    ----------
+    path : str
+        Path to the image file.
+    data : bytes
+        Content of the image file if it's not read from `path` (e.g. for
+        packed datasets).
+    cache : ImageCache
+        Cache of decoded images. If it's given, the image is decoded and
+        converted to RGB when it's opened and is taken from the cache if it's
+        there.
+
+    """
+
+    def __init__(self, path, data=None, cache=None):
+        self.path = path
+        self.data = data
+        self.cache = cache
+        self._image = None
+
+    def _open_file(self):
+        if self.data is None:
+            return PIL.Image.open(self.path)
+        return PIL.Image.open(io.BytesIO(self.data))
+
+    def open(self):
+        """Open the image (if it's not open yet) and return it."""
+        if self._image is None:
+            if self.cache is None:
+                self._image = self._open_file()
+            else:
+                self._image = self.cache.get(self.path)
+                if self._image is None:
+                    self._image = _decode_rgb(self._open_file())
+                    self.cache.put(self.path, self._image)
+        return self._image
+
+    def close(self):
+        if self._image is not None:
+            # Cached images are shared, so they are not closed.
+            if self.cache is None:
+                self._image.close()
+            self._image = None
+
+    def __getattr__(self, name):
+        return getattr(self.open(), name)
+
+    def __repr__(self):
+        return 'LazyImage(path={})'.format(self.path)
+
+
+def open_image(image):
+    """Return opened `PIL.Image` for an image or a lazy image."""
+    if isinstance(image, LazyImage):
+        return image.open()
+    return image
+
+
+def reopen_image(image, image_path):
+    """Open the file of an image again and return a new `PIL.Image`.
+
+    This is useful to get the image at full resolution after it was decoded
+    at reduced resolution (see `utils.load_reduced`).
+
+    """
+    if isinstance(image, LazyImage):
+        return image._open_file()
+    return PIL.Image.open(image_path)
+
 
 class LabeledDataset:
     """A set of images with marked regions loaded from a directory.
 
+    The index of regions is cached in the directory (see
+    `region_index.CachedRegionIndex`), so that only the regions of new or
+    modified images are loaded when the dataset is used again.
+
+    Parameters
+    ----------
+    path : str
+        Path to the images and region files.
+    index_cache : bool
+        Use the cache of the region index (default: True).
+    image_cache : ImageCache
+        Cache of decoded images (by default images are decoded every time the
+        dataset is iterated).
+
     Attributes
     ----------
     path : str
@@ -44,9 +210,13 @@ class LabeledDataset:
 
     """
 
-    def __init__(self, path):
+    def __init__(self, path, index_cache=True, image_cache=None):
         self.path = path
-        self.index = idx.reg_index(path)
+        self.image_cache = image_cache
+        if index_cache:
+            self.index = ri.reg_index(path)
+        else:
+            self.index = idx.reg_index(path)
         self.region_types = [
             rt for rt in self.index.region_types
             if 'label' not in rt
@@ -60,12 +230,20 @@ class LabeledDataset:
     def __str__(self):
         return 'LabeledDataset(path={})'.format(self.path)
 
+    def image_size(self, image_path):
+        """Return width and height of an image (from the index if possible)."""
+        image_name = os.path.relpath(image_path, self.path)
+        if image_name in getattr(self.index, 'image_sizes', {}):
+            return self.index.image_sizes[image_name]
+        with PIL.Image.open(image_path) as image:
+            return image.size
+
     def __iter__(self):
         """Yield images, paths and marked boxes.
 
         Yields
         ------
-        image_data : (Image, set, list of tuple)
+        image_data : (LazyImage, set, list of tuple)
             Images, their paths and detection boxes.
 
         """
@@ -75,7 +253,8 @@ class LabeledDataset:
                 region[:4] for region in self.index[image_name]
                 if region[4] in self.region_types
             ]
-            yield PIL.Image.open(image_path), image_path, boxes
+            image = LazyImage(image_path, cache=self.image_cache)
+            yield image, image_path, boxes
 
 
 class JsonDataset:
@@ -84,14 +263,25 @@ class JsonDataset:
     Parameters
     ----------
     path : str
-        Path to the JSON file.
+        Path to the JSON (or JSONL) file with benchmark results.
+    image_cache : ImageCache
+        Cache of decoded images (by default images are decoded every time the
+        dataset is iterated).
+    stream : bool
+        Parse the image records one by one during iteration instead of
+        loading the whole file upfront. In this mode `data` only contains the
+        summary keys that precede the image records.
 
     """
 
-    def __init__(self, path):
+    def __init__(self, path, image_cache=None, stream=False):
         self.path = path
-        with open(self.path, 'rt', encoding='utf-8') as jf:
-            self.data = json.load(jf)
+        self.image_cache = image_cache
+        self.stream = stream
+        if stream:
+            self.data = results.read_summary(path, keys=['images_path'])
+        else:
+            self.data = results.load(self.path)
         self.images_path = self.data['images_path']
 
     def __str__(self):
@@ -102,11 +292,363 @@ class JsonDataset:
 
         Yields
         ------
-        image_data : (Image, set, list of tuple)
+        image_data : (LazyImage, set, list of tuple)
             Images, their paths and detection boxes.
 
         """
-        for img in self.data['images']:
+        if self.stream:
+            records = results.iter_records(self.path)
+        else:
+            records = self.data['images']
+        for img in records:
             image_path = os.path.join(self.images_path, img['image_name'])
             boxes = [gt[:4] for gt in img['ground_truth']]
-            yield PIL.Image.open(image_path), image_path, boxes
+            image = LazyImage(image_path, cache=self.image_cache)
+            yield image, image_path, boxes
+
+
+class PackedDataset:
+    """A set of images with marked regions loaded from a packed dataset.
+
+    The shard files (see `wentral.pack`) are memory-mapped and read
+    sequentially, the images are only decoded when they are used.
+
+    Parameters
+    ----------
+    path : str
+        Path to a directory with shard files (produced by `pack.write_pack`)
+        or to one shard file.
+    image_cache : ImageCache
+        Cache of decoded images (by default images are decoded every time the
+        dataset is iterated).
+
+    """
+
+    def __init__(self, path, image_cache=None):
+        self.path = path
+        self.image_cache = image_cache
+        self.shard_paths = pack.shard_paths(path)
+        if not self.shard_paths:
+            raise Exception('No packed dataset files in {}'.format(path))
+        first = pack.PackFile(self.shard_paths[0])
+        self.images_path = first.images_path
+        first.close()
+
+    def __str__(self):
+        return 'PackedDataset(path={})'.format(self.path)
+
+    def __iter__(self):
+        """Yield images, paths and marked boxes.
+
+        Yields
+        ------
+        image_data : (LazyImage, set, list of tuple)
+            Images, their paths and detection boxes.
+
+        """
+        for shard_path in self.shard_paths:
+            shard = pack.PackFile(shard_path)
+            try:
+                for i, image_name in enumerate(shard.image_names):
+                    image_path = os.path.join(self.images_path, image_name)
+                    image = LazyImage(image_path, shard.image_data(i),
+                                      self.image_cache)
+                    yield image, image_path, shard.boxes(i)
+            finally:
+                shard.close()
+
+
+def _decoded_size(image):
+    """Estimate memory size of decoded image in bytes (from its header).
+
+    The images are converted to RGB after decoding and PIL stores RGB images
+    (and all other modes) with at most 4 bytes per pixel.
+
+    """
+    width, height = image.size
+    return width * height * 4
+
+
+def _decode_rgb(image):
+    """Decode the image and convert it to RGB."""
+    image.load()
+    if image.mode != 'RGB':
+        rgb_image = image.convert('RGB')
+        image.close()
+        image = rgb_image
+    return image
+
+
+def _decode(image_data, input_size=None):
+    """Decode the image (maybe at reduced resolution) and convert it to RGB."""
+    image, image_path, boxes = image_data
+    decoded = _decode_rgb(u.load_reduced(open_image(image), input_size))
+    if isinstance(image, LazyImage):
+        # Keep the lazy image because its file content might be needed later
+        # (e.g. for the keys of the detection cache with packed datasets).
+        image._image = decoded
+        return image, image_path, boxes
+    return decoded, image_path, boxes
+
+
+class PrefetchingDataset:
+    """Dataset wrapper that decodes images ahead of time in the background.
+
+    The images are decoded (and converted to RGB) by a pool of threads while
+    the consumer is busy with previous images. The order of iteration is the
+    same as the order of the wrapped dataset.
+
+    Parameters
+    ----------
+    dataset : iterable of (image, image_path, expected_boxes)
+        Wrapped dataset.
+    prefetch : int
+        Maximum number of images that are decoded ahead.
+    max_memory : int
+        Memory budget for images that are decoded ahead, in bytes (the size of
+        decoded images is estimated from their dimensions). At least one image
+        is always decoded ahead, even if it's bigger than the budget.
+    workers : int
+        Number of decoding threads.
+    input_size : (int, int)
+        Decode the images at reduced resolution that is at least this size
+        (see `utils.load_reduced` and `Detector.input_size`).
+    should_decode : callable
+        Function that is called with each item of the dataset before it's
+        queued for decoding. If it returns False, the item is passed through
+        without decoding the image (by default all images are decoded).
+
+    """
+
+    def __init__(self, dataset, prefetch=4, max_memory=const.PREFETCH_MEMORY,
+                 workers=2, input_size=None, should_decode=None):
+        self.dataset = dataset
+        self.input_size = input_size
+        self.should_decode = should_decode
+        self.prefetch = prefetch
+        self.max_memory = max_memory
+        self.workers = workers
+
+    @property
+    def images_path(self):
+        return self.dataset.images_path
+
+    def __str__(self):
+        return str(self.dataset)
+
+    def __iter__(self):
+        """Yield decoded images, paths and marked boxes.
+
+        Yields
+        ------
+        image_data : (Image, set, list of tuple)
+            Images, their paths and detection boxes. Lazy images of the
+            wrapped dataset are yielded with the decoded images attached.
+
+        """
+        pending = collections.deque()  # Futures with their memory sizes.
+        pending_memory = 0
+
+        with cf.ThreadPoolExecutor(self.workers) as executor:
+            try:
+                for image_data in self.dataset:
+                    decode = (self.should_decode is None
+                              or self.should_decode(image_data))
+                    size = _decoded_size(image_data[0]) if decode else 0
+                    while pending and (
+                        len(pending) >= self.prefetch or
+                        pending_memory + size > self.max_memory
+                    ):
+                        future, future_size = pending.popleft()
+                        pending_memory -= future_size
+                        yield future.result()
+
+                    if decode:
+                        future = executor.submit(_decode, image_data,
+                                                 self.input_size)
+                    else:
+                        future = cf.Future()
+                        future.set_result(image_data)
+                    pending.append((future, size))
+                    pending_memory += size
+
+                while pending:
+                    future, _ = pending.popleft()
+                    yield future.result()
+            finally:
+                # Don't decode any more images if the iteration is stopped.
+                for future, _ in pending:
+                    future.cancel()
+
+
+def shard_of(image_path, shard_count):
+    """Return the index (from 1) of the shard that the image belongs to.
+
+    The assignment only depends on the file name of the image so it's the
+    same on all machines regardless of the location of the dataset.
+
+    """
+    name = os.path.basename(image_path).encode('utf-8')
+    return zlib.crc32(name) % shard_count + 1
+
+
+class ShardedDataset:
+    """Dataset wrapper that only yields one shard of the images.
+
+    The images are split into `shard_count` shards (see `shard_of`), so that
+    running the benchmark for each shard on a different machine covers the
+    whole dataset.
+
+    Parameters
+    ----------
+    dataset : iterable of (image, image_path, expected_boxes)
+        Wrapped dataset.
+    shard : int
+        Index of the shard to yield (from 1 to `shard_count`).
+    shard_count : int
+        Total number of shards.
+
+    """
+
+    def __init__(self, dataset, shard, shard_count):
+        self.dataset = dataset
+        self.shard = shard
+        self.shard_count = shard_count
+
+    @property
+    def images_path(self):
+        return self.dataset.images_path
+
+    def __str__(self):
+        return str(self.dataset)
+
+    def __iter__(self):
+        for image, image_path, expected_boxes in self.dataset:
+            if shard_of(image_path, self.shard_count) == self.shard:
+                yield image, image_path, expected_boxes
+            else:
+                image.close()
+
+
+def _sample_key(seed, image_path):
+    """Return the sort key of an image for sampling with a seed."""
+    name = os.path.basename(image_path)
+    data = '{}\0{}'.format(seed, name).encode('utf-8')
+    return hashlib.blake2b(data, digest_size=8).digest(), name
+
+
+def _quotas(sizes, count):
+    """Split `count` between groups proportionally to their sizes.
+
+    Uses the largest remainder method, so the quotas add up to `count`.
+
+    """
+    total = sum(sizes.values())
+    exact = {key: count * size / total for key, size in sizes.items()}
+    quotas = {key: int(x) for key, x in exact.items()}
+    by_remainder = sorted(exact, key=lambda k: (quotas[k] - exact[k], k))
+    for key in by_remainder[:count - sum(quotas.values())]:
+        quotas[key] += 1
+    return quotas
+
+
+class SampledDataset:
+    """Dataset wrapper that only yields a deterministic subset of the images.
+
+    The images are selected by sorting them by a hash of the seed and the file
+    name, so the subset only depends on the seed and the names of the images
+    (and is the same on all machines). Larger samples with the same seed
+    contain smaller ones. The selected images are yielded in the order of the
+    wrapped dataset and the images that are not selected are never opened
+    (unless they are stratified by aspect ratio and the dataset doesn't have
+    `image_size` method).
+
+    Parameters
+    ----------
+    dataset : iterable of (image, image_path, expected_boxes)
+        Wrapped dataset.
+    limit : int
+        Maximum number of images. Without `fraction` and `stratify`, these are
+        simply the first images of the dataset.
+    fraction : float
+        Fraction of the images to select (between 0 and 1).
+    seed : int
+        Seed that determines which images are selected.
+    stratify : str
+        Select the same fraction of the images from each stratum. The strata
+        are based on the number of ground truth boxes (`'boxes'`) or the
+        aspect ratio of the images (`'aspect'`), on a logarithmic scale. The
+        aspect ratio is taken from the dataset index if the dataset has
+        `image_size` method, otherwise the headers of all images are read.
+
+    """
+
+    STRATIFY = ['boxes', 'aspect']
+
+    def __init__(self, dataset, limit=None, fraction=None, seed=0,
+                 stratify=None):
+        if stratify is not None and stratify not in self.STRATIFY:
+            raise Exception('Unknown stratification: {}'.format(stratify))
+        self.dataset = dataset
+        self.limit = limit
+        self.fraction = fraction
+        self.seed = seed
+        self.stratify = stratify
+
+    @property
+    def images_path(self):
+        return self.dataset.images_path
+
+    def __str__(self):
+        return str(self.dataset)
+
+    def _stratum(self, image, image_path, expected_boxes):
+        if self.stratify == 'boxes':
+            return len(expected_boxes).bit_length()
+        if self.stratify == 'aspect':
+            if hasattr(self.dataset, 'image_size'):
+                width, height = self.dataset.image_size(image_path)
+            else:
+                width, height = image.size
+            return round(math.log2(height / width) * 2)
+        return None
+
+    def _select(self):
+        """Return the paths of the selected images."""
+        strata = {}
+        for image_data in self.dataset:
+            stratum = self._stratum(*image_data)
+            image_data[0].close()
+            strata.setdefault(stratum, []).append(image_data[1])
+
+        total = sum(len(paths) for paths in strata.values())
+        count = total
+        if self.fraction is not None:
+            count = int(round(total * self.fraction))
+        if self.limit is not None:
+            count = min(count, self.limit)
+
+        quotas = _quotas({k: len(v) for k, v in strata.items()}, count) \
+            if total else {}
+        selected = set()
+        for stratum, paths in strata.items():
+            paths.sort(key=lambda path: _sample_key(self.seed, path))
+            selected.update(paths[:quotas[stratum]])
+        return selected
+
+    def __iter__(self):
+        if self.fraction is None and self.stratify is None:
+            selected = None
+        else:
+            selected = self._select()
+
+        count = 0
+        for image, image_path, expected_boxes in self.dataset:
+            if self.limit is not None and count >= self.limit:
+                image.close()
+                break
+            if selected is None or image_path in selected:
+                count += 1
+                yield image, image_path, expected_boxes
+            else:
+                image.close()
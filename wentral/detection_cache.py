@@ -0,0 +1,168 @@
+# Copyright (C) 2019-present eyeo GmbH
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Persistent cache of detector outputs."""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+import wentral.constants as const
+
+
+def default_cache_dir():
+    """Return the default location of the detection cache."""
+    return os.environ.get(
+        'WENTRAL_CACHE_DIR',
+        os.path.join(os.path.expanduser('~'), '.cache', 'wentral'),
+    )
+
+
+class DetectionCache:
+    """Content-addressed on-disk cache of detections.
+
+    Cache entries are keyed by the hash of the image file content, image file
+    name (because some detectors, such as `JsonDetector`, use it), detector
+    description (`str(detector)`, which includes detector parameters) and
+    detection parameters. Each entry is stored in a separate JSON file. When
+    the total size of the entries exceeds `max_size`, least recently used
+    entries are removed.
+
+    Parameters
+    ----------
+    path : str
+        Directory where the cache is stored (it's created if necessary).
+    max_size : int
+        Maximum total size of the cache entries in bytes.
+    refresh : bool
+        If True, existing entries are ignored (but new results are still
+        saved, replacing them).
+
+    """
+
+    def __init__(self, path, max_size=const.DETECTION_CACHE_SIZE,
+                 refresh=False):
+        self.path = path
+        self.max_size = max_size
+        self.refresh = refresh
+        os.makedirs(path, exist_ok=True)
+        self.size = sum(size for _, _, size in self._entries())
+
+    def __str__(self):
+        return 'DetectionCache(path={})'.format(self.path)
+
+    def _entries(self):
+        """Yield paths, access times and sizes of all cache entries."""
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for filename in filenames:
+                if filename.endswith('.json'):
+                    entry_path = os.path.join(dirpath, filename)
+                    try:
+                        stat = os.stat(entry_path)
+                    except FileNotFoundError:
+                        continue  # Removed by another process.
+                    yield entry_path, stat.st_mtime, stat.st_size
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key + '.json')
+
+    def make_key(self, image_path, detector, params, image_data=None):
+        """Calculate cache key for detecting objects in an image.
+
+        Parameters
+        ----------
+        image_path : str
+            Path to the image file.
+        detector : Detector
+            Detector that produces the detections.
+        params : dict
+            Parameters passed to `detector.detect`.
+        image_data : bytes
+            Content of the image file (if it's not read from `image_path`).
+
+        Returns
+        -------
+        key : str
+            Cache key (hex digest of a hash).
+
+        """
+        digest = hashlib.sha256()
+        if image_data is not None:
+            digest.update(image_data)
+        else:
+            with open(image_path, 'rb') as image_file:
+                for chunk in iter(lambda: image_file.read(1 << 20), b''):
+                    digest.update(chunk)
+        digest.update(b'\0' + os.path.basename(image_path).encode('utf-8'))
+        digest.update(b'\0' + str(detector).encode('utf-8'))
+        digest.update(b'\0' + json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return cached detections or None if they are not in the cache."""
+        if self.refresh:
+            return None
+
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'rt', encoding='utf-8') as entry_file:
+                detections = json.load(entry_file)
+            os.utime(entry_path)  # Mark as recently used.
+        except (FileNotFoundError, ValueError):
+            return None
+
+        logging.debug('Detection cache hit: {}'.format(key))
+        return [tuple(d) for d in detections]
+
+    def put(self, key, detections):
+        """Save detections into the cache."""
+        entry_path = self._entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        # Detectors often return NumPy scalars that JSON can't serialize.
+        data = json.dumps([[float(v) for v in d[:5]] for d in detections])
+        data = data.encode('utf-8')
+
+        # Write into a temporary file first to never expose partial entries.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry_path))
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, entry_path)
+
+        self.size += len(data)
+        if self.size > self.max_size:
+            self._evict()
+
+    def _evict(self):
+        """Remove least recently used entries to get under `max_size`."""
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        self.size = sum(size for _, _, size in entries)
+        # Free some extra space to not do this on every `put`.
+        target_size = self.max_size * 0.9
+
+        for entry_path, _, size in entries:
+            if self.size <= target_size:
+                break
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass  # Already removed by another process.
+            self.size -= size
@@ -43,8 +43,25 @@ class Detector:
     any class that implements `detect` and `batch_detect` with the right
     signatures will work with Wentral just as well.
 
+    Attributes
+    ----------
+    needs_pixels : bool
+        Whether the detector looks at the content of the images. Detectors
+        that don't (e.g. the ones that load stored detections) should set
+        this to False, then the images are not decoded during benchmarking
+        (unless visualizations are requested) and `detect` gets an image
+        object that is only opened if it's used.
+    input_size : (int, int)
+        Width and height to which the detector scales the images (or None).
+        If this is set, large images are decoded at reduced resolution (that
+        is still at least `input_size`) and the detected boxes are scaled back
+        to the coordinates of the original image.
+
     """
 
+    needs_pixels = True
+    input_size = None
+
     def __init__(self, **params):
         """Implementations should pass detector parameters here.
 
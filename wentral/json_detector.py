@@ -20,12 +20,97 @@
 
 """Detector that loads the detections from a JSON file."""
 
-import json
+import collections
 import os
+import threading
+
+import numpy as np
 
 import wentral.detector as det
 import wentral.constants as const
-import wentral.utils as u
+import wentral.nms as nms
+import wentral.results as results
+
+
+class _LruCache:
+    """Cache with a memory budget that drops least recently used entries.
+
+    It's safe to use from multiple threads and it's pickled empty.
+
+    Parameters
+    ----------
+    max_memory : int
+        Memory budget in bytes (entries bigger than that are not cached).
+
+    """
+
+    # Approximate size of the Python objects of an entry in bytes.
+    ENTRY_OVERHEAD = 200
+
+    def __init__(self, max_memory):
+        self.max_memory = max_memory
+        self.memory = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getstate__(self):
+        return {'max_memory': self.max_memory}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_memory'])
+
+    def get(self, key):
+        """Return the entry or None if it's not in the cache."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, size):
+        """Add an entry of `size` bytes (evicting old entries if needed)."""
+        size += self.ENTRY_OVERHEAD
+        if size > self.max_memory:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.memory -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.memory += size
+            while self.memory > self.max_memory:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.memory -= evicted_size
+
+
+class _SortedDetections:
+    """Detections of one image sorted by decreasing confidence.
+
+    The detections are stored in an array with a row for each detection
+    (x0, y0, x1, y1, confidence). The ones with equal confidence keep their
+    original order.
+
+    """
+
+    def __init__(self, detections):
+        boxes = np.array([d[:5] for d in detections], dtype=float)
+        boxes = boxes.reshape(-1, 5)
+        self.boxes = boxes[np.argsort(-boxes[:, 4], kind='stable')]
+        # Negated confidences are ascending, which `searchsorted` needs.
+        self._neg_confidence = -self.boxes[:, 4]
+
+    @property
+    def nbytes(self):
+        return self.boxes.nbytes + self._neg_confidence.nbytes
+
+    def above(self, confidence_threshold):
+        """Return the detections with confidence of at least the threshold."""
+        count = np.searchsorted(self._neg_confidence, -confidence_threshold,
+                                side='right')
+        return self.boxes[:count]
 
 
 class JsonDetector(det.Detector):
@@ -37,15 +122,26 @@ class JsonDetector(det.Detector):
     Parameters
     ----------
     path : str
-        Path to the JSON file.
+        Path to the JSON (or JSONL) file with benchmark results.
     confidence_threshold : float
         Minimal detection confidence.
     iou_threshold : float
         IoU (intersection over union) level at which two detections are
         considered duplicates.
 
+    The detections of each image are sorted by confidence once, when they are
+    first requested, and stored in a compact array, so confidence thresholding
+    is a binary search. These sorted detections and the results of `detect`
+    for each combination of image and thresholds are kept in a cache with the
+    memory budget of `const.JSON_DETECTOR_CACHE_MEMORY` bytes (least recently
+    used entries are dropped), so that repeated detection (e.g. in threshold
+    sweeps or repeated passes over the dataset) is cheap. Box coordinates are
+    returned as floats.
+
     """
 
+    needs_pixels = False
+
     def __init__(self, path, confidence_threshold=const.CONF_THRESHOLD,
                  iou_threshold=const.IOU_THRESHOLD):
         super().__init__(
@@ -54,17 +150,21 @@ class JsonDetector(det.Detector):
             iou_threshold=iou_threshold,
         )
         self._load_data()
+        # Sorted detections (keyed by image name) and `detect` results (keyed
+        # by image name and thresholds).
+        self._cache = _LruCache(const.JSON_DETECTOR_CACHE_MEMORY)
 
     def _load_data(self):
         """Load detections from a JSON file."""
-        with open(self.path, 'rt', encoding='utf-8') as jf:
-            data = json.load(jf)
+        if results.is_binary(self.path):
+            # Detections for each image are read when they are requested.
+            self.detections = results.BinaryDetections(
+                results.BinaryResults(self.path),
+            )
+            return
 
-        self.detections = {}
-        for img_data in data['images']:
-            name = img_data['image_name']
-            detections = img_data['detections']
-            self.detections[name] = [d[:5] for d in detections]
+        # The records are indexed by byte offset and parsed on request.
+        self.detections = results.JsonDetections(self.path)
 
     def detect(self, image, path, confidence_threshold=None,
                iou_threshold=None):
@@ -97,20 +197,24 @@ class JsonDetector(det.Detector):
             confidence_threshold = self.confidence_threshold
 
         image_name = os.path.basename(path)
-        if image_name not in self.detections:
-            raise KeyError('No detections data for ' + image_name)
-
-        detections = sorted([
-            d for d in self.detections[image_name]
-            if d[4] >= confidence_threshold
-        ], key=lambda d: d[4], reverse=True)
-
-        picked = []
-        for d in detections:
-            for p in picked:
-                if u.iou(p[:4], d[:4]) >= iou_threshold:  # duplicate.
-                    break
-            else:
-                picked.append(d)
-
-        return picked
+        key = (image_name, confidence_threshold, iou_threshold)
+        picked = self._cache.get(key)
+        if picked is None:
+            candidates = self._sorted_detections(image_name).above(
+                confidence_threshold,
+            )
+            picked = candidates[nms.nms_indices(candidates, iou_threshold)]
+            self._cache.put(key, picked, picked.nbytes)
+
+        return picked.tolist()
+
+    def _sorted_detections(self, image_name):
+        """Return `_SortedDetections` of the image."""
+        sorted_detections = self._cache.get(image_name)
+        if sorted_detections is None:
+            if image_name not in self.detections:
+                raise KeyError('No detections data for ' + image_name)
+            sorted_detections = _SortedDetections(self.detections[image_name])
+            self._cache.put(image_name, sorted_detections,
+                            sorted_detections.nbytes)
+        return sorted_detections
@@ -0,0 +1,290 @@
+# Copyright (C) 2019-present eyeo GmbH
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Load generation for the object detection web service."""
+
+import bisect
+import concurrent.futures as cf
+import itertools
+import os
+import threading
+import time
+import urllib.parse as urlparse
+
+import numpy as np
+import requests
+
+import wentral.constants as const
+
+# Upper bounds of latency histogram buckets in milliseconds (the last bucket
+# is unbounded).
+LATENCY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+                   10000]
+
+
+class LoadTestResult:
+    """Statistics of a load test.
+
+    Attributes
+    ----------
+    latencies : list of float
+        Latencies of successful requests in seconds.
+    errors : dict of str -> int
+        Counts of failed requests by error message.
+    duration : float
+        Duration of the test in seconds.
+
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = {}
+        self.duration = None
+        self._lock = threading.Lock()
+
+    def add(self, latency):
+        """Record a successful request."""
+        with self._lock:
+            self.latencies.append(latency)
+
+    def add_error(self, error):
+        """Record a failed request."""
+        with self._lock:
+            message = str(error)
+            self.errors[message] = self.errors.get(message, 0) + 1
+
+    @property
+    def error_count(self):
+        return sum(self.errors.values())
+
+    @property
+    def request_count(self):
+        return len(self.latencies) + self.error_count
+
+    @property
+    def error_rate(self):
+        if self.request_count == 0:
+            return 0
+        return self.error_count / self.request_count
+
+    @property
+    def throughput(self):
+        """Number of successful requests per second."""
+        if not self.duration:
+            return 0
+        return len(self.latencies) / self.duration
+
+    def percentiles(self):
+        """Return latency percentiles of successful requests in seconds."""
+        if not self.latencies:
+            return {}
+        values = np.percentile(self.latencies, const.LATENCY_PERCENTILES)
+        ret = {
+            'p{}'.format(q): float(value)
+            for q, value in zip(const.LATENCY_PERCENTILES, values)
+        }
+        ret['max'] = max(self.latencies)
+        return ret
+
+    def histogram(self):
+        """Return the histogram of latencies of successful requests.
+
+        Returns
+        -------
+        histogram : list of (float, int)
+            Upper bound of each bucket in milliseconds (None for the last
+            bucket) and the number of requests with latency in the bucket.
+
+        """
+        counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        for latency in self.latencies:
+            counts[bisect.bisect_left(LATENCY_BUCKETS, latency * 1000)] += 1
+        return list(zip(LATENCY_BUCKETS + [None], counts))
+
+    def to_dict(self):
+        return {
+            'request_count': self.request_count,
+            'error_count': self.error_count,
+            'error_rate': self.error_rate,
+            'errors': self.errors,
+            'duration': self.duration,
+            'throughput': self.throughput,
+            'latency': self.percentiles(),
+            'histogram': [
+                {'le_ms': bound, 'count': count}
+                for bound, count in self.histogram()
+            ],
+        }
+
+
+class _RequestSource:
+    """Thread-safe source of request payloads taken from a dataset.
+
+    If neither `request_count` nor `duration` are given, each image of the
+    dataset is sent once. Otherwise the dataset is cycled until the number of
+    requests or the time limit is reached.
+
+    """
+
+    def __init__(self, dataset, request_count=None, duration=None):
+        self.dataset = dataset
+        self.deadline = None
+        if duration is not None:
+            self.deadline = time.perf_counter() + duration
+        if request_count is None and duration is None:
+            self._items = self._read(dataset)
+        else:
+            self._items = itertools.islice(self._cycle(), request_count)
+        self._lock = threading.Lock()
+
+    def _cycle(self):
+        """Yield the items of the dataset over and over again."""
+        while True:
+            empty = True
+            for item in self._read(self.dataset):
+                empty = False
+                yield item
+            if empty:
+                return
+
+    @staticmethod
+    def _read(dataset):
+        """Yield names and contents of image files in the dataset."""
+        for image, image_path, _ in dataset:
+            image_data = getattr(image, 'data', None)
+            image.close()  # We send the file as is.
+            if image_data is None:
+                with open(image_path, 'rb') as image_file:
+                    image_data = image_file.read()
+            yield os.path.basename(image_path), image_data
+
+    def next(self):
+        """Return the next (image_name, image_data) or None at the end."""
+        with self._lock:
+            if self.deadline is not None \
+                    and time.perf_counter() >= self.deadline:
+                return None
+            return next(self._items, None)
+
+
+def _send(session, url, image_name, image_data, params):
+    """Send one detection request and return detected boxes."""
+    response = session.post(url, files={'image': (image_name, image_data)},
+                            data=params)
+    response.raise_for_status()
+    return response.json()['boxes']
+
+
+def _closed_loop(url, source, concurrency, params, result):
+    """Run `concurrency` clients that each send requests back to back."""
+    def client():
+        session = requests.Session()
+        while True:
+            item = source.next()
+            if item is None:
+                return
+            start = time.perf_counter()
+            try:
+                _send(session, url, *item, params)
+            except Exception as err:
+                result.add_error(err)
+            else:
+                result.add(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def _open_loop(url, source, rate, concurrency, params, result):
+    """Send requests at a fixed rate regardless of the responses.
+
+    Latency is measured from the time when the request was scheduled to be
+    sent so that the delays caused by all `concurrency` clients being busy
+    are included.
+
+    """
+    local = threading.local()
+
+    def send(item, scheduled):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        try:
+            _send(local.session, url, *item, params)
+        except Exception as err:
+            result.add_error(err)
+        else:
+            result.add(time.perf_counter() - scheduled)
+
+    start = time.perf_counter()
+    with cf.ThreadPoolExecutor(concurrency) as executor:
+        for i in itertools.count():
+            scheduled = start + i / rate
+            time.sleep(max(0, scheduled - time.perf_counter()))
+            item = source.next()
+            if item is None:
+                break
+            executor.submit(send, item, scheduled)
+
+
+def run(server_url, dataset, concurrency=1, rate=None, request_count=None,
+        duration=None, **params):
+    """Send detection requests with images from a dataset to a web service.
+
+    Parameters
+    ----------
+    server_url : str
+        URL of the server where the web service (`wentral ws`) is running.
+    dataset : iterable of (image, image_path, expected_boxes)
+        Source of images.
+    concurrency : int
+        Number of clients that send requests in parallel.
+    rate : float
+        If given, the requests are sent at this rate (requests per second)
+        regardless of how fast they are served (open loop, `concurrency`
+        limits the number of requests in flight). Otherwise each client
+        sends the next request when it gets the response (closed loop).
+    request_count : int
+        Total number of requests to send.
+    duration : float
+        Time limit for sending requests in seconds. If neither `duration` nor
+        `request_count` are given, each image of the dataset is sent once.
+    params : dict
+        Parameters of detection requests (e.g. confidence_threshold).
+
+    Returns
+    -------
+    result : LoadTestResult
+        Statistics of the requests.
+
+    """
+    url = urlparse.urljoin(server_url, 'detect')
+    source = _RequestSource(dataset, request_count, duration)
+    result = LoadTestResult()
+
+    start = time.perf_counter()
+    if rate is None:
+        _closed_loop(url, source, concurrency, params, result)
+    else:
+        _open_loop(url, source, rate, concurrency, params, result)
+    result.duration = time.perf_counter() - start
+    return result
@@ -0,0 +1,102 @@
+# Copyright (C) 2019-present eyeo GmbH
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Non-maximum suppression of duplicate detections."""
+
+import numpy as np
+
+import wentral.utils as u
+
+
+def nms_indices(boxes, iou_threshold, confidence_threshold=None,
+                top_k=None):
+    """Select the detections that remain after non-maximum suppression.
+
+    The detections are processed in the order of decreasing confidence (the
+    ones with equal confidence keep their original order) and each of them is
+    dropped if its IoU with any already selected detection is at least
+    `iou_threshold`. For each selected detection the IoUs with all remaining
+    candidates are calculated at once and the suppressed candidates are
+    removed, so the work is proportional to the number of the selected
+    detections times the number of candidates.
+
+    Parameters
+    ----------
+    boxes : list of tuple (x0, y0, x1, y1, confidence, ...) or numpy.ndarray
+        Detections (the elements after the confidence are ignored).
+    iou_threshold : float
+        IoU (intersection over union) level at which two detections are
+        considered duplicates.
+    confidence_threshold : float
+        If given, detections with lower confidence are dropped before the
+        suppression.
+    top_k : int
+        If given, only this many detections with the highest confidence are
+        considered (this makes the suppression faster when there are many
+        low confidence detections but can change the result).
+
+    Returns
+    -------
+    indices : numpy.ndarray
+        Indices of the selected detections in `boxes` in the order of
+        decreasing confidence.
+
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=int)
+    if isinstance(boxes, np.ndarray):
+        coords = boxes[:, :4].astype(float)
+        scores = boxes[:, 4].astype(float)
+    else:
+        coords = np.array([box[:4] for box in boxes], dtype=float)
+        scores = np.array([box[4] for box in boxes], dtype=float)
+
+    order = np.argsort(-scores, kind='stable')
+    if confidence_threshold is not None:
+        order = order[scores[order] >= confidence_threshold]
+    if top_k is not None:
+        order = order[:top_k]
+
+    coords = coords[order]
+    candidates = np.arange(len(order))
+    picked = []
+    while len(candidates) > 0:
+        best, candidates = candidates[0], candidates[1:]
+        picked.append(best)
+        ious = u.iou_matrix(coords[best:best + 1], coords[candidates])[0]
+        candidates = candidates[~(ious >= iou_threshold)]
+
+    return order[picked]
+
+
+def nms(boxes, iou_threshold, confidence_threshold=None, top_k=None):
+    """Remove duplicate detections with non-maximum suppression.
+
+    See `nms_indices` for the description of the parameters.
+
+    Returns
+    -------
+    boxes : list
+        Selected detections (elements of `boxes`) in the order of decreasing
+        confidence.
+
+    """
+    indices = nms_indices(boxes, iou_threshold, confidence_threshold, top_k)
+    return [boxes[i] for i in indices]
@@ -0,0 +1,263 @@
+# Copyright (C) 2019-present eyeo GmbH
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Packed dataset format.
+
+Packed datasets store encoded images and their ground truth boxes in a few
+large shard files, so that reading the dataset doesn't require opening a
+file for each image. A shard file starts with `PACK_MAGIC`, followed by the
+offset of the JSON footer (8 bytes, little endian) and the data section. The
+footer, which ends the file, contains the description of the original
+dataset, the names of the images (relative to `images_path`) and the table
+of arrays (their dtypes, shapes and offsets relative to the start of the
+data section). The arrays are:
+
+- `images` -- Contents of the image files one after another (uint8).
+- `image_offsets` -- Offset of each image in `images` (with the total size
+  at the end).
+- `boxes` -- Ground truth boxes (x0, y0, x1, y1) of all images.
+- `box_offsets` -- Index of the first box of each image in `boxes` (with the
+  total number of boxes at the end).
+
+"""
+
+import json
+import mmap
+import os
+
+import numpy as np
+
+import wentral.constants as const
+
+PACK_MAGIC = b'WENTPCK\x01'
+PACK_EXTENSION = '.wpack'
+
+_ALIGNMENT = 64
+
+
+def _align(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def shard_paths(path):
+    """Return the paths of the shard files of a packed dataset.
+
+    Parameters
+    ----------
+    path : str
+        Path to a shard file or to a directory with shard files.
+
+    """
+    if os.path.isdir(path):
+        return sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.endswith(PACK_EXTENSION)
+        )
+    return [path]
+
+
+def is_packed(path):
+    """Check if the path is a packed dataset (or a shard of it)."""
+    return path.endswith(PACK_EXTENSION) or (
+        os.path.isdir(path) and shard_paths(path) != []
+    )
+
+
+class _ShardWriter:
+    """Writer of one shard file."""
+
+    def __init__(self, path):
+        self.out_file = open(path, 'wb')
+        self.out_file.write(PACK_MAGIC)
+        self.out_file.write(b'\0' * 8)  # Footer offset, written at the end.
+        self.data_start = _align(self.out_file.tell())
+        self.out_file.write(b'\0' * (self.data_start - self.out_file.tell()))
+        self.image_names = []
+        self.image_offsets = [0]
+        self.boxes = []
+        self.box_offsets = [0]
+
+    @property
+    def size(self):
+        return self.image_offsets[-1]
+
+    def add(self, image_name, image_data, boxes):
+        self.out_file.write(image_data)
+        self.image_names.append(image_name)
+        self.image_offsets.append(self.image_offsets[-1] + len(image_data))
+        self.boxes.extend(tuple(box[:4]) for box in boxes)
+        self.box_offsets.append(len(self.boxes))
+
+    def close(self, description, images_path):
+        arrays = {
+            'image_offsets': np.array(self.image_offsets, '<i8'),
+            'boxes': np.array(self.boxes, '<f8').reshape(-1, 4),
+            'box_offsets': np.array(self.box_offsets, '<i8'),
+        }
+        table = {'images': {'dtype': '|u1', 'shape': [self.size],
+                            'offset': 0}}
+        offset = _align(self.size)
+        for name, array in arrays.items():
+            self.out_file.write(b'\0' * (self.data_start + offset
+                                         - self.out_file.tell()))
+            self.out_file.write(array.tobytes())
+            table[name] = {'dtype': array.dtype.str,
+                           'shape': list(array.shape), 'offset': offset}
+            offset = _align(offset + array.nbytes)
+
+        footer_offset = self.out_file.tell()
+        self.out_file.write(json.dumps({
+            'dataset': description,
+            'images_path': images_path,
+            'image_names': self.image_names,
+            'arrays': table,
+        }).encode('utf-8'))
+        self.out_file.seek(len(PACK_MAGIC))
+        self.out_file.write(footer_offset.to_bytes(8, 'little'))
+        self.out_file.close()
+
+
+def write_pack(dataset, path, shard_size=const.PACK_SHARD_SIZE):
+    """Write a dataset in packed format.
+
+    The images are not decoded, the contents of the files are stored as is.
+
+    Parameters
+    ----------
+    dataset : iterable of (image, image_path, expected_boxes)
+        Dataset to pack (it must have `images_path` attribute).
+    path : str
+        Directory where the shard files are written (created if necessary).
+    shard_size : int
+        Approximate maximum size of the images in a shard in bytes (a shard
+        contains at least one image even if it's larger).
+
+    Returns
+    -------
+    shard_paths : list of str
+        Paths of the written shard files.
+
+    """
+    os.makedirs(path, exist_ok=True)
+    images_path = dataset.images_path
+    paths = []
+    writer = None
+
+    try:
+        for image, image_path, boxes in dataset:
+            image_data = _read_image(image, image_path)
+            if writer is not None and \
+                    writer.size + len(image_data) > shard_size:
+                writer.close(str(dataset), images_path)
+                writer = None
+            if writer is None:
+                paths.append(os.path.join(
+                    path, '{:05d}{}'.format(len(paths) + 1, PACK_EXTENSION),
+                ))
+                writer = _ShardWriter(paths[-1])
+            image_name = os.path.relpath(image_path, images_path)
+            writer.add(image_name, image_data, boxes)
+    finally:
+        if writer is not None:
+            writer.close(str(dataset), images_path)
+
+    return paths
+
+
+def _read_image(image, image_path):
+    """Return the content of the image file."""
+    data = getattr(image, 'data', None)
+    image.close()
+    if data is not None:
+        return data
+    with open(image_path, 'rb') as image_file:
+        return image_file.read()
+
+
+class PackFile:
+    """Shard file of a packed dataset.
+
+    The file is memory-mapped and the access to it is expected to be
+    sequential (this is communicated to the OS, so that it can read ahead).
+
+    Parameters
+    ----------
+    path : str
+        Path to the shard file.
+
+    Attributes
+    ----------
+    description : str
+        Description of the packed dataset.
+    images_path : str
+        Path to the directory of the packed dataset.
+    image_names : list of str
+        Names of the images (relative to `images_path`).
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as in_file:
+            if in_file.read(len(PACK_MAGIC)) != PACK_MAGIC:
+                raise Exception('{} is not a packed dataset file'
+                                .format(path))
+            footer_offset = int.from_bytes(in_file.read(8), 'little')
+            data_start = _align(in_file.tell())
+            in_file.seek(footer_offset)
+            footer = json.loads(in_file.read().decode('utf-8'))
+            self._mmap = mmap.mmap(in_file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+
+        if hasattr(self._mmap, 'madvise'):
+            self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+
+        self.description = footer['dataset']
+        self.images_path = footer['images_path']
+        self.image_names = footer['image_names']
+
+        # The offsets and the boxes are small, so they are copied.
+        self._arrays = {}
+        for name, info in footer['arrays'].items():
+            if name != 'images':
+                self._arrays[name] = np.frombuffer(
+                    self._mmap, dtype=np.dtype(info['dtype']),
+                    count=int(np.prod(info['shape'])),
+                    offset=data_start + info['offset'],
+                ).reshape(info['shape']).copy()
+        self._images_start = data_start + footer['arrays']['images']['offset']
+
+    def __len__(self):
+        return len(self.image_names)
+
+    def image_data(self, i):
+        """Return the content of the file of i-th image."""
+        offsets = self._arrays['image_offsets']
+        return self._mmap[self._images_start + offsets[i]:
+                          self._images_start + offsets[i + 1]]
+
+    def boxes(self, i):
+        """Return the ground truth boxes of i-th image."""
+        offsets = self._arrays['box_offsets']
+        return [tuple(box) for box in
+                self._arrays['boxes'][offsets[i]:offsets[i + 1]].tolist()]
+
+    def close(self):
+        self._mmap.close()
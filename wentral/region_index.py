@@ -0,0 +1,251 @@
+# Copyright (C) 2019-present eyeo GmbH
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Region index of a dataset with a persistent cache."""
+
+import csv
+import glob
+import json
+import logging
+import os
+import tempfile
+
+import admincer.index as idx
+
+# Name of the cache file (in the dataset directory).
+CACHE_FILE_NAME = '.wentral-index.json'
+# Version of the cache format (caches with other versions are ignored).
+CACHE_VERSION = 2
+
+
+def _stat(path):
+    """Return modification time (in ns) and size of a file (None if absent)."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class CachedRegionIndex(idx.RegionIndex):
+    """Region index that caches the regions of the images in a file.
+
+    The regions of each image are stored in the cache together with the
+    modification times and sizes of the image and its TXT region file. When
+    the index is loaded again, only the images for which these have changed
+    are opened and their region files parsed. If any CSV or .names file in
+    the dataset directory changes, the whole index is rebuilt.
+
+    The result is the same as with `admincer.index.reg_index()`.
+
+    Parameters
+    ----------
+    root_path : str
+        Path to the directory from which the index is loaded.
+    cache_path : str
+        Path to the cache file (by default `CACHE_FILE_NAME` in `root_path`).
+        If the cache can't be saved (e.g. because the dataset directory is
+        read-only), the index is still loaded.
+
+    Attributes
+    ----------
+    reloaded : list of str
+        Names of the images which regions were not found in the cache.
+    image_sizes : dict of str -> (int, int)
+        Width and height of each image.
+
+    """
+
+    def __init__(self, root_path, cache_path=None):
+        super().__init__(root_path)
+        self.cache_path = cache_path or os.path.join(root_path,
+                                                     CACHE_FILE_NAME)
+        self.reloaded = []
+        self.image_sizes = {}
+
+    def _global_stats(self):
+        """Return stats of the files that affect all the images."""
+        return {
+            os.path.basename(path): _stat(path)
+            for pattern in ['*.csv', '*.names']
+            for path in glob.glob(os.path.join(self.root_path, pattern))
+        }
+
+    def _read_cache(self):
+        """Return cached image entries if the cache is valid for the dataset.
+
+        Each entry contains `stats` of the image and its TXT file, `size` and
+        `regions` of the image.
+
+        """
+        try:
+            with open(self.cache_path, 'rt', encoding='utf-8') as cache_file:
+                cache = json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+        if (cache.get('version') != CACHE_VERSION
+                or cache.get('global') != self._global_stats()):
+            return {}
+        return cache['images']
+
+    def _write_cache(self, entries):
+        """Save the entries into the cache file (atomically)."""
+        data = json.dumps({
+            'version': CACHE_VERSION,
+            'global': self._global_stats(),
+            'images': entries,
+        }, sort_keys=True)
+        cache_dir = os.path.dirname(os.path.abspath(self.cache_path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, 'wt', encoding='utf-8') as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as err:
+            logging.warning('Failed to save region index cache: {}'
+                            .format(err))
+
+    def _scan_image_stats(self):
+        """Return the stats of all images and their TXT files."""
+        ret = {}
+        for dirpath, dirnames, filenames in os.walk(self.root_path):
+            names = set(filenames)
+            for filename in filenames:
+                if any(filename.endswith(ext)
+                       for ext in idx.IMAGE_EXTENSIONS):
+                    image_path = os.path.join(dirpath, filename)
+                    rel_path = os.path.relpath(image_path, self.root_path)
+                    txt_name = os.path.splitext(filename)[0] + '.txt'
+                    ret[rel_path] = [
+                        _stat(image_path),
+                        _stat(os.path.join(dirpath, txt_name))
+                        if txt_name in names else None,
+                    ]
+        return ret
+
+    def _load_csv_rows(self, image_names):
+        """Load regions of some images from the CSV files in root_path."""
+        csv_files = glob.glob(os.path.join(self.root_path, '*.csv'))
+        for csv_file in csv_files:
+            with open(csv_file, 'r', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    if row['image'] not in image_names:
+                        continue
+                    x1, y1, x2, y2 = [
+                        int(round(float(row[key])))
+                        for key in ['xmin', 'ymin', 'xmax', 'ymax']
+                    ]
+                    self[row['image']].append((x1, y1, x2, y2, row['label']))
+        return csv_files != []
+
+    def _load_txt(self, image_name):
+        """Load regions of an image from its TXT file (YOLO format)."""
+        if self[image_name] != []:
+            raise Exception('Regions specified twice for {}'
+                            .format(image_name))
+
+        width, height = self._get_image_size(image_name)
+        txt_path = os.path.join(self.root_path,
+                                os.path.splitext(image_name)[0] + '.txt')
+        with open(txt_path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                t, x, y, w, h = line.strip().split()
+                t = int(t)
+                if self.region_types is not None:
+                    t = self.region_types[t]
+                else:
+                    t = str(t)
+                x, y, w, h = map(float, [x, y, w, h])
+                x1 = int(round((x - w / 2) * width))
+                x2 = int(round((x + w / 2) * width))
+                y1 = int(round((y - h / 2) * height))
+                y2 = int(round((y + h / 2) * height))
+                self[image_name].append((x1, y1, x2, y2, t))
+
+    def _clip(self, image_name):
+        """Clip regions to the image boundaries and remove 0-area ones."""
+        width, height = self._get_image_size(image_name)
+        clipped_regions = []
+        for x1, y1, x2, y2, region_type in self[image_name]:
+            x1, x2 = [min(max(x, 0), width) for x in (x1, x2)]
+            y1, y2 = [min(max(y, 0), height) for y in (y1, y2)]
+            if x1 != x2 and y1 != y2:
+                clipped_regions.append((x1, y1, x2, y2, region_type))
+        self[image_name] = clipped_regions
+
+    def load(self):
+        """Load the index from .root_path (using the cache if possible)."""
+        self._load_region_types()
+        cached = self._read_cache()
+        stats = self._scan_image_stats()
+
+        for image_name, image_stats in stats.items():
+            entry = cached.get(image_name)
+            if entry is not None and entry['stats'] == image_stats:
+                self[image_name] = [tuple(r) for r in entry['regions']]
+                self.image_sizes[image_name] = tuple(entry['size'])
+            else:
+                self[image_name] = []
+                self.reloaded.append(image_name)
+
+        have_csv = self._load_csv_rows(set(self.reloaded))
+        have_txt = any(txt_stat for _, txt_stat in stats.values())
+        for image_name in self.reloaded:
+            if stats[image_name][1] is not None:
+                self._load_txt(image_name)
+
+        if self.region_types is None:
+            # Without a provided region types mapping the naming of regions
+            # loaded from CSV and TXT files will not be consistent.
+            if have_csv and have_txt:
+                raise Exception('A .names file is required to allow mixing of '
+                                '.csv and .txt regions files.')
+            self.region_types = sorted({
+                region_type
+                for regions in self.values()
+                for x1, y1, x2, y2, region_type in regions
+            })
+
+        for image_name in self.reloaded:
+            self._clip(image_name)
+            self.image_sizes[image_name] = self._get_image_size(image_name)
+
+        if self.reloaded or set(cached) != set(stats):
+            logging.debug('Regions of {} images loaded, {} cached'
+                          .format(len(self.reloaded),
+                                  len(stats) - len(self.reloaded)))
+            self._write_cache({
+                image_name: {'stats': image_stats,
+                             'size': self.image_sizes[image_name],
+                             'regions': self[image_name]}
+                for image_name, image_stats in stats.items()
+            })
+
+
+def reg_index(root_path, cache_path=None):
+    """Return the index of marked regions in the images (using the cache).
+
+    See `CachedRegionIndex` for the description of the parameters.
+
+    """
+    ret = CachedRegionIndex(root_path, cache_path)
+    ret.load()
+    return ret
@@ -0,0 +1,729 @@
+# Copyright (C) 2019-present eyeo GmbH
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Output of benchmark results in JSON, JSONL and binary formats.
+
+The binary format stores boxes in columnar arrays that are memory-mapped when
+the file is loaded, so the results for one image can be accessed without
+reading the rest of the file. The file starts with `BINARY_MAGIC`, followed
+by the length of the JSON header (8 bytes, little endian) and the header
+itself. The header contains the summary, image names, additional match IoUs
+and the table of arrays (their dtypes, shapes and offsets relative to the
+start of the data section that follows the header). The arrays are:
+
+- `detections` -- Detections of all images (x0, y0, x1, y1, confidence,
+  is_true) one after another.
+- `detection_offsets` -- Index of the first detection of each image in
+  `detections` (with the total number of detections at the end).
+- `ground_truth` and `ground_truth_offsets` -- The same for ground truth
+  boxes (x0, y0, x1, y1, confidence).
+- `iou_matches` -- Results of matching at additional IoUs: a row for each
+  detection and a column for each of the IoUs.
+- `images` -- Metrics, matching parameters and pixel count of each image.
+- `timings` -- Wall and CPU time of each stage (see
+  `const.BENCHMARK_STAGES`) for each image (NaN for skipped stages).
+
+"""
+
+import collections.abc
+import json
+import re
+import shutil
+import tempfile
+
+import numpy as np
+
+import wentral.constants as const
+
+BINARY_MAGIC = b'WENTRAL\x01'
+BINARY_EXTENSION = '.wbin'
+
+# Per-image metrics stored in binary files (unknown pixel count is -1).
+IMAGE_DTYPE = np.dtype([
+    ('tp', '<i8'), ('fn', '<i8'), ('fp', '<i8'),
+    ('precision', '<f8'), ('recall', '<f8'), ('f1', '<f8'),
+    ('confidence_threshold', '<f8'), ('match_iou', '<f8'),
+    ('pixels', '<i8'),
+])
+
+# Arrays in binary files start at offsets that are multiples of this.
+_ALIGNMENT = 64
+
+# Amount of text that is read at once when JSON files are parsed
+# incrementally (in characters).
+_CHUNK_SIZE = 1 << 20
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# Characters that can continue a number until the end of the buffer.
+_NUMBER_TAIL = re.compile(r'[0-9.eE+-]*\Z')
+_DECODER = json.JSONDecoder()
+
+
+def _is_jsonl(path):
+    return path.endswith('.jsonl')
+
+
+def is_binary(path):
+    """Check if the path refers to a results file in binary format."""
+    return path.endswith(BINARY_EXTENSION)
+
+
+def write_json(summary, records, out_file):
+    """Write benchmark results as a JSON object.
+
+    The summary keys come first and are followed by `images` array with one
+    image record per line, so the file can be produced and consumed one
+    record at a time.
+
+    Parameters
+    ----------
+    summary : dict
+        Overall results (see `Evaluation.summary_dict`).
+    records : iterable of str
+        Image records serialized as JSON (without line breaks).
+    out_file : file
+        Text file to write to.
+
+    """
+    out_file.write('{\n')
+    for key, value in sorted(summary.items()):
+        value_json = json.dumps(value, indent=2, sort_keys=True)
+        out_file.write('  {}: {},\n'.format(
+            json.dumps(key),
+            value_json.replace('\n', '\n  '),
+        ))
+
+    out_file.write('  "images": [')
+    separator = '\n    '
+    for record in records:
+        out_file.write(separator + record)
+        separator = ',\n    '
+    out_file.write('\n  ]\n}\n')
+
+
+def write_jsonl(summary, records, out_file):
+    """Write benchmark results in JSONL format.
+
+    The first line contains the summary and each following line contains one
+    image record. See `write_json` for the description of the parameters.
+
+    """
+    out_file.write(json.dumps(summary, sort_keys=True) + '\n')
+    for record in records:
+        out_file.write(record + '\n')
+
+
+def serialize(ms):
+    """Serialize the results for one image into a JSON line."""
+    return json.dumps(ms.to_dict(), sort_keys=True)
+
+
+def dump(summary, matchsets, out_file, jsonl=False):
+    """Write the summary and match sets in JSON or JSONL format."""
+    write = write_jsonl if jsonl else write_json
+    write(summary, (serialize(ms) for ms in matchsets), out_file)
+
+
+def _align(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def _dtype_to_json(dtype):
+    if dtype.names is None:
+        return dtype.str
+    return [[name, dtype.fields[name][0].str] for name in dtype.names]
+
+
+def _dtype_from_json(descr):
+    if isinstance(descr, str):
+        return np.dtype(descr)
+    return np.dtype([tuple(field) for field in descr])
+
+
+class _BinarySpool:
+    """Accumulator of match sets for writing them in binary format.
+
+    Boxes are written into temporary files as the match sets are added and
+    only a few numbers per image are kept in memory.
+
+    """
+
+    def __init__(self):
+        self._files = {
+            name: tempfile.TemporaryFile()
+            for name in ['detections', 'ground_truth', 'iou_matches']
+        }
+        self._dtypes = {}
+        self._counts = {name: 0 for name in self._files}
+        self.image_names = []
+        self.map_ious = None
+        self._images = []
+        self._timings = []
+        self._detection_offsets = [0]
+        self._ground_truth_offsets = [0]
+
+    def _append(self, name, array):
+        self._dtypes.setdefault(name, array.dtype)
+        self._files[name].write(np.ascontiguousarray(array).tobytes())
+        self._counts[name] += len(array)
+
+    def add_matchset(self, ms):
+        """Add the results for one image."""
+        if self.map_ious is None:
+            self.map_ious = sorted(ms.iou_matches)
+        self.image_names.append(ms.image_name)
+        image = {name: getattr(ms, name, None) for name in IMAGE_DTYPE.names}
+        if image['pixels'] is None:
+            image['pixels'] = -1
+        self._images.append(tuple(image.values()))
+        self._timings.append([
+            [ms.timings[stage][kind] if stage in ms.timings else np.nan
+             for kind in ['wall', 'cpu']]
+            for stage in const.BENCHMARK_STAGES
+        ])
+        self._append('detections', ms.detections)
+        self._append('ground_truth', ms.ground_truth)
+        if self.map_ious:
+            self._append('iou_matches', np.stack(
+                [ms.iou_matches[map_iou] for map_iou in self.map_ious],
+                axis=1,
+            ))
+        self._detection_offsets.append(self._counts['detections'])
+        self._ground_truth_offsets.append(self._counts['ground_truth'])
+
+    def write(self, summary, out_file):
+        """Write the summary and the results into a binary file."""
+        arrays = {
+            'images': np.array(self._images, dtype=IMAGE_DTYPE),
+            'timings': np.array(self._timings, dtype='<f8').reshape(
+                -1, len(const.BENCHMARK_STAGES), 2,
+            ),
+            'detection_offsets': np.array(self._detection_offsets, '<i8'),
+            'ground_truth_offsets': np.array(self._ground_truth_offsets,
+                                             '<i8'),
+        }
+        table = {}
+        offset = 0
+
+        for name in ['detections', 'ground_truth', 'iou_matches']:
+            if name not in self._dtypes:
+                continue
+            dtype = self._dtypes[name]
+            shape = [self._counts[name]]
+            if name == 'iou_matches':
+                shape.append(len(self.map_ious))
+            size = self._files[name].tell()
+            table[name] = {'dtype': _dtype_to_json(dtype), 'shape': shape,
+                           'offset': offset}
+            offset = _align(offset + size)
+
+        for name, array in arrays.items():
+            table[name] = {'dtype': _dtype_to_json(array.dtype),
+                           'shape': list(array.shape), 'offset': offset}
+            offset = _align(offset + array.nbytes)
+
+        header = json.dumps({
+            'summary': summary,
+            'image_names': self.image_names,
+            'map_ious': self.map_ious or [],
+            'stages': const.BENCHMARK_STAGES,
+            'arrays': table,
+        }).encode('utf-8')
+        out_file.write(BINARY_MAGIC)
+        out_file.write(len(header).to_bytes(8, 'little'))
+        out_file.write(header)
+
+        data_start = _align(out_file.tell())
+        for name, info in sorted(table.items(), key=lambda i: i[1]['offset']):
+            out_file.write(b'\0' * (data_start + info['offset']
+                                    - out_file.tell()))
+            if name in self._files:
+                self._files[name].seek(0)
+                shutil.copyfileobj(self._files[name], out_file)
+            else:
+                out_file.write(arrays[name].tobytes())
+
+    def close(self):
+        for spool_file in self._files.values():
+            spool_file.close()
+
+
+def write_binary(summary, matchsets, out_file):
+    """Write benchmark results in binary format.
+
+    Parameters
+    ----------
+    summary : dict
+        Overall results (see `Evaluation.summary_dict`).
+    matchsets : iterable of MatchSet
+        Results for individual images.
+    out_file : file
+        Binary file to write to.
+
+    """
+    spool = _BinarySpool()
+    try:
+        for ms in matchsets:
+            spool.add_matchset(ms)
+        spool.write(summary, out_file)
+    finally:
+        spool.close()
+
+
+class BinaryResults:
+    """Benchmark results loaded from a binary file.
+
+    The arrays are memory-mapped, so only the parts of the file that are
+    accessed are actually read.
+
+    Parameters
+    ----------
+    path : str
+        Path to the binary results file.
+
+    Attributes
+    ----------
+    summary : dict
+        Overall results.
+    image_names : list of str
+        Names of the images in the order of the results.
+    map_ious : list of float
+        Additional match IoUs (see `MatchSet.iou_matches`).
+    stages : list of str
+        Stages of image processing that have timing information.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as in_file:
+            if in_file.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+                raise Exception('{} is not a binary results file'
+                                .format(path))
+            header_size = int.from_bytes(in_file.read(8), 'little')
+            header = json.loads(in_file.read(header_size).decode('utf-8'))
+            data_start = _align(in_file.tell())
+
+        self.summary = header['summary']
+        self.image_names = header['image_names']
+        self.map_ious = header['map_ious']
+        self.stages = header['stages']
+        self._index = None
+
+        buf = np.memmap(path, dtype=np.uint8, mode='r')
+        self._arrays = {}
+        for name, info in header['arrays'].items():
+            dtype = _dtype_from_json(info['dtype'])
+            start = data_start + info['offset']
+            size = int(np.prod(info['shape'])) * dtype.itemsize
+            self._arrays[name] = (buf[start:start + size].view(dtype)
+                                  .reshape(info['shape']))
+
+    def __len__(self):
+        return len(self.image_names)
+
+    def index(self, image_name):
+        """Return the position of the image with this name."""
+        if self._index is None:
+            self._index = {name: i for i, name in enumerate(self.image_names)}
+        return self._index[image_name]
+
+    def _boxes(self, name, offsets_name, i):
+        offsets = self._arrays[offsets_name]
+        return self._arrays[name][offsets[i]:offsets[i + 1]]
+
+    def detections(self, i):
+        """Return the detections in i-th image as a structured array."""
+        return self._boxes('detections', 'detection_offsets', i)
+
+    def ground_truth(self, i):
+        """Return the ground truth of i-th image as a structured array."""
+        return self._boxes('ground_truth', 'ground_truth_offsets', i)
+
+    def record(self, i):
+        """Return the results for i-th image (like `MatchSet.to_dict()`)."""
+        ret = {'image_name': self.image_names[i]}
+        ret.update(zip(IMAGE_DTYPE.names, self._arrays['images'][i].tolist()))
+        if ret['pixels'] < 0:
+            ret['pixels'] = None
+        ret['timings'] = {
+            stage: {'wall': wall, 'cpu': cpu}
+            for stage, (wall, cpu) in zip(self.stages,
+                                          self._arrays['timings'][i].tolist())
+            if not np.isnan(wall)
+        }
+        ret['detections'] = self.detections(i).tolist()
+        ret['ground_truth'] = self.ground_truth(i).tolist()
+        iou_matches = self._boxes('iou_matches', 'detection_offsets', i) \
+            if self.map_ious else None
+        ret['iou_matches'] = {
+            map_iou: iou_matches[:, j].tolist()
+            for j, map_iou in enumerate(self.map_ious)
+        }
+        return ret
+
+
+class _BinaryRecords(collections.abc.Sequence):
+    """Image records of binary results that are loaded on access."""
+
+    def __init__(self, binary_results):
+        self.binary_results = binary_results
+
+    def __len__(self):
+        return len(self.binary_results)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('Image index out of range: {}'.format(i))
+        return self.binary_results.record(i)
+
+
+class BinaryDetections(collections.abc.Mapping):
+    """Mapping from image names to detections in binary results.
+
+    The detections are returned as lists of [x0, y0, x1, y1, confidence].
+
+    """
+
+    def __init__(self, binary_results):
+        self.binary_results = binary_results
+
+    def __len__(self):
+        return len(self.binary_results)
+
+    def __iter__(self):
+        return iter(self.binary_results.image_names)
+
+    def __getitem__(self, image_name):
+        detections = self.binary_results.detections(
+            self.binary_results.index(image_name),
+        )
+        return [list(d[:5]) for d in detections.tolist()]
+
+
+def load(path):
+    """Load benchmark results from a JSON, JSONL or binary file.
+
+    Returns
+    -------
+    results : dict
+        Benchmark results in the same format as `Evaluation.to_dict()`. For
+        binary files `images` is a sequence that reads the records of the
+        images on access.
+
+    """
+    if is_binary(path):
+        binary_results = BinaryResults(path)
+        results = dict(binary_results.summary)
+        results['images'] = _BinaryRecords(binary_results)
+        return results
+
+    with open(path, 'rt', encoding='utf-8') as in_file:
+        if not _is_jsonl(path):
+            return json.load(in_file)
+        results = json.loads(in_file.readline())
+        results['images'] = [json.loads(line) for line in in_file if line]
+        return results
+
+
+class _JsonReader:
+    """Incremental reader of JSON values from a text file.
+
+    The file is read in chunks and only the part of it that is not parsed yet
+    is kept in memory. The byte offsets of the values in the file are
+    tracked, so they could be read again later.
+
+    """
+
+    def __init__(self, in_file, chunk_size=_CHUNK_SIZE):
+        self.in_file = in_file
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.byte_pos = 0
+
+    def _advance(self, end):
+        consumed = self.buffer[self.pos:end]
+        if not consumed.isascii():
+            consumed = consumed.encode('utf-8')
+        self.byte_pos += len(consumed)
+        self.pos = end
+
+    def _fill(self):
+        """Read more of the file, return False at the end of it."""
+        # Read at least as much as we have to keep the parsing of long values
+        # linear.
+        size = max(self.chunk_size, len(self.buffer) - self.pos)
+        chunk = self.in_file.read(size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Skip whitespace and return the next character ('' at the end)."""
+        while True:
+            self._advance(_WHITESPACE.match(self.buffer, self.pos).end())
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, chars):
+        """Read one of the `chars` (after whitespace) and return it."""
+        char = self.peek()
+        if char == '' or char not in chars:
+            raise ValueError('Expected {} at byte {} of {}'.format(
+                ' or '.join(map(repr, chars)), self.byte_pos,
+                self.in_file.name,
+            ))
+        self._advance(self.pos + 1)
+        return char
+
+    def value(self):
+        """Read the next value.
+
+        Returns
+        -------
+        value : object
+            Parsed value.
+        offset : int
+            Byte offset of the value in the file.
+        size : int
+            Size of the value in the file in bytes.
+
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue  # The value continues in the next chunk.
+                raise
+            # A number that reaches the end of the buffer might continue in
+            # the next chunk (e.g. "0." is parsed as 0).
+            if not _NUMBER_TAIL.match(self.buffer, end) or not self._fill():
+                break
+        offset = self.byte_pos
+        self._advance(end)
+        return value, offset, self.byte_pos - offset
+
+
+def _scan_json(in_file):
+    """Yield the summary items and the image records of JSON results.
+
+    See `_scan` for the description of the output.
+
+    """
+    reader = _JsonReader(in_file, _CHUNK_SIZE)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key, _, _ = reader.value()
+        if not isinstance(key, str):
+            raise ValueError('Invalid key in {}: {!r}'.format(in_file.name,
+                                                              key))
+        reader.expect(':')
+        if key == 'images':
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.expect(']')
+            else:
+                while True:
+                    yield (key,) + reader.value()
+                    if reader.expect(',]') == ']':
+                        break
+        else:
+            yield (key,) + reader.value()
+        if reader.expect(',}') == '}':
+            return
+
+
+def _scan_jsonl(in_file):
+    """Yield the summary items and the image records of JSONL results."""
+    offset = 0
+    for i, line in enumerate(in_file):
+        if i == 0:
+            for key, value in json.loads(line).items():
+                yield key, value, None, None
+        elif line.strip():
+            yield 'images', json.loads(line), offset, len(line)
+        offset += len(line)
+
+
+def _scan(path):
+    """Parse JSON or JSONL results incrementally.
+
+    Yields
+    ------
+    item : (str, object, int, int)
+        Summary keys with their values and then (key `images`) the image
+        records, one by one, with their byte offsets and sizes in the file.
+
+    """
+    if _is_jsonl(path):
+        with open(path, 'rb') as in_file:
+            yield from _scan_jsonl(in_file)
+    else:
+        with open(path, 'rt', encoding='utf-8', newline='') as in_file:
+            yield from _scan_json(in_file)
+
+
+def read_summary(path, keys=None):
+    """Load the summary of benchmark results without the image records.
+
+    Parameters
+    ----------
+    path : str
+        Path to a JSON, JSONL or binary results file.
+    keys : list of str
+        If these keys are found before the image records, the rest of the
+        file is not read (by default all keys are read, which requires
+        parsing all the records when the file is in JSON format).
+
+    Returns
+    -------
+    summary : dict
+        Overall results.
+
+    """
+    if is_binary(path):
+        return dict(BinaryResults(path).summary)
+
+    summary = {}
+    for key, value, _, _ in _scan(path):
+        if key != 'images':
+            summary[key] = value
+        elif keys is not None and all(k in summary for k in keys):
+            break
+    return summary
+
+
+def iter_records(path):
+    """Yield the image records of benchmark results one by one.
+
+    Unlike `load`, this only keeps one record in memory at a time.
+
+    Parameters
+    ----------
+    path : str
+        Path to a JSON, JSONL or binary results file.
+
+    Yields
+    ------
+    record : dict
+        Results for one image (like `MatchSet.to_dict()`).
+
+    """
+    if is_binary(path):
+        yield from _BinaryRecords(BinaryResults(path))
+        return
+
+    for key, record, _, _ in _scan(path):
+        if key == 'images':
+            yield record
+
+
+class JsonDetections(collections.abc.Mapping):
+    """Mapping from image names to detections in JSON or JSONL results.
+
+    The file is parsed once to find the byte offsets of the image records and
+    then only the record of the requested image is read and parsed. The
+    detections are returned as lists of [x0, y0, x1, y1, confidence].
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._index = {
+            record['image_name']: (offset, size)
+            for key, record, offset, size in _scan(path)
+            if key == 'images'
+        }
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __getitem__(self, image_name):
+        offset, size = self._index[image_name]
+        with open(self.path, 'rb') as in_file:
+            in_file.seek(offset)
+            record = json.loads(in_file.read(size).decode('utf-8'))
+        return [d[:5] for d in record['detections']]
+
+
+class ResultsWriter:
+    """Writer of benchmark results that doesn't keep them in memory.
+
+    The results for individual images are added as they are produced and are
+    spooled into temporary files. When the evaluation is complete, `write`
+    outputs the summary followed by the image records.
+
+    Parameters
+    ----------
+    path : str
+        Path to the output file. If it ends with `.jsonl`, the output is in
+        JSONL format, if it ends with `BINARY_EXTENSION`, the output is in
+        binary format, otherwise it's in JSON format.
+    include_sweep : bool
+        Include the metrics at all confidence thresholds and the threshold
+        with the best F1 (see `Evaluation.summary_dict`).
+
+    """
+
+    def __init__(self, path, include_sweep=False):
+        self.path = path
+        self.include_sweep = include_sweep
+        if is_binary(path):
+            self._spool = _BinarySpool()
+        else:
+            self._spool = tempfile.TemporaryFile('w+t', encoding='utf-8')
+
+    def add_matchset(self, ms):
+        """Add the results for one image."""
+        if is_binary(self.path):
+            self._spool.add_matchset(ms)
+        else:
+            self._spool.write(serialize(ms) + '\n')
+
+    def write(self, evaluation):
+        """Write the results into the output file."""
+        summary = evaluation.summary_dict(self.include_sweep)
+        if is_binary(self.path):
+            with open(self.path, 'wb') as out_file:
+                self._spool.write(summary, out_file)
+        else:
+            self._spool.seek(0)
+            records = (line.rstrip('\n') for line in self._spool)
+            write = write_jsonl if _is_jsonl(self.path) else write_json
+            with open(self.path, 'wt', encoding='utf-8') as out_file:
+                write(summary, records, out_file)
+        self.close()
+
+    def close(self):
+        self._spool.close()
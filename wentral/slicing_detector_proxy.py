@@ -75,6 +75,12 @@ class SlicingDetectorProxy(det.Detector):
             slice_overlap=slice_overlap,
         )
 
+    @property
+    def input_size(self):
+        # Slices are as wide as the image (for tall images), so reducing the
+        # whole image is the same as reducing each slice.
+        return getattr(self.detector, 'input_size', None)
+
     @classmethod
     def _slice_boxes(cls, image_size, slicing_threshold, slice_overlap):
         """Calculate slice positions (to pass to image.crop())."""
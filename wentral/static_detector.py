@@ -36,6 +36,8 @@ class StaticDetector(det.Detector, ds.LabeledDataset):
 
     """
 
+    needs_pixels = False
+
     def __init__(self, path):
         det.Detector.__init__(self, path=path)
         ds.LabeledDataset.__init__(self, path)
@@ -20,6 +20,8 @@
 
 """Common utilities."""
 
+import numpy as np
+
 # Add this to a possibly zero-valued denominator to avoid division by zero.
 EPSILON = 1e-7
 
@@ -67,7 +69,142 @@ def iou(box1, box2):
     return int_area / (area(box1) + area(box2) - int_area + EPSILON)
 
 
+def _box_array(boxes):
+    """Convert a list of boxes (possibly with extra fields) to an array."""
+    if isinstance(boxes, np.ndarray) and boxes.ndim == 2:
+        return boxes[:, :4].astype(float, copy=False)
+    if len(boxes) == 0:
+        return np.zeros((0, 4))
+    return np.array([box[:4] for box in boxes], dtype=float)
+
+
+def iou_matrix(boxes1, boxes2):
+    """Calculate intersection over union of all pairs of boxes.
+
+    This is a vectorized version of `iou` that produces exactly the same
+    values (the arithmetic is performed in the same order).
+
+    Parameters
+    ----------
+    boxes1 : list of tuple (x0, y0, x1, y1, ...)
+        First list of boxes (only the first 4 elements of each are used).
+    boxes2 : list of tuple (x0, y0, x1, y1, ...)
+        Second list of boxes.
+
+    Returns
+    -------
+    ious : numpy.ndarray
+        Array of shape (len(boxes1), len(boxes2)) where element [i, j] is
+        `iou(boxes1[i], boxes2[j])`.
+
+    """
+    b1 = _box_array(boxes1)
+    b2 = _box_array(boxes2)
+
+    x0 = np.maximum(b1[:, None, 0], b2[None, :, 0])
+    y0 = np.maximum(b1[:, None, 1], b2[None, :, 1])
+    x1 = np.minimum(b1[:, None, 2], b2[None, :, 2])
+    y1 = np.minimum(b1[:, None, 3], b2[None, :, 3])
+    int_area = np.where((x0 > x1) | (y0 > y1), 0, (x1 - x0) * (y1 - y0))
+
+    area1 = (b1[:, 2] - b1[:, 0]) * (b1[:, 3] - b1[:, 1])
+    area2 = (b2[:, 2] - b2[:, 0]) * (b2[:, 3] - b2[:, 1])
+    union = area1[:, None] + area2[None, :] - int_area + EPSILON
+    return int_area / union
+
+
 def xy_swap(box):
     """Swap x and y coordinates in a box."""
     x0, y0, x1, y1 = box[:4]
     return (y0, x0, y1, x1) + box[4:]
+
+
+# Key of `PIL.Image.info` where the size of images decoded at reduced
+# resolution (by `load_reduced`) before the reduction is stored.
+ORIGINAL_SIZE_KEY = 'wentral.original_size'
+
+# Image modes where pixel values can be averaged by `PIL.Image.reduce`
+# (others, e.g. palette images, are converted to RGB before reduction).
+_REDUCIBLE_MODES = {'L', 'LA', 'La', 'RGB', 'RGBA', 'RGBa', 'CMYK', 'YCbCr',
+                    'LAB', 'HSV', 'I', 'F'}
+
+
+def load_reduced(image, input_size=None):
+    """Decode the image at reduced resolution if the detector allows it.
+
+    The image is reduced by the largest integer factor that keeps it at least
+    as big as `input_size` in both dimensions, so that the detector that
+    scales the images to `input_size` gets the same amount of detail. JPEG
+    images are decoded at reduced scale directly, other formats are reduced
+    after decoding (images in modes that can't be reduced, such as palette
+    images, are converted to RGB first). If the image is reduced, its
+    original size is saved in `image.info[ORIGINAL_SIZE_KEY]` (see
+    `scale_boxes`).
+
+    Parameters
+    ----------
+    image : PIL.Image
+        Image that is not decoded yet (already decoded images are not
+        reduced).
+    input_size : (int, int)
+        Input width and height of the detector (if None, the image is decoded
+        at full resolution).
+
+    Returns
+    -------
+    image : PIL.Image
+        Decoded image.
+
+    """
+    width, height = image.size
+    if input_size is not None and getattr(image, 'tile', None):
+        in_width, in_height = input_size
+        factor = min(width // in_width, height // in_height)
+        if factor > 1:
+            image.draft(None, (width // factor, height // factor))
+            image.load()
+            # Draft mode might reduce the image less than we can.
+            factor = min(image.size[0] // in_width,
+                         image.size[1] // in_height)
+            if factor > 1:
+                if image.mode not in _REDUCIBLE_MODES:
+                    image = image.convert('RGB')
+                image = image.reduce(factor)
+    image.load()
+    if image.size != (width, height):
+        image.info[ORIGINAL_SIZE_KEY] = (width, height)
+    return image
+
+
+def original_size(image):
+    """Return the size of the image before reduction by `load_reduced`."""
+    return image.info.get(ORIGINAL_SIZE_KEY, image.size)
+
+
+def scale_boxes(boxes, image):
+    """Scale boxes detected in reduced image to its original size.
+
+    Parameters
+    ----------
+    boxes : list of tuple (x0, y0, x1, y1, ...)
+        Boxes in the coordinates of the image (the elements after the
+        coordinates are kept as is).
+    image : PIL.Image
+        Image that was possibly reduced by `load_reduced`.
+
+    Returns
+    -------
+    boxes : list of tuple
+        Boxes in the coordinates of the original image.
+
+    """
+    if ORIGINAL_SIZE_KEY not in image.info:
+        return boxes
+    width, height = image.info[ORIGINAL_SIZE_KEY]
+    x_scale = width / image.size[0]
+    y_scale = height / image.size[1]
+    return [
+        (box[0] * x_scale, box[1] * y_scale, box[2] * x_scale,
+         box[3] * y_scale) + tuple(box[4:])
+        for box in boxes
+    ]
@@ -30,6 +30,8 @@ import flask
 import PIL
 import psutil
 
+import wentral.utils as u
+
 
 class RequestData:
     """Information about a request to the web service."""
@@ -135,6 +137,10 @@ def make_app(detector):
             image_file = flask.request.files['image']
             image_name = request_data.image_name = image_file.filename
             image = PIL.Image.open(image_file)
+            # Decode large images at reduced resolution if the detector is
+            # going to scale them down anyway.
+            image = u.load_reduced(image, getattr(app.detector, 'input_size',
+                                                  None))
             if image.mode != 'RGB':
                 image = image.convert('RGB')
 
@@ -150,6 +156,7 @@ def make_app(detector):
             logging.debug('RSS before detection: %d', _mem_rss())
             request_data.to_detect()
             boxes = app.detector.detect(image, image_name, **kw)
+            boxes = u.scale_boxes(boxes, image)
             request_data.to_response()
             det_time = request_data.end_t - request_data.detect_t
             logging.info('Found {} objects in {} seconds'.format(len(boxes),
@@ -157,7 +164,7 @@ def make_app(detector):
             logging.debug('RSS after detection: %d', _mem_rss())
 
             response_body = json.dumps({
-                'size': image.size,
+                'size': u.original_size(image),
                 'boxes': boxes,
                 'detection_time': det_time,
             })